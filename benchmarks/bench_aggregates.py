@@ -0,0 +1,56 @@
+"""
+Compare the NumPy and the pure Python implementation of fn:sum, fn:avg, fn:min and fn:max
+over a large sequence of facts.
+
+Run from the root of the repository:
+    python -m benchmarks.bench_aggregates
+"""
+import random
+import timeit
+
+from lxml import etree
+
+from src.xpyth_parser.conversion import vectorized
+from src.xpyth_parser.conversion.function import fn_sum, fn_avg, fn_min, fn_max
+
+NUMBER_OF_FACTS = 200000
+REPEAT = 5
+
+
+def create_facts(number_of_facts):
+    root = etree.Element("xbrl")
+    for _ in range(number_of_facts):
+        fact = etree.SubElement(root, "Revenue")
+        fact.text = str(random.randint(-10 ** 9, 10 ** 9))
+
+    return root.xpath("//Revenue")
+
+
+def run_benchmark():
+    facts = create_facts(NUMBER_OF_FACTS)
+    numpy_module = vectorized.numpy
+
+    print(f"Aggregating {NUMBER_OF_FACTS} facts, best of {REPEAT} runs")
+    for function in [fn_sum, fn_avg, fn_min, fn_max]:
+        timings = {}
+        for label, module in [("python", None), ("numpy", numpy_module)]:
+            if label == "numpy" and module is None:
+                continue
+
+            vectorized.numpy = module
+            try:
+                timings[label] = min(timeit.repeat(lambda: function(facts), number=1, repeat=REPEAT))
+            finally:
+                vectorized.numpy = numpy_module
+
+        line = ", ".join(f"{label}: {seconds * 1000:.1f} ms" for label, seconds in timings.items())
+        if len(timings) == 2:
+            line += f" (speedup {timings['python'] / timings['numpy']:.1f}x)"
+        print(f"{function.__name__}: {line}")
+
+    if numpy_module is None:
+        print("NumPy is not installed, only the pure Python implementation was measured")
+
+
+if __name__ == "__main__":
+    run_benchmark()
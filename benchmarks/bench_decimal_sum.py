@@ -0,0 +1,76 @@
+"""
+Compare fn:sum over a large sequence of monetary facts in the default (floating point) mode and in decimal mode.
+In decimal mode, the sum is computed with scaled integers, with NumPy (if installed) and with pure Python.
+Summing Decimal objects one by one is measured as reference.
+
+Run from the root of the repository:
+    python -m benchmarks.bench_decimal_sum
+"""
+import random
+import timeit
+from decimal import Decimal
+
+from lxml import etree
+
+from src.xpyth_parser.conversion import vectorized
+from src.xpyth_parser.conversion.decimals import exact_sum
+from src.xpyth_parser.conversion.frame import EvaluationFrame
+from src.xpyth_parser.conversion.function import fn_sum
+
+NUMBER_OF_FACTS = 100000
+REPEAT = 5
+
+
+def create_facts(number_of_facts):
+    root = etree.Element("xbrl")
+    for _ in range(number_of_facts):
+        fact = etree.SubElement(root, "Revenue")
+        fact.text = f"{random.randint(-10 ** 9, 10 ** 9) / 100:.2f}"
+
+    return root.xpath("//Revenue")
+
+
+def sum_floats(facts):
+    with EvaluationFrame():
+        return fn_sum(facts)
+
+
+def sum_decimals(facts):
+    with EvaluationFrame(decimal_mode=True):
+        return fn_sum(facts)
+
+
+def sum_decimal_objects(facts):
+    return exact_sum([Decimal(fact.text) for fact in facts])
+
+
+def run_benchmark():
+    facts = create_facts(NUMBER_OF_FACTS)
+    numpy_module = vectorized.numpy
+
+    def measure(function):
+        return min(timeit.repeat(lambda: function(facts), number=1, repeat=REPEAT))
+
+    timings = {"float": measure(sum_floats)}
+
+    if numpy_module is not None:
+        timings["decimal mode, numpy"] = measure(sum_decimals)
+
+    vectorized.numpy = None
+    try:
+        timings["decimal mode, python"] = measure(sum_decimals)
+    finally:
+        vectorized.numpy = numpy_module
+
+    timings["Decimal objects"] = measure(sum_decimal_objects)
+
+    print(f"Summing {NUMBER_OF_FACTS} monetary facts, best of {REPEAT} runs")
+    for label, seconds in timings.items():
+        print(f"{label}: {seconds * 1000:.1f} ms ({seconds / timings['float']:.1f}x float)")
+
+    if numpy_module is None:
+        print("NumPy is not installed, decimal mode was only measured with pure Python")
+
+
+if __name__ == "__main__":
+    run_benchmark()
@@ -0,0 +1,48 @@
+"""
+Compare looking up the elements of //prefix:concept paths in an ElementIndex with querying them from the tree,
+for an instance of a million elements.
+
+Run from the root of the repository:
+    python -m benchmarks.bench_element_index
+"""
+import time
+
+from benchmarks.documents import create_document
+from src.xpyth_parser.parse import Parser
+
+NUMBER_OF_ELEMENTS = 1000000
+NUMBER_OF_CONCEPTS = 1000
+NUMBER_OF_ASSERTIONS = 200
+
+
+def evaluate_assertions(parsers, document):
+    start = time.perf_counter()
+    outcomes = [parser.evaluate(xml=document) for parser in parsers]
+    return time.perf_counter() - start, outcomes
+
+
+def run_benchmark():
+    document = create_document(NUMBER_OF_ELEMENTS, NUMBER_OF_CONCEPTS)
+    parsers = [Parser(f"sum(//ns:Concept{i}) > 0", no_resolve=True) for i in range(NUMBER_OF_ASSERTIONS)]
+
+    print(f"{NUMBER_OF_ASSERTIONS} assertions on //ns:Concept paths, {NUMBER_OF_ELEMENTS} elements")
+
+    scan_seconds, scan_outcomes = evaluate_assertions(parsers, document)
+    print(f"tree scans: {scan_seconds * 1000:.0f} ms ({scan_seconds / NUMBER_OF_ASSERTIONS * 1000:.1f} ms per path)")
+
+    start = time.perf_counter()
+    document.build_index()
+    build_seconds = time.perf_counter() - start
+    print(f"index build: {build_seconds * 1000:.0f} ms")
+
+    index_seconds, index_outcomes = evaluate_assertions(parsers, document)
+    print(f"index lookups: {index_seconds * 1000:.0f} ms ({index_seconds / NUMBER_OF_ASSERTIONS * 1000:.2f} ms per path)")
+    assert index_outcomes == scan_outcomes
+
+    total = build_seconds + index_seconds
+    print(f"speedup including the index build: {scan_seconds / total:.1f}x, "
+          f"index pays off after {build_seconds / (scan_seconds / NUMBER_OF_ASSERTIONS):.0f} paths")
+
+
+if __name__ == "__main__":
+    run_benchmark()
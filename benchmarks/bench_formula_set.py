@@ -0,0 +1,50 @@
+"""
+Compare evaluating a set of assertions with a FormulaSet, which finds the elements of all their simple paths in one
+walk over the instance, with evaluating every assertion on its own, which walks the instance for every path.
+
+Run from the root of the repository:
+    python -m benchmarks.bench_formula_set
+"""
+import time
+
+from benchmarks.documents import create_document
+from src.xpyth_parser.grammar.prefetch import FormulaSet
+from src.xpyth_parser.parse import Parser
+
+NUMBER_OF_ELEMENTS = 100000
+NUMBER_OF_CONCEPTS = 1000
+NUMBER_OF_ASSERTIONS = 1000
+
+
+def run_benchmark():
+    document = create_document(NUMBER_OF_ELEMENTS, NUMBER_OF_CONCEPTS)
+    parsers = [
+        Parser(f"sum(//ns:Concept{i % NUMBER_OF_CONCEPTS}) >= count(/xbrl/ns:Concept{(i + 1) % NUMBER_OF_CONCEPTS})",
+               no_resolve=True)
+        for i in range(NUMBER_OF_ASSERTIONS)
+    ]
+    formula_set = FormulaSet(parsers)
+
+    print(f"{NUMBER_OF_ASSERTIONS} assertions with {len(formula_set.paths)} distinct paths, "
+          f"{NUMBER_OF_ELEMENTS} elements")
+
+    start = time.perf_counter()
+    separate_outcomes = [parser.evaluate(xml=document) for parser in parsers]
+    separate_seconds = time.perf_counter() - start
+    print(f"a walk per path: {separate_seconds * 1000:.0f} ms")
+
+    start = time.perf_counter()
+    prefetched_paths = formula_set.prefetch(document)
+    walk_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    set_outcomes = [parser.evaluate(xml=document, prefetched_paths=prefetched_paths) for parser in parsers]
+    set_seconds = time.perf_counter() - start
+    print(f"one walk: {walk_seconds * 1000:.0f} ms, evaluation: {set_seconds * 1000:.0f} ms")
+    assert set_outcomes == separate_outcomes
+
+    print(f"speedup: {separate_seconds / (walk_seconds + set_seconds):.1f}x")
+
+
+if __name__ == "__main__":
+    run_benchmark()
@@ -0,0 +1,59 @@
+"""
+Compare the set operations on node sequences with list based set operations, for a large number of facts.
+
+Run from the root of the repository:
+    python -m benchmarks.bench_node_sets
+"""
+import timeit
+
+from lxml import etree
+
+from src.xpyth_parser.conversion.nodesets import union, intersect, except_
+
+NUMBER_OF_FACTS = 20000
+REPEAT = 3
+
+
+def create_facts(number_of_facts):
+    root = etree.Element("xbrl")
+    for i in range(number_of_facts):
+        etree.SubElement(root, "fact", dimension="a" if i % 2 == 0 else "b")
+
+    return root.xpath("//fact"), root.xpath("//fact[@dimension = 'a']")
+
+
+def list_union(left, right):
+    nodes = list(left)
+    for node in right:
+        if node not in nodes:
+            nodes.append(node)
+    return nodes
+
+
+def list_intersect(left, right):
+    return [node for node in left if node in right]
+
+
+def list_except(left, right):
+    return [node for node in left if node not in right]
+
+
+def run_benchmark():
+    facts, dimension_facts = create_facts(NUMBER_OF_FACTS)
+
+    print(f"Set operations on {NUMBER_OF_FACTS} and {len(dimension_facts)} facts, best of {REPEAT} runs")
+    for name, node_set_operation, list_operation in [
+        ("union", union, list_union),
+        ("intersect", intersect, list_intersect),
+        ("except", except_, list_except),
+    ]:
+        timings = {}
+        for label, operation in [("node sets", node_set_operation), ("lists", list_operation)]:
+            timings[label] = min(timeit.repeat(lambda: operation(facts, dimension_facts), number=1, repeat=REPEAT))
+
+        line = ", ".join(f"{label}: {seconds * 1000:.1f} ms" for label, seconds in timings.items())
+        print(f"{name}: {line} (speedup {timings['lists'] / timings['node sets']:.0f}x)")
+
+
+if __name__ == "__main__":
+    run_benchmark()
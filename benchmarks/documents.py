@@ -0,0 +1,17 @@
+"""
+Documents the benchmarks are run against
+"""
+from lxml import etree
+
+from src.xpyth_parser.conversion.document import Document
+
+
+def create_document(number_of_elements, number_of_concepts):
+    """
+    Instance with the given number of facts, spread evenly over the concepts ns:Concept0, ns:Concept1, ...
+    """
+    root = etree.Element("xbrl", nsmap={"ns": "http://example"})
+    for i in range(number_of_elements):
+        etree.SubElement(root, f"{{http://example}}Concept{i % number_of_concepts}", contextRef="c1").text = str(i)
+
+    return Document.from_tree(root)
@@ -0,0 +1,109 @@
+"""
+Aggregates that are kept up to date while values are added, one at a time.
+
+Facts of a filing can arrive as a stream. Instead of summing all values of a path again after every new fact,
+the count, sum, minimum and maximum of the path are updated with the value of each new fact.
+"""
+from decimal import Decimal, localcontext, MAX_PREC
+
+from .decimals import promote_operands
+from .frame import in_decimal_mode
+
+
+class RunningAggregate:
+    def __init__(self):
+        """
+        Count, sum, minimum and maximum of the values that were added so far.
+        Sums are computed as fn:sum does: sums of decimals are exact, and a decimal added to a double gives a double.
+        """
+        self.count = 0
+        self.total = 0
+        self.minimum = None
+        self.maximum = None
+        # Integers and decimals compared with doubles are promoted to double, as in fn:min and fn:max
+        self.doubles = False
+
+        # Error of adding a value that can not be summed or compared, raised when the sum, minimum or maximum is used
+        self.sum_error = None
+        self.compare_error = None
+
+    def add(self, value):
+        """
+        Add a (atomized) value
+        """
+        self.count += 1
+        if isinstance(value, float):
+            self.doubles = True
+
+        if self.sum_error is None:
+            try:
+                if isinstance(value, Decimal):
+                    with localcontext() as context:
+                        # Sums of decimals are exact
+                        context.prec = MAX_PREC
+                        self.total = self.total + value
+                else:
+                    self.total = self.total + value
+            except TypeError:
+                # A decimal and a double are added as doubles
+                total, promoted = promote_operands(self.total, value)
+                try:
+                    self.total = total + promoted
+                except TypeError as error:
+                    self.sum_error = error
+
+        if self.compare_error is None:
+            try:
+                if self.minimum is None or value < self.minimum:
+                    self.minimum = value
+                if self.maximum is None or value > self.maximum:
+                    self.maximum = value
+            except TypeError as error:
+                self.compare_error = error
+
+    def add_count(self):
+        """
+        Count a value without its content, for aggregates of which only the count is used (fn:count, fn:exists and
+        fn:empty)
+        """
+        self.count += 1
+
+    def __len__(self):
+        return self.count
+
+    def sum(self):
+        if self.sum_error is not None:
+            raise self.sum_error
+        return self.total
+
+    def avg(self):
+        """
+        Average of the values, or the empty sequence if no values were added
+        """
+        if self.count == 0:
+            return []
+        total = self.sum()
+        if in_decimal_mode() and not isinstance(total, float):
+            return Decimal(total) / self.count
+        return total / self.count
+
+    def min(self):
+        return self.extreme(self.minimum)
+
+    def max(self):
+        return self.extreme(self.maximum)
+
+    def extreme(self, value):
+        """
+        Minimum or maximum of the values, or the empty sequence if no values were added
+        """
+        if self.compare_error is not None:
+            raise self.compare_error
+        if not self.count:
+            return []
+        if self.doubles and isinstance(value, (int, Decimal)) and not isinstance(value, bool):
+            return float(value)
+        return value
+
+    def __repr__(self):
+        return f"RunningAggregate(count={self.count}, sum={self.total})"
@@ -0,0 +1,295 @@
+import re
+from decimal import Decimal
+
+import lxml.etree
+from isodate import parse_date
+
+from .frame import current_frame
+from .qname import QName
+
+INTEGER = "integer"
+DECIMAL = "decimal"
+DOUBLE = "double"
+DATE = "date"
+STRING = "string"
+
+# Lexical forms of the atomic types we recognize. Whitespace around the value is allowed (and ignored).
+s_IntegerRegex = r"[+-]?\d+"
+s_DecimalRegex = r"[+-]?(?:\d+\.\d*|\.\d+)"
+s_DoubleRegex = r"[+-]?(?:\d+(?:\.\d*)?|\.\d+)[eE][+-]?\d+|[+-]?INF|NaN"
+s_DateRegex = r"\d{4}-\d{2}-\d{2}"
+
+# One pattern which classifies a text value. The name of the group that matched is the type of the value.
+lexical_classifier = re.compile(
+    rf"\s*(?:(?P<{INTEGER}>{s_IntegerRegex})|(?P<{DECIMAL}>{s_DecimalRegex})"
+    rf"|(?P<{DOUBLE}>{s_DoubleRegex})|(?P<{DATE}>{s_DateRegex}))\s*$"
+)
+
+# Lexical forms that can be cast to a type. Integers are valid decimals, and both are valid doubles.
+lexical_forms = {
+    INTEGER: re.compile(rf"\s*{s_IntegerRegex}\s*$"),
+    DECIMAL: re.compile(rf"\s*(?:{s_IntegerRegex}|{s_DecimalRegex})\s*$"),
+    DOUBLE: re.compile(rf"\s*(?:{s_IntegerRegex}|{s_DecimalRegex}|{s_DoubleRegex})\s*$"),
+    DATE: re.compile(rf"\s*{s_DateRegex}\s*$"),
+}
+
+# Types which can be used as type hint, by local name. Includes the common XBRL item types.
+type_kinds = {
+    "integer": INTEGER,
+    "int": INTEGER,
+    "long": INTEGER,
+    "short": INTEGER,
+    "byte": INTEGER,
+    "nonNegativeInteger": INTEGER,
+    "positiveInteger": INTEGER,
+    "nonPositiveInteger": INTEGER,
+    "negativeInteger": INTEGER,
+    "decimal": DECIMAL,
+    "double": DOUBLE,
+    "float": DOUBLE,
+    "date": DATE,
+    "string": STRING,
+    "integerItemType": INTEGER,
+    "nonNegativeIntegerItemType": INTEGER,
+    "positiveIntegerItemType": INTEGER,
+    "decimalItemType": DECIMAL,
+    "monetaryItemType": DECIMAL,
+    "sharesItemType": DECIMAL,
+    "pureItemType": DECIMAL,
+    "doubleItemType": DOUBLE,
+    "floatItemType": DOUBLE,
+    "dateItemType": DATE,
+    "stringItemType": STRING,
+}
+
+
+def cast_integer(text):
+    return int(text)
+
+
+def cast_decimal(text):
+    return Decimal(text.strip())
+
+
+def cast_double(text):
+    text = text.strip()
+    if text.endswith("INF"):
+        # XML Schema spells infinity differently than Python
+        return float(text.replace("INF", "inf"))
+    return float(text)
+
+
+def cast_date(text):
+    return parse_date(text.strip())
+
+
+def cast_string(text):
+    return text
+
+
+class Atomizer:
+    def __init__(self, type_hints: dict = None, namespaces: dict = None, exact_decimals: bool = False):
+        """
+        The atomizer casts the text values of (sequences of) LXML elements to typed values.
+
+        Values are classified using regular expressions instead of trying casts value by value, so no exceptions
+        are raised for values that are not numeric. The type that is found for an element name is kept. Sequences
+        of elements with a known type are cast in bulk, checking once for the whole sequence if that succeeded.
+
+        :param type_hints: Dict of element name to type name, e.g. {"ns:Revenue": "xbrli:monetaryItemType"}.
+            Element names can be given in Clark notation ("{namespace}localname"), as QName or as a prefixed
+            name which is resolved using the namespaces.
+            Type names are XML Schema or XBRL item types, like "xs:integer", "xs:decimal" or "xs:date".
+        :param namespaces: Dict of prefix to namespace, used to resolve prefixed element names in the type hints
+        :param exact_decimals: If True, untyped values that look like a decimal are cast to Decimal instead of float
+        """
+
+        self.namespaces = namespaces if namespaces else {}
+        self.type_hints = {}
+        if type_hints is not None:
+            for element_name, type_name in type_hints.items():
+                self.type_hints[self.clark_name(element_name)] = self.type_kind(type_name)
+
+        # Type that was derived from the values of an element name, keyed by tag
+        self.derived_types = {}
+
+        # Untyped values that look like a decimal are treated as double, unless decimals are asked for
+        self.untyped_decimal = DECIMAL if exact_decimals else DOUBLE
+
+        self.casts = {
+            INTEGER: cast_integer,
+            DECIMAL: cast_decimal,
+            DOUBLE: cast_double,
+            DATE: cast_date,
+            STRING: cast_string,
+        }
+
+    def clark_name(self, element_name):
+        """
+        Get the element name in Clark notation, which is how LXML names its elements.
+        """
+        if isinstance(element_name, QName):
+            if element_name.namespace is not None:
+                return f"{{{element_name.namespace}}}{element_name.localname}"
+            prefix, localname = element_name.prefix, element_name.localname
+
+        elif element_name.startswith("{") or ":" not in element_name:
+            return element_name
+
+        else:
+            prefix, localname = element_name.split(":", 1)
+
+        if prefix is None:
+            return localname
+
+        if prefix not in self.namespaces.keys():
+            raise ValueError(f"Unknown namespace prefix '{prefix}' for type hint of element '{element_name}'")
+
+        return f"{{{self.namespaces[prefix]}}}{localname}"
+
+    @staticmethod
+    def type_kind(type_name):
+        """
+        Get the kind of value (integer, decimal, double, date or string) for a type name
+        """
+        if isinstance(type_name, QName):
+            local_type_name = type_name.localname
+        else:
+            local_type_name = type_name.rsplit("}", 1)[-1].rsplit(":", 1)[-1]
+
+        if local_type_name not in type_kinds.keys():
+            raise ValueError(f"Type '{type_name}' can not be used as type hint")
+
+        return type_kinds[local_type_name]
+
+    def classify(self, text):
+        """
+        Get the kind of value of an untyped text value
+
+        :param text: Text value of an element
+        :return: Kind of value
+        """
+        match = lexical_classifier.match(text)
+        if match is None:
+            return STRING
+
+        kind = match.lastgroup
+        if kind == DECIMAL:
+            return self.untyped_decimal
+
+        return kind
+
+    def declared_kind(self, tag):
+        """
+        Get the kind of value that is declared for an element name using a type hint
+
+        :return: Kind of value, or None if there is no type hint for the element name
+        """
+        return self.type_hints.get(tag)
+
+    def atomize_element(self, element):
+        """
+        Get the typed value of an element
+
+        :param element: LXML element
+        :return: Typed value
+        """
+        text = element.text
+        if text is None:
+            return ""
+
+        tag = element.tag
+        kind = self.type_hints.get(tag)
+        if kind is None:
+            kind = self.derived_types.get(tag)
+
+        # Check if the value has the lexical form of the known kind. If not, classify the value itself.
+        if kind is None or (kind != STRING and lexical_forms[kind].match(text) is None):
+            kind = self.classify(text)
+            if tag not in self.type_hints.keys():
+                self.derived_types[tag] = kind
+
+        elif kind == STRING and tag not in self.type_hints.keys():
+            # Strings match everything, so values of elements that were strings before are classified again
+            kind = self.classify(text)
+            self.derived_types[tag] = kind
+
+        return self.casts[kind](text)
+
+    def atomize_item(self, item):
+        if isinstance(item, lxml.etree._Element):
+            return self.atomize_element(item)
+        return item
+
+    def atomize(self, items):
+        """
+        Atomize a sequence. Elements are cast to their typed value, other items are kept as they are.
+
+        :param items: Iterable of LXML elements and/or atomic values
+        :return: List of atomic values
+        """
+        if not isinstance(items, list):
+            items = list(items)
+
+        if items and isinstance(items[0], lxml.etree._Element):
+            values = self.atomize_elements(items)
+            if values is not None:
+                return values
+
+        atomize_item = self.atomize_item
+        return [atomize_item(item) for item in items]
+
+    def atomize_elements(self, elements):
+        """
+        Atomize a sequence of elements in bulk, assuming all values have the type that is known for the name of the
+        first element (or the type of its value). This is the common case, as most sequences are the outcome of a
+        query for one element name.
+
+        :param elements: List of LXML elements
+        :return: List of typed values, or None if the elements need to be atomized one by one
+        """
+        type_hints = self.type_hints
+        tag = elements[0].tag
+
+        if type_hints and len({type_hints.get(element.tag) for element in elements}) > 1:
+            # Elements are declared to have different types
+            return None
+
+        kind = type_hints.get(tag)
+        if kind is None:
+            kind = self.derived_types.get(tag)
+        if kind is None and elements[0].text is not None:
+            kind = self.classify(elements[0].text)
+        if kind is None or kind == STRING:
+            # Strings are classified value by value, as they might hold other values as well
+            return None
+
+        try:
+            values = list(map(self.casts[kind], [element.text for element in elements]))
+        except (AttributeError, TypeError, ValueError, ArithmeticError):
+            # Not all items are elements (with a value) of this type. This is checked once for the whole sequence.
+            return None
+
+        if tag not in type_hints.keys():
+            self.derived_types[tag] = kind
+
+        return values
+
+
+# Atomizers which are used when an evaluation has no type hints
+default_atomizer = Atomizer()
+decimal_atomizer = Atomizer(exact_decimals=True)
+
+
+def current_atomizer():
+    """
+    Get the atomizer of the evaluation that is currently running, or the default atomizer.
+    """
+    frame = current_frame()
+    if frame is not None:
+        if frame.atomizer is not None:
+            return frame.atomizer
+        if frame.decimal_mode:
+            return decimal_atomizer
+
+    return default_atomizer
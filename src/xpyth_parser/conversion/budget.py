@@ -0,0 +1,127 @@
+"""
+Limits on the work a single evaluation may do.
+
+Expressions can come from users we do not control. A budget stops an evaluation that takes too many steps, goes
+through too many items or runs past its deadline, by raising BudgetExceeded from inside the evaluation.
+"""
+import datetime
+import time
+
+from .frame import current_frame
+
+# Limits that can be exceeded
+MAX_STEPS = "max_steps"
+MAX_ITEMS = "max_items"
+DEADLINE = "deadline"
+CANCELLED = "cancelled"
+
+# Reading the clock is cheap, but not free. The deadline is checked once every this many steps or items.
+DEADLINE_CHECK_INTERVAL = 64
+
+
+class BudgetExceeded(RuntimeError):
+    def __init__(self, limit, maximum, used):
+        """
+        Raised when an evaluation exceeds one of the limits of its budget
+
+        :param limit: Name of the limit that was exceeded: "max_steps", "max_items", "deadline" or "cancelled"
+        :param maximum: Value of the limit
+        :param used: Number of steps or items that were used, or the number of seconds the evaluation ran
+        """
+        self.limit = limit
+        self.maximum = maximum
+        self.used = used
+
+        if limit == CANCELLED:
+            message = "Evaluation was cancelled"
+        elif limit == DEADLINE:
+            message = f"Evaluation did not finish before its deadline, after {used:.3f} seconds"
+        else:
+            message = f"Evaluation exceeded {limit}={maximum}"
+        super().__init__(message)
+
+
+class EvaluationBudget:
+    def __init__(self, max_steps: int = None, max_items: int = None, deadline=None):
+        """
+        Budget of a single evaluation. Every node that is evaluated, every function call and every predicate or
+        binding that is evaluated for an item counts as a step. Every item that goes through a predicate, for
+        expression, simple map or sequence counts as an item.
+
+        :param max_steps: Maximum number of evaluation steps, or None for no limit
+        :param max_items: Maximum number of items, or None for no limit
+        :param deadline: Number of seconds the evaluation may take (counted from the creation of the budget),
+            or the datetime.datetime by which it should be finished. None for no deadline.
+        """
+        self.max_steps = max_steps
+        self.max_items = max_items
+
+        self.started = time.monotonic()
+        if isinstance(deadline, datetime.datetime):
+            now = datetime.datetime.now(tz=deadline.tzinfo)
+            deadline = (deadline - now).total_seconds()
+        self.deadline = deadline
+        self.deadline_at = self.started + deadline if deadline is not None else None
+
+        self.steps = 0
+        self.items = 0
+        self.cancelled = False
+
+        # Countdown to the next check of the clock
+        self._until_deadline_check = DEADLINE_CHECK_INTERVAL
+
+    def step(self, count: int = 1):
+        """
+        Count evaluation steps
+
+        :raises BudgetExceeded: If the maximum number of steps is exceeded, the deadline passed or the evaluation
+            was cancelled
+        """
+        self.steps += count
+        if self.max_steps is not None and self.steps > self.max_steps:
+            raise BudgetExceeded(limit=MAX_STEPS, maximum=self.max_steps, used=self.steps)
+
+        self._tick(count)
+
+    def item(self, count: int = 1):
+        """
+        Count items of sequences
+
+        :raises BudgetExceeded: If the maximum number of items is exceeded, the deadline passed or the evaluation
+            was cancelled
+        """
+        self.items += count
+        if self.max_items is not None and self.items > self.max_items:
+            raise BudgetExceeded(limit=MAX_ITEMS, maximum=self.max_items, used=self.items)
+
+        self._tick(count)
+
+    def cancel(self):
+        """
+        Stop the evaluation within a few steps. Can be called from another thread.
+        """
+        self.cancelled = True
+
+    def _tick(self, count):
+        self._until_deadline_check -= count
+        if self._until_deadline_check > 0:
+            return
+        self._until_deadline_check = DEADLINE_CHECK_INTERVAL
+
+        if self.cancelled:
+            raise BudgetExceeded(limit=CANCELLED, maximum=None, used=self.steps)
+
+        if self.deadline_at is not None:
+            now = time.monotonic()
+            if now > self.deadline_at:
+                raise BudgetExceeded(limit=DEADLINE, maximum=self.deadline, used=now - self.started)
+
+
+def current_budget():
+    """
+    Get the budget of the evaluation that is currently running.
+
+    :return: EvaluationBudget, or None if the evaluation has no limits
+    """
+    frame = current_frame()
+    return frame.budget if frame is not None else None
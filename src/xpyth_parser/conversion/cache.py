@@ -0,0 +1,353 @@
+"""
+Cache of evaluation results.
+
+Filings are often submitted again without changes, and validated again. A result cache keeps the outcome of an
+evaluation keyed by the fingerprint of the compiled expression, a hash of the content of the document and a
+canonical hash of the variables, so evaluating the same expression on the same document with the same variables
+again does not evaluate anything.
+
+Only results without nodes are cached: nodes belong to the tree they were selected from, and can not be stored
+on disk. Attribute values and text are cached as plain strings. Results of custom functions are assumed to only depend on their arguments; clear the cache after
+replacing a custom function.
+"""
+import hashlib
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from decimal import Decimal
+
+from lxml import etree
+
+# Separates the parts of a fingerprint
+KEY_SEPARATOR = b"\x00"
+
+# Size of the chunks in which files are hashed
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def fingerprint(*parts) -> str:
+    """
+    Hash strings or byte strings into a hex digest
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else str(part).encode("utf-8"))
+        digest.update(KEY_SEPARATOR)
+    return digest.hexdigest()
+
+
+def file_fingerprint(path) -> str:
+    """
+    Hash the content of a file, in chunks
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def document_fingerprint(document) -> str:
+    """
+    Hash the content of a document. Byte-identical documents have the same fingerprint.
+    Documents given as bytes, memory maps or paths are hashed as they are, without parsing them.
+
+    :param document: Byte string or string of an XML document, a memory map, the path of a file as os.PathLike,
+        an LXML element or None
+    """
+    if document is None:
+        return ""
+    if isinstance(document, os.PathLike):
+        return file_fingerprint(document)
+    if isinstance(document, str):
+        document = document.encode("utf-8")
+    elif isinstance(document, etree._ElementTree):
+        document = etree.tostring(document)
+    elif isinstance(document, etree._Element):
+        document = etree.tostring(document.getroottree())
+
+    return hashlib.sha256(document).hexdigest()
+
+
+def canonical_value(value):
+    """
+    Get a canonical string of a variable value. Values of different types give different strings, as 1, 1.0 and "1"
+    are different values in XPath. The order of dicts does not matter.
+    """
+    if isinstance(value, (list, tuple)):
+        return "(" + ",".join(canonical_value(item) for item in value) + ")"
+    if isinstance(value, dict):
+        items = sorted((canonical_value(key), canonical_value(item)) for key, item in value.items())
+        return "{" + ",".join(f"{key}:{item}" for key, item in items) + "}"
+    if isinstance(value, (etree._Element, etree._ElementTree)):
+        return f"node:{document_fingerprint(value)}"
+    if isinstance(value, Decimal):
+        # Decimal("1.0") and Decimal("1.00") are the same value
+        return f"Decimal:{value.normalize()}"
+
+    return f"{type(value).__name__}:{value!r}"
+
+
+def variables_fingerprint(variables) -> str:
+    """
+    Hash a dict of variables. The order of the variables does not matter.
+    """
+    if not variables:
+        return ""
+    return fingerprint(canonical_value(variables))
+
+
+def is_cacheable(value) -> bool:
+    """
+    Check if a result can be cached: it does not contain nodes.
+    """
+    if isinstance(value, (etree._Element, etree._ElementTree)):
+        return False
+    if isinstance(value, (list, tuple)):
+        return all(is_cacheable(item) for item in value)
+    return True
+
+
+def plain_value(value):
+    """
+    Get a result as it is stored. Attribute values and text that LXML returns are strings which refer to their
+    element, and through it to the whole tree, so they are stored as plain strings.
+    """
+    if isinstance(value, etree._ElementUnicodeResult):
+        return str(value)
+    if isinstance(value, list):
+        return [plain_value(item) for item in value]
+    if isinstance(value, tuple):
+        return tuple(plain_value(item) for item in value)
+    return value
+
+
+class CacheStats:
+    def __init__(self):
+        """
+        Statistics of a result cache
+
+        hits: Number of evaluations that were skipped because their result was cached
+        misses: Number of evaluations of which the result was not cached
+        stores: Number of results that were added to the cache
+        evictions: Number of results that were removed to make room for others
+        uncacheable: Number of results that could not be cached, because they contain nodes or can not be stored
+        """
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.uncacheable = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "uncacheable": self.uncacheable,
+            "hit_rate": self.hit_rate,
+        }
+
+    def __repr__(self):
+        return f"CacheStats({', '.join(f'{name}={value}' for name, value in self.as_dict().items())})"
+
+
+class ResultCache:
+    """
+    Base class of result cache backends. Backends implement load, save and clear, and are safe to use from
+    multiple threads.
+    """
+
+    # Returned by load when a key is not in the cache, as None is a valid result
+    MISSING = object()
+
+    def __init__(self):
+        self.stats = CacheStats()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(expression_fingerprint: str, document_key: str, variables=None, context_item=None) -> str:
+        """
+        Get the key of an evaluation
+
+        :param expression_fingerprint: Fingerprint of the compiled expression (Parser.fingerprint)
+        :param document_key: Fingerprint of the document the expression is evaluated against (document_fingerprint)
+        :param variables: Dict of variables
+        :param context_item: Context item of the expression
+        """
+        context = canonical_value(context_item) if context_item is not None else ""
+        return fingerprint(expression_fingerprint, document_key, variables_fingerprint(variables), context)
+
+    def get(self, key):
+        """
+        Get a cached result
+
+        :return: The result, or ResultCache.MISSING if it is not cached
+        """
+        with self._lock:
+            value = self.load(key)
+            if value is self.MISSING:
+                self.stats.misses += 1
+            else:
+                self.stats.hits += 1
+            return value
+
+    def set(self, key, value):
+        """
+        Cache a result, unless it contains nodes
+        """
+        if not is_cacheable(value):
+            with self._lock:
+                self.stats.uncacheable += 1
+            return
+
+        value = plain_value(value)
+        with self._lock:
+            if self.save(key, value):
+                self.stats.stores += 1
+            else:
+                self.stats.uncacheable += 1
+
+    def load(self, key):
+        raise NotImplementedError
+
+    def save(self, key, value) -> bool:
+        """
+        Store a result
+
+        :return: False if the backend can not store the result
+        """
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+class MemoryResultCache(ResultCache):
+    def __init__(self, maxsize: int = 1024):
+        """
+        Cache of results in memory. The least recently used results are evicted when the cache is full.
+
+        :param maxsize: Maximum number of results
+        """
+        super().__init__()
+        self.maxsize = maxsize
+        self.results = OrderedDict()
+
+    def load(self, key):
+        if key not in self.results:
+            return self.MISSING
+
+        self.results.move_to_end(key)
+        value = self.results[key]
+        # Callers get a list of their own
+        return list(value) if isinstance(value, list) else value
+
+    def save(self, key, value):
+        self.results[key] = list(value) if isinstance(value, list) else value
+        self.results.move_to_end(key)
+
+        while len(self.results) > self.maxsize:
+            self.results.popitem(last=False)
+            self.stats.evictions += 1
+
+        return True
+
+    def clear(self):
+        with self._lock:
+            self.results.clear()
+
+    def __len__(self):
+        return len(self.results)
+
+
+class DiskResultCache(ResultCache):
+    def __init__(self, path: str, max_bytes: int = 64 * 1024 * 1024):
+        """
+        Cache of results in an SQLite database on disk, so results are kept between runs and shared between
+        processes on the same machine. Results are pickled. The least recently used results are evicted when the
+        pickled results take more than max_bytes.
+
+        :param path: Path of the database file. It is created if it does not exist.
+        :param max_bytes: Maximum total size of the pickled results
+        """
+        super().__init__()
+        self.path = path
+        self.max_bytes = max_bytes
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, used REAL NOT NULL)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS results_used ON results (used)")
+
+    def load(self, key):
+        row = self.connection.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return self.MISSING
+
+        self.connection.execute("UPDATE results SET used = ? WHERE key = ?", (time.time(), key))
+        return pickle.loads(row[0])
+
+    def save(self, key, value):
+        try:
+            data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            return False
+
+        if len(data) > self.max_bytes:
+            return False
+
+        self.connection.execute("INSERT OR REPLACE INTO results (key, value, size, used) VALUES (?, ?, ?, ?)",
+                                (key, data, len(data), time.time()))
+        self._evict()
+        return True
+
+    def _evict(self):
+        """
+        Remove the least recently used results until the results fit in max_bytes
+        """
+        total = self.size
+        if total <= self.max_bytes:
+            return
+
+        rows = self.connection.execute("SELECT key, size FROM results ORDER BY used").fetchall()
+        evicted = []
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            evicted.append((key,))
+            total -= size
+
+        self.connection.executemany("DELETE FROM results WHERE key = ?", evicted)
+        self.stats.evictions += len(evicted)
+
+    @property
+    def size(self) -> int:
+        """
+        Total size of the pickled results in bytes
+        """
+        return self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+
+    def clear(self):
+        with self._lock:
+            self.connection.execute("DELETE FROM results")
+
+    def close(self):
+        self.connection.close()
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM results").fetchone()[0]
@@ -0,0 +1,63 @@
+"""
+Exact decimal (xs:decimal) arithmetic.
+
+In decimal mode, decimal literals and untyped decimal values are Decimals instead of floats. Summing a long
+sequence of Decimals is slow compared to floats, so sequences of element values which all have the same number
+of decimals (the common case for monetary values) are summed as scaled integers: "12.50" is summed as 1250,
+and the scale is applied to the total once.
+"""
+from decimal import Decimal, localcontext, MAX_PREC
+
+from .vectorized import vectorize_decimals, vector_sum
+
+
+def scaled_to_decimal(value, scale):
+    """
+    Get the Decimal of a scaled integer. Integers that were not scaled stay integers.
+    """
+    if scale == 0:
+        return value
+    return Decimal(f"{value}E-{scale}")
+
+
+def decimal_sum(items):
+    """
+    Sum a sequence of elements with decimal values as scaled integers. This is the fast path of fn:sum in decimal mode.
+
+    :param items: List of LXML elements
+    :return: Decimal (or int if all values are integers), or None if the values can not be summed as scaled integers
+    """
+    scaled = vectorize_decimals(items)
+    if scaled is None:
+        return None
+
+    vector, scale = scaled
+    return scaled_to_decimal(vector_sum(vector), scale)
+
+
+def promote_operands(left, right):
+    """
+    Promote the operands of an arithmetic operation to a common type.
+    A decimal combined with a double becomes a double, as in XPath.
+    """
+    if isinstance(left, Decimal) and isinstance(right, float):
+        return float(left), right
+    if isinstance(left, float) and isinstance(right, Decimal):
+        return left, float(right)
+    return left, right
+
+
+def exact_sum(values):
+    """
+    Sum atomic values. Sums of decimals are not rounded to the precision of the decimal context.
+
+    :param values: List of numbers
+    :return: Sum of the values
+    """
+    with localcontext() as context:
+        context.prec = MAX_PREC
+        try:
+            return sum(values)
+        except TypeError:
+            # Decimals can not be added to floats. Mixed with doubles, the decimals are promoted to double.
+            return sum(float(value) for value in values)
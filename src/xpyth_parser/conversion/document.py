@@ -0,0 +1,150 @@
+"""
+XML documents which are parsed once and evaluated against any number of times.
+
+Instances of large filings can be hundreds of megabytes. A Document can be loaded straight from a file or a memory
+map, so the document is never copied into a Python byte string, and the tree is reused by every evaluation.
+Documents are parsed by an XMLParser of the current thread, which is created once per thread.
+"""
+import mmap
+import os
+import threading
+
+from lxml import etree
+
+from .cache import document_fingerprint, file_fingerprint
+from .index import ElementIndex
+from .nodesets import DocumentOrders
+from .xbrl_index import XbrlIndexes
+
+_parsers = threading.local()
+
+
+def xml_parser():
+    """
+    Get the XMLParser of the current thread. LXML parsers can be used by one thread at a time, so every thread
+    gets a parser of its own, which is reused for every document that thread parses.
+
+    Large documents are allowed (huge_tree), and whitespace between elements is not kept as text.
+    """
+    parser = getattr(_parsers, "parser", None)
+    if parser is None:
+        parser = _parsers.parser = etree.XMLParser(huge_tree=True, remove_blank_text=True)
+    return parser
+
+
+class Document:
+    def __init__(self, root, path=None):
+        """
+        Parsed XML document. Create documents with Document.load, or one of the from_ methods.
+
+        :param root: Root element of the document
+        :param path: Path of the file the document was loaded from, if any
+        """
+        self.root = root
+        self.path = path
+        self._fingerprint = None
+
+        # ElementIndex used by paths like //ns:X, once it is built
+        self.index = None
+        # Positions of the nodes, used by set operations of every evaluation against the document
+        self.document_orders = DocumentOrders()
+        # Contexts and units, used by the XBRL functions of every evaluation against the document
+        self.xbrl_indexes = XbrlIndexes()
+
+    @classmethod
+    def load(cls, source):
+        """
+        Load a document from any kind of source
+
+        :param source: Document, LXML element or element tree, bytes (or bytearray or memoryview), string of XML,
+            mmap.mmap, or the path of a file as os.PathLike
+        :return: Document
+        """
+        if isinstance(source, Document):
+            return source
+        if isinstance(source, (etree._Element, etree._ElementTree)):
+            return cls.from_tree(source)
+        if isinstance(source, mmap.mmap):
+            return cls.from_mmap(source)
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            return cls.from_bytes(source)
+        if isinstance(source, str):
+            return cls.from_string(source)
+        if isinstance(source, os.PathLike):
+            return cls.from_path(source)
+
+        raise TypeError(f"Can not load a document from '{type(source).__name__}'")
+
+    @classmethod
+    def from_path(cls, path):
+        """
+        Parse a file. LXML reads the file itself, so its content is never held in a Python object.
+        """
+        path = os.fspath(path)
+        return cls(etree.parse(path, parser=xml_parser()).getroot(), path=path)
+
+    @classmethod
+    def from_mmap(cls, memory_map):
+        """
+        Parse a memory mapped file, from the start of the map. The map is read in chunks.
+        """
+        memory_map.seek(0)
+        return cls(etree.parse(memory_map, parser=xml_parser()).getroot())
+
+    @classmethod
+    def from_bytes(cls, data):
+        return cls(etree.fromstring(data, parser=xml_parser()))
+
+    @classmethod
+    def from_string(cls, text):
+        """
+        Parse a string of XML. The string is parsed as it is, without encoding it into a byte string first, unless it
+        starts with an XML declaration that declares its encoding.
+        """
+        try:
+            root = etree.fromstring(text, parser=xml_parser())
+        except ValueError:
+            # LXML does not accept strings with an encoding declaration
+            root = etree.fromstring(text.encode("utf-8"), parser=xml_parser())
+        return cls(root)
+
+    @classmethod
+    def from_tree(cls, tree):
+        """
+        Use an LXML tree that was already parsed
+        """
+        if isinstance(tree, etree._ElementTree):
+            tree = tree.getroot()
+        return cls(tree)
+
+    @property
+    def fingerprint(self) -> str:
+        """
+        Hash of the content of the document, used as part of the key of cached results. Documents loaded from a file
+        are hashed from the file, other documents from the serialized tree. The hash is computed once.
+        """
+        if self._fingerprint is None:
+            if self.path is not None:
+                self._fingerprint = file_fingerprint(self.path)
+            else:
+                self._fingerprint = document_fingerprint(self.root)
+
+        return self._fingerprint
+
+    def build_index(self) -> ElementIndex:
+        """
+        Index the elements of the document by name, so paths like //ns:X that are evaluated against the document look
+        their elements up instead of walking the tree. The index is built once, in one walk over the tree, and is
+        worth it when more than a few such paths are evaluated. The document should not be changed after that.
+        """
+        if self.index is None:
+            self.index = ElementIndex(self.root)
+        return self.index
+
+    @property
+    def nsmap(self):
+        return self.root.nsmap
+
+    def __repr__(self):
+        source = f" from '{self.path}'" if self.path is not None else ""
+        return f"Document(<{self.root.tag}>{source})"
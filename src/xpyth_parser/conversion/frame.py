@@ -0,0 +1,138 @@
+from contextvars import ContextVar
+
+_current_frame = ContextVar("current_frame", default=None)
+
+
+class EvaluationFrame:
+    def __init__(self, atomizer=None, decimal_mode=None, position=None, size=None, variables=None, document=None,
+                 context_item=None, budget=None, event_loop=None, subtree_values=None,
+                 aggregates=None, element_index=None, prefetched_paths=None,
+                 document_orders=None, xbrl_indexes=None):
+        """
+        An evaluation frame holds the intermediate values of a single evaluation of an expression.
+        Function calls store their outcome in the frame, so they are only called once per evaluation.
+        The syntax tree itself is never changed by evaluating it, so one tree can be evaluated any number of times,
+        by multiple threads at once, each with frames of their own.
+
+        A frame is activated by using it as a context manager:
+
+        with EvaluationFrame():
+            resolve_expression(...)
+
+        :param atomizer: Atomizer used to cast element values. If None, the atomizer of the enclosing frame
+            (or the default atomizer) is used.
+        :param decimal_mode: If True, arithmetic on decimals is exact (xs:decimal) instead of floating point.
+            If None, the mode of the enclosing frame is used.
+        :param position: Position of the context item (1-based), returned by fn:position().
+            If None, the position of the enclosing frame is used.
+        :param size: Number of items in the sequence that is being filtered, returned by fn:last().
+            If None, the size of the enclosing frame is used.
+        :param variables: Dict of variable name to value. If None, the variables of the enclosing frame are used.
+        :param document: LXML etree which paths are evaluated against. If None, the document of the enclosing frame
+            is used.
+        :param context_item: Context item, like the item that is being filtered by a predicate.
+            If None, the context item of the enclosing frame is used.
+        :param budget: EvaluationBudget which limits the work of the evaluation. If None, the budget of the enclosing
+            frame is used.
+        :param event_loop: Asyncio event loop which coroutine functions are run on, when the evaluation runs in
+            another thread than the loop. If None, the event loop of the enclosing frame is used.
+        :param subtree_values: SubtreeValues of an incremental evaluation, which holds the values of subtrees that
+            did not change since the previous evaluation. If None, those of the enclosing frame are used.
+        :param aggregates: Dict of id of the path argument of an aggregate function to the RunningAggregate of the
+            path, kept up to date by a FactStream. If None, those of the enclosing frame are used.
+        :param element_index: ElementIndex of the document, which paths like //ns:X look their elements up in.
+            If None, the index of the enclosing frame is used.
+        :param prefetched_paths: PrefetchedPaths of the document, with the elements of simple paths found by a
+            FormulaSet. If None, those of the enclosing frame are used.
+        :param document_orders: DocumentOrders with the positions of nodes, used by set operations on nodes.
+            If None, those of the enclosing frame are used.
+        :param xbrl_indexes: XbrlIndexes with the contexts and units of documents, used by the XBRL functions.
+            If None, those of the enclosing frame are used.
+        """
+
+        # Outcomes of function calls, keyed by the id of the function node
+        self.results = {}
+
+        if atomizer is None and current_frame() is not None:
+            atomizer = current_frame().atomizer
+        self.atomizer = atomizer
+
+        if decimal_mode is None:
+            decimal_mode = current_frame() is not None and current_frame().decimal_mode
+        self.decimal_mode = decimal_mode
+
+        if position is None and current_frame() is not None:
+            position, size = current_frame().position, current_frame().size
+        self.position = position
+        self.size = size
+
+        if variables is None and current_frame() is not None:
+            variables = current_frame().variables
+        self.variables = variables if variables is not None else {}
+
+        if document is None and current_frame() is not None:
+            document = current_frame().document
+        self.document = document
+
+        if context_item is None and current_frame() is not None:
+            context_item = current_frame().context_item
+        self.context_item = context_item
+
+        if budget is None and current_frame() is not None:
+            budget = current_frame().budget
+        self.budget = budget
+
+        if event_loop is None and current_frame() is not None:
+            event_loop = current_frame().event_loop
+        self.event_loop = event_loop
+
+        if subtree_values is None and current_frame() is not None:
+            subtree_values = current_frame().subtree_values
+        self.subtree_values = subtree_values
+
+        if aggregates is None and current_frame() is not None:
+            aggregates = current_frame().aggregates
+        self.aggregates = aggregates
+
+        if element_index is None and current_frame() is not None:
+            element_index = current_frame().element_index
+        self.element_index = element_index
+
+        if prefetched_paths is None and current_frame() is not None:
+            prefetched_paths = current_frame().prefetched_paths
+        self.prefetched_paths = prefetched_paths
+
+        if document_orders is None and current_frame() is not None:
+            document_orders = current_frame().document_orders
+        self.document_orders = document_orders
+
+        if xbrl_indexes is None and current_frame() is not None:
+            xbrl_indexes = current_frame().xbrl_indexes
+        self.xbrl_indexes = xbrl_indexes
+
+        self._token = None
+
+    def __enter__(self):
+        self._token = _current_frame.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        _current_frame.reset(self._token)
+        self._token = None
+
+
+def current_frame():
+    """
+    Get the frame of the evaluation that is currently running.
+
+    :return: EvaluationFrame, or None if no evaluation is running
+    """
+    return _current_frame.get()
+
+
+def in_decimal_mode():
+    """
+    Check if the evaluation that is currently running uses exact decimal arithmetic.
+    """
+    frame = current_frame()
+    return frame is not None and frame.decimal_mode
@@ -1,15 +1,330 @@
+import asyncio
 import functools
+import inspect
+import types
+from collections.abc import Iterator
+from decimal import Decimal, localcontext, MAX_PREC
 
 import lxml.etree
 from isodate import parse_date, parse_duration
 from functools import partial
 
-from .functions.generic import FunctionRegistry, QuerySingleton
-from .qname import QName, Parameter
+from .aggregates import RunningAggregate
+from .atomize import current_atomizer
+from .decimals import decimal_sum, exact_sum, promote_operands
+from .frame import current_frame, in_decimal_mode
+from .functions.generic import FunctionRegistry
+from .qname import QName
+from .ranges import IntegerRange
+from .vectorized import vectorize_elements, vector_sum, vector_avg, vector_min, vector_max
 
 
 reg = FunctionRegistry()
 
+# Functions which consume their argument in a single pass. Streamed arguments (like for expressions) are passed
+# to these functions as iterator, so their items are never collected into a list.
+streaming_functions = {"fn:count", "fn:sum", "fn:avg", "fn:min", "fn:max"}
+
+
+class FunctionCall(partial):
+    """
+    Function node of the syntax tree. Calling the node runs the function with the arguments that were parsed.
+
+    Arguments which are expressions themselves (paths, variables, operators or other function calls) are evaluated
+    in the current evaluation frame when the function is run. The parsed arguments are never replaced by their
+    values, so the node can be evaluated again, with another document or other variables.
+
+    Within an evaluation frame, the function is only run once: the outcome is stored in the frame and
+    handed out to everyone who asks for the value of this node afterwards.
+    If the function is registered as pure, the outcome is also kept in the function registry and reused by
+    other evaluations with the same arguments.
+    """
+
+    qname = None
+
+    @property
+    def _children(self):
+        if not self.args:
+            return []
+        parsed_args = self.args[0]
+        return parsed_args if isinstance(parsed_args, list) else [parsed_args]
+
+    @property
+    def is_async(self):
+        """
+        Check if the function is a coroutine function, like custom functions that look up data asynchronously
+        """
+        return inspect.iscoroutinefunction(self.func)
+
+    def __call__(self, *args, **kwargs):
+        frame = current_frame()
+        if frame is None:
+            return self.run(*args, **kwargs)
+
+        if frame.budget is not None:
+            frame.budget.step()
+
+        key = id(self)
+        if key in frame.results:
+            outcome = frame.results[key]
+            if isinstance(outcome, PendingCall):
+                # The call was started before, wait for its outcome
+                outcome = frame.results[key] = outcome.result()
+            return outcome
+
+        outcome = self.run(*args, **kwargs)
+        if not isinstance(outcome, types.GeneratorType):
+            # Generators can only be consumed once, so they cannot be handed out again
+            frame.results[key] = outcome
+
+        return outcome
+
+    def run(self, *args, **kwargs):
+        """
+        Run the function, using the outcomes of pure functions that are already known.
+
+        :return: Outcome of the function
+        """
+        # As with partial, arguments that are passed to the call are added after the parsed ones
+        arguments = (self.arguments(),) + args
+
+        pure_key = self.pure_key(arguments) if not args and not kwargs else None
+        if pure_key is not None:
+            found, outcome = reg.get_pure_result(pure_key)
+            if found:
+                return outcome
+
+        frame = current_frame()
+        keywords = {"query": frame.document if frame is not None else None, **self.keywords, **kwargs}
+        outcome = self.func(*arguments, **keywords)
+
+        if asyncio.iscoroutine(outcome):
+            outcome = run_coroutine(outcome)
+
+        if pure_key is not None and not isinstance(outcome, types.GeneratorType):
+            reg.set_pure_result(pure_key, outcome)
+
+        return outcome
+
+    def start(self):
+        """
+        Start the call of a coroutine function on the event loop of the evaluation, without waiting for its outcome.
+        Other calls can be started (and other parts of the expression evaluated) while it runs. The outcome is
+        picked up when the node is evaluated.
+        """
+        frame = current_frame()
+        if frame is None or frame.event_loop is None or id(self) in frame.results or not self.is_async:
+            return
+
+        arguments = (self.arguments(),)
+        pure_key = self.pure_key(arguments)
+        if pure_key is not None:
+            found, outcome = reg.get_pure_result(pure_key)
+            if found:
+                frame.results[id(self)] = outcome
+                return
+
+        keywords = {"query": frame.document, **self.keywords}
+        future = asyncio.run_coroutine_threadsafe(self.func(*arguments, **keywords), frame.event_loop)
+        frame.results[id(self)] = PendingCall(future=future, pure_key=pure_key)
+
+    def arguments(self):
+        """
+        Evaluate the parsed arguments in the current evaluation frame.
+
+        Arguments are flattened into one sequence, as XPath does not have nested sequences. A single value
+        is passed as it is.
+
+        :return: Value of the argument, or list of values if there is more than one
+        """
+        if not self.args:
+            return []
+
+        parsed_args = self.args[0]
+        if not isinstance(parsed_args, list):
+            frame = current_frame()
+            if frame is not None and frame.aggregates is not None and id(parsed_args) in frame.aggregates:
+                # The aggregate of the path is kept up to date by a FactStream, or computed while streaming
+                return frame.aggregates[id(parsed_args)]
+
+            if self.qname in streaming_functions:
+                items = argument_stream(parsed_args)
+                if items is not None:
+                    return items
+
+            value = argument_value(parsed_args)
+            if isinstance(value, list) and len(value) == 1:
+                return value[0]
+            return value
+
+        frame = current_frame()
+        if frame is not None and frame.event_loop is not None:
+            # Calls of coroutine functions in the arguments run concurrently
+            from ..grammar.expressions import start_calls
+            start_calls(parsed_args)
+
+        values = []
+        for parsed_arg in parsed_args:
+            value = argument_value(parsed_arg)
+            if isinstance(value, (list, tuple, range, IntegerRange)):
+                values.extend(value)
+            else:
+                values.append(value)
+
+        if len(values) == 1:
+            return values[0]
+        return values
+
+    def pure_key(self, arguments):
+        """
+        Key under which the outcome of a pure function is memoized.
+
+        :param arguments: Evaluated arguments of the function
+        :return: Tuple of function name and arguments, or None if the outcome can not be memoized
+        """
+        if self.qname is None or not reg.is_pure(self.qname):
+            return None
+
+        args = freeze_arguments(arguments)
+        if args is None:
+            return None
+
+        return self.qname, args
+
+
+def freeze_arguments(args):
+    """
+    Turn (nested) arguments into a hashable key. Only atomic values are supported,
+    as nodes or nested expressions might give a different outcome in the next evaluation.
+
+    :param args: Arguments of a function call
+    :return: Tuple of atomic arguments, or None if an argument is not atomic
+    """
+    if isinstance(args, (list, tuple)):
+        frozen = []
+        for arg in args:
+            frozen_arg = freeze_arguments(arg)
+            if frozen_arg is None:
+                return None
+            frozen.append(frozen_arg)
+
+        return tuple(frozen)
+
+    elif isinstance(args, (str, int, float, Decimal, QName)):
+        # Include the type so that 1, 1.0 and True are not mixed up
+        return type(args), args
+
+    return None
+
+
+class PendingCall:
+    def __init__(self, future, pure_key=None):
+        """
+        Call of a coroutine function that was started, but whose outcome was not asked for yet
+
+        :param future: concurrent.futures.Future of the outcome
+        :param pure_key: Key under which the outcome is memoized, if the function is pure
+        """
+        self.future = future
+        self.pure_key = pure_key
+
+    def result(self):
+        outcome = self.future.result()
+        if self.pure_key is not None:
+            reg.set_pure_result(self.pure_key, outcome)
+        return outcome
+
+
+def run_coroutine(coroutine):
+    """
+    Run a coroutine of a custom function to completion. If the evaluation has an event loop (evaluate_async),
+    the coroutine runs on that loop, while the evaluation waits in its own thread. Otherwise, it runs on an
+    event loop of its own.
+
+    :return: Outcome of the coroutine
+    """
+    frame = current_frame()
+    if frame is not None and frame.event_loop is not None:
+        return asyncio.run_coroutine_threadsafe(coroutine, frame.event_loop).result()
+
+    return asyncio.run(coroutine)
+
+
+def argument_value(parsed_arg):
+    """
+    Get the value of a parsed argument of a function call in the current evaluation frame.
+
+    :param parsed_arg: Literal value or expression node
+    :return: Value of the argument
+    """
+    if isinstance(parsed_arg, (str, int, float, Decimal)):
+        return parsed_arg
+
+    # Expressions import function calls, so they can only be imported once the grammar is loaded
+    from ..grammar.expressions import resolve_expression
+
+    frame = current_frame()
+    if frame is None:
+        value = resolve_expression(parsed_arg, variable_map={}, lxml_etree=None)
+    else:
+        value = resolve_expression(parsed_arg, variable_map=frame.variables, lxml_etree=frame.document,
+                                   context_item_value=frame.context_item)
+
+    if isinstance(value, types.GeneratorType):
+        return list(value)
+    return value
+
+def argument_stream(parsed_arg):
+    """
+    Get the items of a parsed argument which is streamed, like a for expression.
+
+    :return: Iterator of items, or None if the argument is not streamed
+    """
+    if isinstance(parsed_arg, (str, int, float, Decimal)):
+        return None
+
+    from ..grammar.expressions import stream_expression
+
+    frame = current_frame()
+    if frame is None:
+        return stream_expression(parsed_arg, variable_map={}, lxml_etree=None)
+
+    return stream_expression(parsed_arg, variable_map=frame.variables, lxml_etree=frame.document,
+                             context_item_value=frame.context_item)
+
+
+def stream_values(items):
+    """
+    Atomize the items of a stream, one at a time
+    """
+    atomize_item = current_atomizer().atomize_item
+    for item in items:
+        yield atomize_item(item)
+
+
+def stream_sum(items):
+    """
+    Sum the items of a stream in a single pass.
+
+    :return: Tuple of (sum, number of items)
+    """
+    total = 0
+    number_of_items = 0
+    with localcontext() as context:
+        # Sums of decimals are exact
+        context.prec = MAX_PREC
+        for value in stream_values(items):
+            try:
+                total = total + value
+            except TypeError:
+                # A decimal and a double are added as doubles
+                total, value = promote_operands(total, value)
+                total = total + value
+            number_of_items += 1
+
+    return total, number_of_items
+
+
 def cast_lxml_elements(args):
     """
     Cast args from LXML elements for functions where this is needed.
@@ -25,47 +340,33 @@ def cast_lxml_elements(args):
         args = args.expr
 
     # If it is already a primary, return it
-    if isinstance(args, str) or isinstance(args, int) or isinstance(args, float):
+    if isinstance(args, (str, int, float, Decimal)):
         return args
 
     elif isinstance(args, bytes):
         # Could be an unparsed (L)XML element
         etree = lxml.etree.fromstring(args)
-        try:
-            arg = int(etree.text)
-        except:
-            arg = etree.text
-
-        return arg
+        return current_atomizer().atomize_element(etree)
 
     elif isinstance(args, lxml.etree._Element):
-        try:
-            arg = int(args.text)
-        except:
-            arg = args.text
-
-        return arg
+        return current_atomizer().atomize_element(args)
 
     elif args == None:
         # If none is passed though (LXML has not found any elements, return the empty list)
         return []
 
-
     # Else, we need to go through the list
-    casted_args = []
-    for arg in args:
-        if isinstance(arg, lxml.etree._Element):
-            try:
-                arg = int(arg.text)
-            except:
-                arg = arg.text
-        casted_args.append(arg)
-
-    return casted_args
+    return current_atomizer().atomize(args)
 
 
 def fn_count(*args, **kwargs):
     args = args[0]
+    if isinstance(args, (IntegerRange, RunningAggregate)):
+        return len(args)
+
+    if isinstance(args, Iterator):
+        return sum(1 for _ in args)
+
     if isinstance(args, list):
 
         return len(args)
@@ -73,17 +374,102 @@ def fn_count(*args, **kwargs):
         return 1
 
 
+def fn_position(*args, **kwargs):
+    """
+    Returns the position of the context item in the sequence that is being filtered by a predicate.
+    """
+    frame = current_frame()
+    if frame is None or frame.position is None:
+        raise ValueError("fn:position() is called without a context item")
+
+    return frame.position
+
+
+def fn_last(*args, **kwargs):
+    """
+    Returns the number of items in the sequence that is being filtered by a predicate.
+    """
+    frame = current_frame()
+    if frame is None or frame.size is None:
+        raise ValueError("fn:last() is called without a context item")
+
+    return frame.size
+
+
+def is_empty_sequence(value):
+    """
+    Check if an argument is the empty sequence, like the outcome of a path that selects nothing
+    """
+    return value is None or (isinstance(value, (list, tuple)) and len(value) == 0)
+
+
 def fn_avg(*args, **kwargs):
+    if is_empty_sequence(args[0]):
+        # The empty sequence has no average
+        return []
+
+    if isinstance(args[0], IntegerRange):
+        if len(args[0]) == 0:
+            return []
+        total, number_of_items = args[0].sum(), len(args[0])
+        if in_decimal_mode():
+            return Decimal(total) / number_of_items
+        return total / number_of_items
+
+    if isinstance(args[0], RunningAggregate):
+        return args[0].avg()
+
+    if isinstance(args[0], Iterator):
+        total, number_of_items = stream_sum(args[0])
+        if number_of_items == 0:
+            return []
+        if in_decimal_mode() and not isinstance(total, float):
+            return Decimal(total) / number_of_items
+        return total / number_of_items
+
+    if in_decimal_mode():
+        total = decimal_sum(args[0])
+        if total is not None:
+            return Decimal(total) / len(args[0])
+
+    vector = vectorize_elements(args[0])
+    if vector is not None:
+        return vector_avg(vector)
+
     casted_args = cast_lxml_elements(args=args[0])
 
     if isinstance(casted_args, int):
         # If there is only one value, the sum would be the same as the value
         return casted_args
 
+    if in_decimal_mode():
+        total = exact_sum(casted_args)
+        if not isinstance(total, float):
+            return Decimal(total) / len(casted_args)
+        return total / len(casted_args)
+
     return sum(casted_args) / len(casted_args)
 
 
 def fn_max(*args, **kwargs):
+    if is_empty_sequence(args[0]):
+        # The empty sequence has no maximum
+        return []
+
+    if isinstance(args[0], IntegerRange):
+        return args[0].max() if len(args[0]) > 0 else []
+
+    if isinstance(args[0], RunningAggregate):
+        return args[0].max()
+
+    if isinstance(args[0], Iterator):
+        # The empty sequence has no maximum
+        return max(stream_values(args[0]), default=[])
+
+    vector = vectorize_elements(args[0])
+    if vector is not None:
+        return vector_max(vector)
+
     casted_args = cast_lxml_elements(args=args[0])
     if isinstance(casted_args, int):
         # If there is only one value, the sum would be the same as the value
@@ -92,6 +478,24 @@ def fn_max(*args, **kwargs):
     return max(casted_args)
 
 def fn_min(*args, **kwargs):
+    if is_empty_sequence(args[0]):
+        # The empty sequence has no minimum
+        return []
+
+    if isinstance(args[0], IntegerRange):
+        return args[0].min() if len(args[0]) > 0 else []
+
+    if isinstance(args[0], RunningAggregate):
+        return args[0].min()
+
+    if isinstance(args[0], Iterator):
+        # The empty sequence has no minimum
+        return min(stream_values(args[0]), default=[])
+
+    vector = vectorize_elements(args[0])
+    if vector is not None:
+        return vector_min(vector)
+
     casted_args = cast_lxml_elements(args=args[0])
     if isinstance(casted_args, int):
         # If there is only one value, the sum would be the same as the value
@@ -100,12 +504,31 @@ def fn_min(*args, **kwargs):
     return min(casted_args)
 
 def fn_sum(*args, **kwargs):
+    if isinstance(args[0], (IntegerRange, RunningAggregate)):
+        return args[0].sum()
+
+    if isinstance(args[0], Iterator):
+        total, number_of_items = stream_sum(args[0])
+        return total
+
+    if in_decimal_mode():
+        total = decimal_sum(args[0])
+        if total is not None:
+            return total
+
+    vector = vectorize_elements(args[0])
+    if vector is not None:
+        return vector_sum(vector)
+
     casted_args = cast_lxml_elements(args=args[0])
 
     if isinstance(casted_args, int):
         # If there is only one value, the sum would be the same as the value
         return casted_args
 
+    if in_decimal_mode():
+        return exact_sum(casted_args)
+
     return sum(casted_args)
 
 
@@ -118,11 +541,22 @@ def fn_not(*args, **kwargs):
 
 def fn_empty(*args, **kwargs):
     for arg in args:
-        if arg is None or arg == "":
+        if isinstance(arg, RunningAggregate):
+            return len(arg) == 0
+        if arg is None or arg == "" or arg == []:
             return True
 
     return False
 
+def fn_exists(*args, **kwargs):
+    """
+    Returns true if the argument is a non-empty sequence
+    """
+    arg = args[0] if args else None
+    if isinstance(arg, (IntegerRange, RunningAggregate)):
+        return len(arg) > 0
+    return arg is not None and not (isinstance(arg, list) and len(arg) == 0)
+
 def xs_date(*args, **kwargs):
     casted_args = cast_lxml_elements(args=args[0])
     if len(casted_args) == 0:
@@ -131,6 +565,25 @@ def xs_date(*args, **kwargs):
         date = parse_date(casted_args)
         return date
 
+def xs_decimal(*args, **kwargs):
+    """
+    Cast a value to xs:decimal. The empty sequence stays empty.
+    """
+    value = args[0]
+    if isinstance(value, list):
+        if len(value) == 0:
+            return []
+        value = value[0]
+
+    if isinstance(value, lxml.etree._Element):
+        value = value.text if value.text is not None else ""
+
+    if isinstance(value, float):
+        # Go through the shortest representation of the float, so 0.1 becomes 0.1 and not 0.1000000000000000055...
+        return Decimal(repr(value))
+
+    return Decimal(str(value).strip())
+
 def xs_yearMonthDuration(*args, **kwargs):
     casted_args = cast_lxml_elements(args=args[0])
     if len(casted_args) == 0:
@@ -176,14 +629,18 @@ def fn_number(*args, **kwargs):
 
 functions = {
         "fn:count":fn_count,
+        "fn:position": fn_position,
+        "fn:last": fn_last,
         "fn:avg": fn_avg,
         "fn:max": fn_max,
         "fn:min": fn_min,
         "fn:sum": fn_sum,
         "fn:not": fn_not,
         "fn:empty": fn_empty,
+        "fn:exists": fn_exists,
         "fn:number": fn_number,
         "xs:date": xs_date,
+        "xs:decimal": xs_decimal,
         "xs:yearMonthDuration": xs_yearMonthDuration,
         "xs:dayTimeDuration": xs_dayTimeDuration,
         "xs:QName": xs_qname,
@@ -197,8 +654,6 @@ functions.update(function_list)
 # Add the initial set of functions to the registry
 reg.add_functions(functions=functions, overwrite_functions=True)
 
-query = QuerySingleton()
-
 def get_function(toks):
     qname = toks[0]
 
@@ -224,77 +679,10 @@ def get_function(toks):
         if len(args) == 1:
             args = args[0]
 
-        return partial(function, args, query=query.lxml_tree)
+        # The document is passed to the function as 'query' when the function is run
+        function_call = FunctionCall(function, args)
+        function_call.qname = full_qname_str
+
+        return function_call
     else:
         print("Cannot find function in registry")
-
-def resolve_paths(fn, lxml_etree):
-    """
-    Attempt to resolve path queries
-
-    :param lxml_etree:
-    :return:
-    """
-
-    for i, arg in enumerate(fn.args):
-
-        if hasattr(arg, "resolve_path"):
-        # if isinstance(arg, path.PathExpression):
-            if lxml_etree is None:
-                # If there is no LXML ETree, we substitute by an empty list
-                # As we would obviously not have been able to find these elements
-                fn.args.pop(i)
-            else:
-                # Substitute the old argument for the LXML elements.
-                resolved_args = arg.resolve_path(lxml_etree=lxml_etree)
-                if isinstance(resolved_args, list):
-                    # If a list is returned, we need to take out the original parameter and add
-                    #  all found values to list
-                    fn.args.pop(i)
-                    fn.args.extend(resolved_args)
-
-                    # If a single value has been returned, we can just replace the parameter
-                else:
-                    fn.args[i] = resolved_args
-
-def cast_parameters(fn, paramlist):
-    """
-    Attempt to get the value of the parameter, function or just take the int value if available.
-
-    :param paramlist:
-    :return:
-    """
-
-    args = []
-    for i, param in enumerate(fn.args):
-        if isinstance(param, Parameter):
-            param_value = param.resolve_parameter(paramlist=paramlist)
-
-            # Only add the parameter if a value is given.
-            if param_value is not None:
-
-                if isinstance(param_value, list):
-                    args.extend(param_value)
-                else:
-                    args.append(param_value)
-
-        elif isinstance(param, float) or isinstance(param, int):
-            args.append(param)
-
-        elif isinstance(param, partial):
-            # need to call function to get its value. This basically turns into a nested loop
-
-            # First call cast_parameters
-            args = cast_parameters(fn=param, paramlist=paramlist)
-
-            # Get the value
-            value = param()
-
-            # Add this value to the list of arguments.
-            args.append(value)
-
-        else:
-            print("Parameter not castable")
-            # logging.warning(f"Parameter type not castable: {type(param)}")
-    # fn.cast_args.extend(args)
-    return args
\ No newline at end of file
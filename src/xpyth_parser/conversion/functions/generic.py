@@ -1,4 +1,5 @@
-
+import threading
+from collections import OrderedDict
 from typing import Union, Optional
 from ..qname import QName
 
@@ -7,6 +8,14 @@ class FunctionRegistry:
     _instance = None
     functions = {}
 
+    # Names of functions which always give the same outcome for the same arguments.
+    # Outcomes of these functions are kept in pure_results, shared between evaluations.
+    pure_functions = set()
+    pure_results = OrderedDict()
+    pure_results_maxsize = 1024
+    # Evaluations run in several threads at once. Lookups move outcomes in the LRU order, so they are locked too.
+    pure_results_lock = threading.RLock()
+
     def __new__(cls, *args, **kwargs):
         if cls._instance is None:
             cls._instance = super().__new__(cls)
@@ -15,22 +24,19 @@ class FunctionRegistry:
     def __init__(
             self,
             custom_functions: Optional[dict] = None,
-            overwrite_functions: Optional[bool] = False
+            overwrite_functions: Optional[bool] = False,
+            pure: Optional[bool] = False,
     ):
         """
         Initialise the FunctionRegistry. In this singleton we keep track of all available functions.
         They are used by wrapping into the Function class.
 
         :param custom_functions:
+        :param pure: If set to True, the custom functions are declared pure. Their outcomes will be memoized
+            across evaluations, keyed by the function name and (atomic) arguments.
         """
 
-        if custom_functions is not None:
-            for function_name, function in custom_functions.items():
-                if function_name not in self.functions.keys():
-                    self.functions[function_name] = function
-                elif overwrite_functions is True:
-                    # Only overwrite functions if this is explicitly set
-                    self.functions[function_name] = function
+        self.add_functions(functions=custom_functions, overwrite_functions=overwrite_functions, pure=pure)
 
     def get_function(self, qname: Union[QName, str]):
 
@@ -43,7 +49,12 @@ class FunctionRegistry:
 
         return None
 
-    def add_functions(self, functions: dict = None, overwrite_functions: Optional[bool] = False):
+    def add_functions(
+            self,
+            functions: dict = None,
+            overwrite_functions: Optional[bool] = False,
+            pure: Optional[bool] = False,
+    ):
 
         if functions is not None:
             for function_name, function in functions.items():
@@ -52,6 +63,54 @@ class FunctionRegistry:
                 elif overwrite_functions is True:
                     # Only overwrite functions if this is explicitly set
                     self.functions[function_name] = function
+                    self.pure_functions.discard(function_name)
+                    self.clear_pure_results(function_name=function_name)
+
+                if pure is True and self.functions[function_name] is function:
+                    self.pure_functions.add(function_name)
+
+    def is_pure(self, qname: Union[QName, str]):
+        if isinstance(qname, QName):
+            qname = qname.__repr__()
+
+        return qname in self.pure_functions
+
+    def get_pure_result(self, key):
+        """
+        Get a memoized outcome of a pure function.
+
+        :param key: Tuple of function name and arguments
+        :return: Tuple of (found, outcome)
+        """
+        with self.pure_results_lock:
+            if key in self.pure_results:
+                # Mark as recently used
+                self.pure_results.move_to_end(key)
+                return True, self.pure_results[key]
+
+        return False, None
+
+    def set_pure_result(self, key, outcome):
+        with self.pure_results_lock:
+            self.pure_results[key] = outcome
+            self.pure_results.move_to_end(key)
+
+            # Evict the least recently used outcomes
+            while len(self.pure_results) > self.pure_results_maxsize:
+                self.pure_results.popitem(last=False)
+
+    def clear_pure_results(self, function_name: Optional[str] = None):
+        """
+        Forget memoized outcomes of pure functions.
+
+        :param function_name: Only forget outcomes of this function. If None, all outcomes are forgotten.
+        """
+        with self.pure_results_lock:
+            if function_name is None:
+                self.pure_results.clear()
+            else:
+                for key in [key for key in self.pure_results if key[0] == function_name]:
+                    del self.pure_results[key]
 
 class QuerySingleton:
     _instance = None
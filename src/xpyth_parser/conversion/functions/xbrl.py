@@ -1,14 +1,99 @@
+import lxml.etree
+
+from ..frame import current_frame
+from ..xbrl_index import XbrlIndex
+
+
+def xbrl_index(query):
+    """
+    Get the XbrlIndex of the document. The index of the ElementIndex of the evaluation is used, if it indexes the
+    document (see Document.build_index). Otherwise the index is kept by the Document or the evaluation, so it is
+    built once for all calls, also when every fact is passed on its own.
+
+    :param query: Root element of the document
+    """
+    frame = current_frame()
+    if frame is None:
+        return XbrlIndex.from_root(query)
+
+    element_index = frame.element_index
+    if element_index is not None and element_index.root is query:
+        return element_index.xbrl
+    if frame.xbrl_indexes is not None:
+        return frame.xbrl_indexes.index(query)
+    return XbrlIndex.from_root(query)
+
+
+def facts(argument):
+    """
+    Get the facts of an argument, which is a single fact or a sequence of facts
+    """
+    if isinstance(argument, lxml.etree._Element):
+        return [argument]
+    return [fact for fact in argument if isinstance(fact, lxml.etree._Element)]
+
+
+def per_fact(values):
+    """
+    Return a single value for a single fact, as paths do
+    """
+    if len(values) == 1:
+        return values[0]
+    return values
+
+
 def identifier(*args, **kwargs):
     """
     Gets the identifier of one or more XBRL facts
     :param self:
-    :return:
+    :return: Identifier (string) of every fact, or a single identifier for a single fact
     """
     # https://specifications.xbrl.org/registries/functions-registry-1.0/80132%20xfi.identifier/80132%20xfi.identifier%20function.html
-    for arg in args[0]:
-        context_ref = arg.get("contextRef")
-        q = kwargs['query']
-        context = q.xpath(f"/xbrli:xbrl/xbrli:context[@id='{context_ref}']/xbrli:entity/xbrli:identifier", namespaces=q.nsmap)
-        return context[0].text
+    index = xbrl_index(kwargs['query'])
+    contexts = [index.context_of(fact) for fact in facts(args[0])]
+    return per_fact([context.identifier for context in contexts if context is not None])
+
+
+def context(*args, **kwargs):
+    """
+    Gets the xbrli:context elements of one or more XBRL facts
+    """
+    index = xbrl_index(kwargs['query'])
+    contexts = [index.context_of(fact) for fact in facts(args[0])]
+    return per_fact([context.element for context in contexts if context is not None])
+
+
+def period(*args, **kwargs):
+    """
+    Gets the xbrli:period elements of one or more XBRL facts
+    """
+    index = xbrl_index(kwargs['query'])
+    contexts = [index.context_of(fact) for fact in facts(args[0])]
+    return per_fact([context.period_element for context in contexts if context is not None])
+
+
+def segment(*args, **kwargs):
+    """
+    Gets the xbrli:segment elements of one or more XBRL facts. Facts without a segment have none.
+    """
+    index = xbrl_index(kwargs['query'])
+    contexts = [index.context_of(fact) for fact in facts(args[0])]
+    return per_fact([context.segment for context in contexts if context is not None and context.segment is not None])
+
+
+def unit(*args, **kwargs):
+    """
+    Gets the xbrli:unit elements of one or more XBRL facts. Facts without a unit have none.
+    """
+    index = xbrl_index(kwargs['query'])
+    units = [index.unit_of(fact) for fact in facts(args[0])]
+    return per_fact([fact_unit.element for fact_unit in units if fact_unit is not None])
+
 
-function_list = {"xfi:identifier": identifier}
+function_list = {
+    "xfi:identifier": identifier,
+    "xfi:context": context,
+    "xfi:period": period,
+    "xfi:segment": segment,
+    "xfi:unit": unit,
+}
@@ -0,0 +1,59 @@
+"""
+Index of the elements of a document by name.
+
+Most paths of assertions are //prefix:concept. LXML answers each of those by walking the whole tree, so thousands of
+assertions against one instance walk the tree thousands of times. An ElementIndex walks the tree once, and keeps the
+elements of every name in document order. Paths that are a descendant name test from the root look their elements up
+in the index instead.
+"""
+from lxml import etree
+
+from .xbrl_index import XbrlIndex
+
+
+class ElementIndex:
+    def __init__(self, root):
+        """
+        Elements of a document per (namespace, local name), in document order, built in one walk over the tree.
+        The index is only valid as long as the document is not changed.
+
+        :param root: Root element of the document
+        """
+        self.root = root
+
+        # Tag of LXML ({namespace}localname, or localname without a namespace) to list of elements.
+        # Descendant paths select from the whole tree, also when the root is not the root of its tree.
+        self.elements_by_tag = {}
+        for element in root.getroottree().iter(etree.Element):
+            elements = self.elements_by_tag.get(element.tag)
+            if elements is None:
+                self.elements_by_tag[element.tag] = [element]
+            else:
+                elements.append(element)
+
+        self._xbrl = None
+
+    @property
+    def xbrl(self) -> XbrlIndex:
+        """
+        XbrlIndex of the contexts and units of the document, built from this index when it is first used
+        """
+        if self._xbrl is None:
+            self._xbrl = XbrlIndex.from_element_index(self)
+        return self._xbrl
+
+    def elements(self, namespace, localname):
+        """
+        Get the elements with a name, in document order
+
+        :param namespace: Namespace of the name, or None for names without a namespace
+        :return: New list of elements
+        """
+        tag = f"{{{namespace}}}{localname}" if namespace else localname
+        return list(self.elements_by_tag.get(tag, ()))
+
+    def __len__(self):
+        return sum(len(elements) for elements in self.elements_by_tag.values())
+
+    def __repr__(self):
+        return f"ElementIndex(names={len(self.elements_by_tag)}, elements={len(self)})"
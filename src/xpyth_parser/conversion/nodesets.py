@@ -0,0 +1,196 @@
+"""
+Set operations on node sequences (union, intersect and except).
+
+Nodes are compared by identity: LXML hands out the same element object for a node as long as it is referenced,
+which the document order index makes sure of. The results are in document order, as XPath requires.
+https://www.w3.org/TR/xpath-3/#combining_seq
+"""
+import threading
+from itertools import count
+
+import lxml.etree
+
+from .frame import current_frame
+
+# Every indexed document gets a number, so nodes of different documents have a stable order as well
+_document_numbers = count()
+
+# Positions within a document are below this number, so the number of the document can be put in front of them
+DOCUMENT_SIZE = 2 ** 40
+
+
+class DocumentOrders:
+    def __init__(self):
+        """
+        Position of every node of the documents that set operations were used on, keyed by root element.
+
+        The positions are kept by a Document, or by a Parser for the tree it was created with, so they are freed
+        together with the document or the Parser. Evaluations against another tree that is not a Document keep them
+        for that evaluation only, so each of those numbers the tree again. Evaluations can run in several threads at
+        once, so the positions are looked up and built under a lock.
+        """
+        self.indexes = {}
+        self.lock = threading.Lock()
+
+    def index(self, node):
+        """
+        Get the order key of every node of the document of the node. The index is built once per document and
+        rebuilt if the node is not part of it (anymore), for example because the document was changed.
+
+        :param node: LXML element
+        :return: Dict of node to its order key
+        """
+        root = node.getroottree().getroot()
+
+        with self.lock:
+            index = self.indexes.get(root)
+            if index is None or node not in index:
+                offset = next(_document_numbers) * DOCUMENT_SIZE
+                index = self.indexes[root] = dict(zip(root.iter(), count(offset)))
+
+        return index
+
+
+def document_order(node):
+    """
+    Get the order key of every node of the document of the node, from the DocumentOrders of the current evaluation
+
+    :param node: LXML element
+    :return: Dict of node to its order key
+    """
+    frame = current_frame()
+    document_orders = frame.document_orders if frame is not None else None
+    if document_orders is None:
+        # Outside of an evaluation the positions are not kept
+        document_orders = DocumentOrders()
+
+    return document_orders.index(node)
+
+
+def node_sequence(value):
+    """
+    Get the nodes of a (resolved) operand of a set operation
+
+    :param value: List of nodes, single node or None (the empty sequence)
+    :return: List of nodes
+    """
+    if value is None:
+        return []
+
+    if isinstance(value, lxml.etree._Element):
+        return [value]
+
+    nodes = [item for item in value if item is not None]
+    for node in nodes:
+        if not isinstance(node, lxml.etree._Element):
+            raise TypeError(f"Set operations are only defined on sequences of nodes, got '{node}'")
+
+    return nodes
+
+
+def order_keys(nodes):
+    """
+    Get a key for every node which sorts the nodes in document order.
+    Nodes of different documents are ordered by the order in which their documents were indexed.
+
+    :return: List of keys
+    """
+    if not nodes:
+        return []
+
+    index = document_order(nodes[0])
+    try:
+        return [index[node] for node in nodes]
+    except KeyError:
+        # Not all nodes are part of the same document
+        return [document_order(node)[node] for node in nodes]
+
+
+def in_document_order(nodes):
+    """
+    Get the nodes and their keys in document order. Path results already are, so mostly this is only a check.
+
+    :return: Tuple of (list of nodes, list of keys)
+    """
+    keys = order_keys(nodes)
+    if any(keys[i] > keys[i + 1] for i in range(len(keys) - 1)):
+        ordered = sorted(zip(keys, nodes), key=lambda key_node: key_node[0])
+        keys = [key for key, node in ordered]
+        nodes = [node for key, node in ordered]
+
+    return nodes, keys
+
+
+def union(left, right):
+    """
+    Nodes that occur in either operand, without duplicates, in document order.
+    Both operands are put in document order, after which they are merged in one pass.
+    """
+    left, left_keys = in_document_order(node_sequence(left))
+    right, right_keys = in_document_order(node_sequence(right))
+
+    nodes = []
+    last_key = None
+    i, j = 0, 0
+    while i < len(left) or j < len(right):
+        if j >= len(right) or (i < len(left) and left_keys[i] <= right_keys[j]):
+            node, key = left[i], left_keys[i]
+            i += 1
+        else:
+            node, key = right[j], right_keys[j]
+            j += 1
+
+        if key != last_key:
+            # Duplicate nodes have the same key, and follow each other after merging
+            nodes.append(node)
+            last_key = key
+
+    return nodes
+
+
+def intersect(left, right):
+    """
+    Nodes that occur in both operands, in document order.
+    Both operands are put in document order, after which they are merged in one pass.
+    """
+    left, left_keys = in_document_order(node_sequence(left))
+    right, right_keys = in_document_order(node_sequence(right))
+
+    nodes = []
+    last_key = None
+    i, j = 0, 0
+    while i < len(left) and j < len(right):
+        if left_keys[i] < right_keys[j]:
+            i += 1
+        elif left_keys[i] > right_keys[j]:
+            j += 1
+        else:
+            if left_keys[i] != last_key:
+                nodes.append(left[i])
+                last_key = left_keys[i]
+            i += 1
+            j += 1
+
+    return nodes
+
+
+def except_(left, right):
+    """
+    Nodes that occur in the left operand, but not in the right operand, in document order.
+    Both operands are put in document order, after which they are merged in one pass.
+    """
+    left, left_keys = in_document_order(node_sequence(left))
+    right, right_keys = in_document_order(node_sequence(right))
+
+    nodes = []
+    last_key = None
+    j = 0
+    for node, key in zip(left, left_keys):
+        while j < len(right) and right_keys[j] < key:
+            j += 1
+
+        if key != last_key and not (j < len(right) and right_keys[j] == key):
+            nodes.append(node)
+        last_key = key
+
+    return nodes
@@ -1,5 +1,9 @@
+from contextvars import ContextVar
 from decimal import Decimal
 
+# If set, decimal literals (like 1.50) are parsed to Decimal instead of float. Set by the Parser in decimal mode.
+decimal_literals = ContextVar("decimal_literals", default=False)
+
 
 def str_to_int(value):
     i = value[0]
@@ -25,3 +29,12 @@ def str_to_float(value):
             exp = value[2]
         return float(f"{value[0]}{value[1]}{exp_sign}{exp}")
     return float(value[0])
+
+
+def str_to_decimal_literal(value):
+    """
+    Parse a decimal literal. This is a float, unless the expression is parsed in decimal mode.
+    """
+    if decimal_literals.get():
+        return str_to_dec(value)
+    return str_to_float(value)
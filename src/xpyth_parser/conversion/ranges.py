@@ -0,0 +1,118 @@
+"""
+Integer ranges, the outcome of range expressions (1 to 100).
+
+A range is not expanded into a list of integers. Its length, sum, minimum, maximum, items at positions and
+membership are computed from its bounds, so aggregates over 1 to N take constant time.
+https://www.w3.org/TR/xpath-3/#id-range-expressions
+"""
+import math
+from decimal import Decimal
+
+
+class IntegerRange:
+    __slots__ = ("start", "end")
+
+    def __init__(self, start: int, end: int):
+        """
+        Sequence of the consecutive integers from start up to and including end. If start is greater than end,
+        the sequence is empty.
+        """
+        self.start = start
+        self.end = end
+
+    def __len__(self):
+        return max(0, self.end - self.start + 1)
+
+    def __iter__(self):
+        return iter(range(self.start, self.end + 1))
+
+    def __reversed__(self):
+        return reversed(range(self.start, self.end + 1))
+
+    def __contains__(self, item):
+        if isinstance(item, bool) or not isinstance(item, (int, float, Decimal)):
+            return False
+        if not self.start <= item <= self.end:
+            # Also rules out NaN and infinity
+            return False
+        return item == int(item)
+
+    def __getitem__(self, index):
+        """
+        Get the item at a (zero based) index, or the items of a slice. Slices of ranges are ranges.
+        """
+        items = range(self.start, self.end + 1)[index]
+        if isinstance(items, range):
+            if items.step == 1:
+                return IntegerRange(items.start, items.stop - 1)
+            return list(items)
+        return items
+
+    def __eq__(self, other):
+        if isinstance(other, IntegerRange):
+            return len(self) == len(other) == 0 or (self.start, self.end) == (other.start, other.end)
+        if isinstance(other, range):
+            return range(self.start, self.end + 1) == other
+        if isinstance(other, (list, tuple)):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    def __hash__(self):
+        if len(self) == 0:
+            return hash(IntegerRange)
+        return hash((IntegerRange, self.start, self.end))
+
+    def __repr__(self):
+        return f"IntegerRange({self.start}, {self.end})"
+
+    def sum(self):
+        """
+        Sum of the integers, as arithmetic series
+        """
+        return len(self) * (self.start + self.end) // 2
+
+    def min(self):
+        return self.start
+
+    def max(self):
+        return self.end
+
+
+def range_bound(value):
+    """
+    Get the integer of an operand of a range expression
+
+    :return: Integer, or None if the operand is the empty sequence
+    """
+    if isinstance(value, (list, tuple)):
+        if len(value) == 0:
+            return None
+        if len(value) > 1:
+            raise TypeError(f"Operand of a range expression should be a single integer, got {len(value)} items")
+        value = value[0]
+
+    if value is None:
+        return None
+
+    if isinstance(value, str):
+        # Untyped values are cast to integer
+        return int(value.strip())
+
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+
+    if isinstance(value, (float, Decimal)) and math.isfinite(value) and value == int(value):
+        return int(value)
+
+    raise TypeError(f"Operand of a range expression should be an integer, got '{value}'")
+
+
+def integer_range(start, end):
+    """
+    Outcome of 'start to end'. If either operand is the empty sequence, so is the outcome.
+    """
+    start, end = range_bound(start), range_bound(end)
+    if start is None or end is None:
+        return []
+
+    return IntegerRange(start, end)
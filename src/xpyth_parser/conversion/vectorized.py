@@ -0,0 +1,163 @@
+"""
+Vectorized aggregation of large node sequences.
+
+NumPy is an optional dependency. If it is not installed, all functions in this module return None
+and the aggregate functions fall back to their pure Python implementation.
+"""
+import warnings
+
+import lxml.etree
+
+from .atomize import current_atomizer, INTEGER, DECIMAL, DOUBLE
+from .frame import in_decimal_mode
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Creating an array has some overhead. Below this number of elements the pure Python implementation is faster.
+VECTORIZE_THRESHOLD = 1000
+
+# Values with more digits might not fit in a 64 bit integer
+MAX_INT64_DIGITS = 18
+
+# Largest absolute value a sum of 64 bit integers can hold
+INT64_MAX = 2 ** 63 - 1
+
+
+def vectorize_elements(elements):
+    """
+    Atomize a sequence of LXML elements into a typed NumPy array, in one pass over the elements.
+    Integer values become an int64 array, other numeric values a float64 array (except in decimal mode).
+
+    :param elements: List of LXML elements
+    :return: NumPy array, or None if the elements can not (or should not) be vectorized
+    """
+    if numpy is None or not isinstance(elements, list) or len(elements) < VECTORIZE_THRESHOLD:
+        return None
+
+    atomizer = current_atomizer()
+    if atomizer.type_hints and any(
+            atomizer.declared_kind(tag) not in (None, INTEGER, DOUBLE)
+            for tag in {element.tag for element in elements if isinstance(element, lxml.etree._Element)}
+    ):
+        # Some elements are declared to hold values which can not be put into an int64 or float64 array
+        return None
+
+    texts = [element.text if isinstance(element, lxml.etree._Element) else None for element in elements]
+    if not all(texts) or max(map(len, texts)) > MAX_INT64_DIGITS or any(map(str.isspace, texts)):
+        # Not every item is an element with a (short enough) text value
+        return None
+
+    # NumPy parses the joined text values in C. Depending on the version, it either raises an error or stops at
+    # the first value that it can not parse. The latter we notice by comparing the length of the array with
+    # the number of elements.
+    # In decimal mode, decimal values should not become floats
+    dtypes = (numpy.int64,) if in_decimal_mode() else (numpy.int64, numpy.float64)
+
+    joined_texts = " ".join(texts)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        for dtype in dtypes:
+            try:
+                vector = numpy.fromstring(joined_texts, dtype=dtype, sep=" ")
+            except ValueError:
+                continue
+
+            if len(vector) == len(texts):
+                return vector
+
+    # Not all values are numeric
+    return None
+
+
+def vectorize_decimals(elements):
+    """
+    Atomize a sequence of LXML elements with decimal values that all have the same number of decimals (like
+    monetary values) into an int64 NumPy array of values scaled by 10 ** scale. "12.50" becomes 1250 with scale 2.
+    Summing the array is exact, unlike summing floats.
+
+    :param elements: List of LXML elements
+    :return: Tuple of (NumPy array, scale), or None if the elements can not (or should not) be vectorized
+    """
+    if numpy is None or not isinstance(elements, list) or len(elements) < VECTORIZE_THRESHOLD:
+        return None
+
+    atomizer = current_atomizer()
+    if atomizer.type_hints and any(
+            atomizer.declared_kind(tag) not in (None, INTEGER, DECIMAL)
+            for tag in {element.tag for element in elements if isinstance(element, lxml.etree._Element)}
+    ):
+        # Some elements are declared to hold values which are not decimals
+        return None
+
+    texts = [element.text if isinstance(element, lxml.etree._Element) else None for element in elements]
+    if not all(texts) or max(map(len, texts)) > MAX_INT64_DIGITS + 1:
+        # Not every item is an element with a (short enough) text value
+        return None
+
+    dot = texts[0].find(".")
+    scale = 0 if dot == -1 else len(texts[0]) - dot - 1
+
+    # Check that every value has its decimal point at the same distance from its end. The values are joined by a
+    # separator which can not be part of an XML text value.
+    joined_texts = "\x00".join(texts)
+    try:
+        characters = numpy.frombuffer(joined_texts.encode("ascii"), dtype=numpy.uint8)
+    except UnicodeEncodeError:
+        return None
+
+    dots = numpy.flatnonzero(characters == ord("."))
+    if scale == 0:
+        if len(dots) > 0:
+            return None
+    else:
+        ends = numpy.append(numpy.flatnonzero(characters == 0), len(characters))
+        if len(dots) != len(texts) or not (ends - dots == scale + 1).all():
+            return None
+
+    # Without the decimal points, the values are integers. NumPy checks their digits while parsing.
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        try:
+            vector = numpy.fromstring(
+                joined_texts.replace(".", "").replace("\x00", " "), dtype=numpy.int64, sep=" "
+            )
+        except ValueError:
+            return None
+
+    if len(vector) != len(texts):
+        return None
+
+    return vector, scale
+
+
+def vector_sum(vector):
+    """
+    Sum a vector. Integer sums which might not fit in 64 bits are summed using Python integers.
+
+    :param vector: NumPy array
+    :return: Python int or float
+    """
+    if len(vector) == 0:
+        return 0
+
+    if vector.dtype.kind == "i":
+        largest = max(abs(int(vector.max())), abs(int(vector.min())))
+        if largest * len(vector) > INT64_MAX:
+            return sum(vector.tolist())
+
+    return vector.sum().item()
+
+
+def vector_avg(vector):
+    return vector_sum(vector) / len(vector)
+
+
+def vector_min(vector):
+    return vector.min().item()
+
+
+def vector_max(vector):
+    return vector.max().item()
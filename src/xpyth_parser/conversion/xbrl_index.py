@@ -0,0 +1,238 @@
+"""
+Contexts and units of an XBRL instance, by id.
+
+Every fact refers to a context (and numeric facts to a unit) by id. Looking that context up with a query scans all
+contexts of the instance, for every fact. An XbrlIndex finds the contexts and units once, and parses the entity
+identifier, period and dimensions of a context the first time it is used.
+"""
+import threading
+
+from isodate import parse_date, parse_datetime
+
+XBRLI = "http://www.xbrl.org/2003/instance"
+XBRLDI = "http://xbrl.org/2006/xbrldi"
+
+CONTEXT = f"{{{XBRLI}}}context"
+UNIT = f"{{{XBRLI}}}unit"
+
+
+def clark_value(element, value):
+    """
+    Resolve a QName in element content or an attribute, like ns:Member, to {namespace}localname
+    """
+    value = value.strip()
+    prefix, _, localname = value.rpartition(":")
+    namespace = element.nsmap.get(prefix or None)
+    return f"{{{namespace}}}{localname}" if namespace else localname
+
+
+def parse_period_date(text):
+    """
+    Parse the date or date and time of a period
+
+    :return: datetime.date, or datetime.datetime if the period has a time
+    """
+    text = text.strip()
+    if "T" in text:
+        return parse_datetime(text)
+    return parse_date(text)
+
+
+class Period:
+    def __init__(self, instant=None, start=None, end=None, forever=False):
+        """
+        Period of a context: an instant, a duration from start to end, or forever
+        """
+        self.instant = instant
+        self.start = start
+        self.end = end
+        self.forever = forever
+
+    @classmethod
+    def from_element(cls, period):
+        """
+        :param period: xbrli:period element
+        """
+        instant = period.find(f"{{{XBRLI}}}instant")
+        if instant is not None:
+            return cls(instant=parse_period_date(instant.text))
+        if period.find(f"{{{XBRLI}}}forever") is not None:
+            return cls(forever=True)
+        return cls(start=parse_period_date(period.findtext(f"{{{XBRLI}}}startDate")),
+                   end=parse_period_date(period.findtext(f"{{{XBRLI}}}endDate")))
+
+    @property
+    def is_instant(self):
+        return self.instant is not None
+
+    def __eq__(self, other):
+        if not isinstance(other, Period):
+            return NotImplemented
+        return (self.instant, self.start, self.end, self.forever) == \
+            (other.instant, other.start, other.end, other.forever)
+
+    def __hash__(self):
+        return hash((self.instant, self.start, self.end, self.forever))
+
+    def __repr__(self):
+        if self.forever:
+            return "Period(forever)"
+        if self.is_instant:
+            return f"Period(instant={self.instant})"
+        return f"Period(start={self.start}, end={self.end})"
+
+
+class Context:
+    def __init__(self, element):
+        """
+        Parsed xbrli:context
+
+        :param element: xbrli:context element
+        """
+        self.element = element
+        self.id = element.get("id")
+
+        identifier = element.find(f"{{{XBRLI}}}entity/{{{XBRLI}}}identifier")
+        self.identifier_element = identifier
+        self.scheme = identifier.get("scheme") if identifier is not None else None
+        self.identifier = identifier.text.strip() if identifier is not None and identifier.text else None
+
+        self.period_element = element.find(f"{{{XBRLI}}}period")
+        self.period = Period.from_element(self.period_element) if self.period_element is not None else None
+
+        self.segment = element.find(f"{{{XBRLI}}}entity/{{{XBRLI}}}segment")
+        self.scenario = element.find(f"{{{XBRLI}}}scenario")
+
+        # Dimension to member ({namespace}localname) of explicit members, dimension to element of typed members,
+        # of the segment and scenario together
+        self.explicit_members = {}
+        self.typed_members = {}
+        for container in (self.segment, self.scenario):
+            if container is None:
+                continue
+            for member in container.iterchildren(f"{{{XBRLDI}}}explicitMember"):
+                self.explicit_members[clark_value(member, member.get("dimension"))] = clark_value(member, member.text)
+            for member in container.iterchildren(f"{{{XBRLDI}}}typedMember"):
+                self.typed_members[clark_value(member, member.get("dimension"))] = member
+
+    def __repr__(self):
+        return f"Context(id='{self.id}', identifier='{self.identifier}', period={self.period})"
+
+
+class Unit:
+    def __init__(self, element):
+        """
+        Parsed xbrli:unit
+
+        :param element: xbrli:unit element
+        """
+        self.element = element
+        self.id = element.get("id")
+
+        divide = element.find(f"{{{XBRLI}}}divide")
+        if divide is not None:
+            numerator = divide.findall(f"{{{XBRLI}}}unitNumerator/{{{XBRLI}}}measure")
+            denominator = divide.findall(f"{{{XBRLI}}}unitDenominator/{{{XBRLI}}}measure")
+        else:
+            numerator = element.findall(f"{{{XBRLI}}}measure")
+            denominator = []
+
+        # Measures as {namespace}localname, like {http://www.xbrl.org/2003/iso4217}EUR
+        self.numerator = tuple(sorted(clark_value(measure, measure.text) for measure in numerator))
+        self.denominator = tuple(sorted(clark_value(measure, measure.text) for measure in denominator))
+
+    def __repr__(self):
+        return f"Unit(id='{self.id}', numerator={self.numerator}, denominator={self.denominator})"
+
+
+class XbrlIndex:
+    def __init__(self, contexts, units):
+        """
+        Contexts and units of an instance by id. Contexts and units are parsed when they are first looked up.
+
+        :param contexts: xbrli:context elements
+        :param units: xbrli:unit elements
+        """
+        self.context_elements = {element.get("id"): element for element in contexts}
+        self.unit_elements = {element.get("id"): element for element in units}
+
+        # Parsed contexts and units, by id
+        self.contexts = {}
+        self.units = {}
+
+    @classmethod
+    def from_root(cls, root):
+        """
+        Index the contexts and units of an instance, which are children of the root element
+        """
+        return cls(contexts=root.iterchildren(CONTEXT), units=root.iterchildren(UNIT))
+
+    @classmethod
+    def from_element_index(cls, element_index):
+        """
+        Index the contexts and units an ElementIndex found, without walking the tree again
+        """
+        return cls(contexts=element_index.elements(XBRLI, "context"), units=element_index.elements(XBRLI, "unit"))
+
+    def context(self, context_id):
+        """
+        :return: Context with the id, or None if there is none
+        """
+        context = self.contexts.get(context_id)
+        if context is None:
+            element = self.context_elements.get(context_id)
+            if element is None:
+                return None
+            context = self.contexts[context_id] = Context(element)
+        return context
+
+    def unit(self, unit_id):
+        """
+        :return: Unit with the id, or None if there is none
+        """
+        unit = self.units.get(unit_id)
+        if unit is None:
+            element = self.unit_elements.get(unit_id)
+            if element is None:
+                return None
+            unit = self.units[unit_id] = Unit(element)
+        return unit
+
+    def context_of(self, fact):
+        """
+        :return: Context of a fact, or None if it has no (known) context
+        """
+        return self.context(fact.get("contextRef"))
+
+    def unit_of(self, fact):
+        """
+        :return: Unit of a fact, or None if it has no (known) unit
+        """
+        return self.unit(fact.get("unitRef"))
+
+    def __repr__(self):
+        return f"XbrlIndex(contexts={len(self.context_elements)}, units={len(self.unit_elements)})"
+
+
+class XbrlIndexes:
+    def __init__(self):
+        """
+        XbrlIndex of every document the XBRL functions were used on, keyed by root element. Kept by a Document, by a
+        Parser for the tree it was created with, or else by an evaluation, so they are freed together with the
+        document, the Parser or the evaluation. Indexes are looked up and built under a lock, as evaluations can run
+        in several threads at once.
+        """
+        self.indexes = {}
+        self.lock = threading.Lock()
+
+    def index(self, root):
+        """
+        Get the XbrlIndex of a document, built the first time it is asked for
+
+        :param root: Root element of the document
+        """
+        with self.lock:
+            index = self.indexes.get(root)
+            if index is None:
+                index = self.indexes[root] = XbrlIndex.from_root(root)
+        return index
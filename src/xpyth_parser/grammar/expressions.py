@@ -1,7 +1,13 @@
 import functools
+import itertools
 import operator
+import threading
 import types
+from collections import ChainMap
+from contextvars import ContextVar
+from decimal import Decimal
 
+import lxml.etree
 import pyparsing
 from pyparsing import (
     Combine,
@@ -16,7 +22,6 @@ from pyparsing import (
 )
 
 from .qualified_names import VariableRegistry
-from ..conversion.functions.generic import QuerySingleton
 from ..conversion.tests import processingInstructionTest, anyKindTest, textTest, commentTest, schemaAttributeTest, \
     elementTest, schemaElementTest, documentTest
 
@@ -25,8 +30,15 @@ var_reg = VariableRegistry()
 
 from .literals import l_par_l, l_par_r, l_dot, t_NCName, t_IntegerLiteral, t_Literal, t_StringLiteral
 
-from ..conversion.function import get_function, resolve_paths, cast_parameters
-from ..conversion.qname import Parameter, qname_from_parse_results
+from ..conversion.atomize import current_atomizer
+from ..conversion.budget import current_budget
+from ..conversion.decimals import promote_operands
+from ..conversion.frame import EvaluationFrame, current_frame, in_decimal_mode
+from ..conversion.nodesets import union, intersect, except_
+from ..conversion.function import get_function, cast_lxml_elements, FunctionCall
+from ..conversion.primaries import decimal_literals
+from ..conversion.qname import Parameter, QName, qname_from_parse_results
+from ..conversion.ranges import IntegerRange, integer_range
 
 xpath_version = "3.1"
 
@@ -68,39 +80,84 @@ t_VarName = t_AtomicType = t_ElementName = t_TypeName = t_AttributeName = t_QNam
 t_VarName.setName("Varname")
 
 def get_variable(toks):
+    """
+    Variable reference. The value of the variable is looked up when the expression is evaluated,
+    so the same syntax tree can be evaluated with other variables.
+    """
+    return Parameter(qname=toks[0])
 
-    var_name = toks[0]
 
-    if len(toks) > 1:
-        return Parameter(qname=toks[0], type_declaration=toks[1])
+# Strings are parsed by one thread at a time
+parse_lock = threading.Lock()
+
+
+@functools.lru_cache(maxsize=1024)
+def parse_variable(text, decimal_mode):
+    """
+    Parse the string value of a variable as an XPath expression. Parsed values are kept, so a variable
+    is only parsed once, also when it is used by many evaluations.
+
+    :param text: Value of the variable
+    :param decimal_mode: If True, decimal literals are parsed as Decimal
+    :return: Syntax tree of the value
+    """
+    with parse_lock:
+        token = decimal_literals.set(decimal_mode)
+        try:
+            return t_XPath.parseString(text, parseAll=True)[0].expr
+        finally:
+            decimal_literals.reset(token)
+
+
+def variable_value(qname, variable_map, lxml_etree, context_item_value=None):
+    """
+    Get the value of a variable. Variables that are passed to the evaluation take precedence over the
+    variables in the registry. String values are parsed and evaluated as XPath expressions.
+
+    :param qname: Name of the variable
+    :param variable_map: Dict of variable name to value
+    :return: Value of the variable. Sequences of one item are unpacked.
+    """
+    variable_name = qname.__repr__()
+    if variable_map and variable_name in variable_map.keys():
+        values = variable_map[variable_name]
+        if isinstance(values, BoundValue):
+            return values.value
     else:
+        values = var_reg.get_variable(qname)
 
-        for var in var_reg.get_variable(toks[0]):
-        # return Parameter(qname=v[0])
-            if isinstance(var, str):
+    if not isinstance(values, list):
+        values = [values]
 
-                parsed_var = t_XPath.parseString(var, parseAll=True)
-                parsed_var = parsed_var[0].expr
+    resolved_values = []
+    for value in values:
+        if isinstance(value, str):
+            value = resolve_expression(
+                parse_variable(value, in_decimal_mode()),
+                variable_map=variable_map,
+                lxml_etree=lxml_etree,
+                context_item_value=context_item_value,
+            )
 
+        if isinstance(value, (list, tuple, range, IntegerRange)):
+            resolved_values.extend(value)
+        else:
+            resolved_values.append(value)
 
-                # try:
-                #     # Parse the individual value as if it is an XPath expression
-                #     parsed_var = t_XPath.parseString(var, parseAll=True)
-                #
-                #     # Unpack the outcome
-                #     parsed_var = parsed_var[0].expr
-                #
-                # except:
-                #     logging.warning(f"Could not parse parameter '{var_name}', value '{var}'")
-                #     parsed_var = var
+    if len(resolved_values) == 1:
+        return resolved_values[0]
 
-                yield parsed_var
+    return resolved_values
 
-            elif isinstance(var, int) or isinstance(var, float):
-                yield var
+class BoundValue:
+    def __init__(self, value):
+        """
+        Value of a variable that is bound by the expression itself, like the variable of a for expression.
+        Bound values are used as they are, instead of being parsed as XPath like the string values of
+        variables that are passed to the Parser.
+        """
+        self.value = value
 
-            else:
-                print("Really expected a string as variable")
 
 t_VarRef = Suppress(Literal("$")) + t_VarName
 t_VarRef.setParseAction(get_variable)
@@ -121,20 +178,19 @@ t_ExprSingle.setName("ExprSingle")
 t_SimpleForBinding = Literal("$") + t_VarName + Keyword("in") + t_ExprSingle
 t_SimpleForBinding.setName("SimpleForBinding")
 t_SimpleForClause = (
-    Keyword("for") + t_SimpleForBinding + Optional(Literal(",") + t_SimpleForBinding)
+    Keyword("for") + t_SimpleForBinding + ZeroOrMore(Literal(",") + t_SimpleForBinding)
 )
 t_SimpleForClause.setName("SimpleForClause")
 
 t_ForExpr = t_SimpleForClause + Keyword("return") + t_ExprSingle
 t_ForExpr.setName("ForExpr")
-t_QuantifiedExpr = OneOrMore(
-    Keyword("some")
-    | Keyword("every")
-    + Literal("$")
-    + t_VarName
-    + Keyword("in")
-    + t_ExprSingle
-    + ZeroOrMore(Literal(",") + Literal("$") + t_VarName + Keyword("in") + t_ExprSingle)
+# QuantifiedExpr ::= ("some" | "every") "$" VarName "in" ExprSingle ("," "$" VarName "in" ExprSingle)*
+#                    "satisfies" ExprSingle
+# The bindings are the same as those of a for expression
+t_QuantifiedExpr = (
+    (Keyword("some") | Keyword("every"))
+    + t_SimpleForBinding
+    + ZeroOrMore(Literal(",") + t_SimpleForBinding)
     + Keyword("satisfies")
     + t_ExprSingle
 )
@@ -153,116 +209,934 @@ class IfExpression(Expr):
         self.then_expr = then_expr
         self.else_expr = else_expr
 
-    def resolve_expression(self, test_outcome, variable_map, lxml_etree):
+    @property
+    def _children(self):
+        return [self.test_expr, self.then_expr, self.else_expr]
 
+    def branch(self, test_outcome):
+        """
+        Get the expression which gives the outcome, depending on the outcome of the test
+
+        :return: The 'then' or the 'else' expression
+        """
         # Then and Else are both SingleExpressions
         if test_outcome is True:
-            # Test has succeeded, so we return the 'then' ExprSingle
-            return_expr = resolve_expression(expression=self.then_expr, variable_map=variable_map, lxml_etree=lxml_etree)
+            return self.then_expr
+        return self.else_expr
+
+    def resolve_expression(self, test_outcome, variable_map, lxml_etree, context_item_value=None):
+        return resolve_expression(expression=self.branch(test_outcome), variable_map=variable_map,
+                                  lxml_etree=lxml_etree, context_item_value=context_item_value)
+
+
+class VariableBinding:
+    def __init__(self, qname, expr):
+        """
+        Binding of a variable to the items of an expression, like '$x in //fact' in a for expression
+
+        :param qname: Name of the variable
+        :param expr: Expression which gives the items the variable is bound to
+        """
+        self.qname = qname
+        self.expr = expr
+
+
+class ForExpression(Expr):
+    def __init__(self, bindings, return_expr):
+        """
+        For expression: for $x in S return R. R is evaluated for every item of S, and the outcomes are
+        concatenated. https://www.w3.org/TR/xpath-3/#id-for-expressions
+
+        The outcome is produced one item at a time. Aggregate functions consume the items as they are produced,
+        so sum(for $x in //fact return $x * 2) is computed in a single pass, without intermediate lists.
+
+        :param bindings: List of VariableBinding. Multiple bindings are nested loops.
+        :param return_expr: Expression that is evaluated for every combination of bound items
+        """
+        self.bindings = bindings
+        self.return_expr = return_expr
+
+        # Outcomes of function calls depend on the bound variables, so if the return expression calls functions,
+        # every iteration gets an evaluation frame of its own.
+        self.calls_functions = any(isinstance(node, FunctionCall) for node in walk(return_expr))
+
+    @property
+    def _children(self):
+        return [binding.expr for binding in self.bindings] + [self.return_expr]
+
+    def iterate(self, variable_map, lxml_etree, context_item_value=None):
+        """
+        Evaluate the return expression for every bound item
+
+        :return: Generator of the items of the outcome
+        """
+        for scope in bound_scopes(self.bindings, variable_map=variable_map, lxml_etree=lxml_etree,
+                                  context_item_value=context_item_value):
+            if self.calls_functions:
+                with EvaluationFrame(variables=scope):
+                    value = resolve_expression(self.return_expr, variable_map=scope, lxml_etree=lxml_etree,
+                                               context_item_value=context_item_value)
+            else:
+                value = resolve_expression(self.return_expr, variable_map=scope, lxml_etree=lxml_etree,
+                                           context_item_value=context_item_value)
+
+            yield from sequence_items(value)
+
+
+class SimpleMapExpression(Expr):
+    def __init__(self, steps):
+        """
+        Simple map expression: S ! E. E is evaluated for every item of S, with the item as context item, and the
+        outcomes are concatenated. https://www.w3.org/TR/xpath-3/#id-map-operator
+
+        Like a for expression, the outcome is produced one item at a time, so sum(//fact ! xs:decimal(.)) is
+        computed in a single pass.
+
+        :param steps: List of expressions. The first expression gives the items the second is evaluated for, etc.
+        """
+        self.steps = steps
+
+    @property
+    def _children(self):
+        return list(self.steps)
+
+    def iterate(self, variable_map, lxml_etree, context_item_value=None):
+        """
+        Evaluate the steps for every item of the step before
+
+        :return: Iterator of the items of the outcome
+        """
+        items = iterate_expression(self.steps[0], variable_map=variable_map, lxml_etree=lxml_etree,
+                                   context_item_value=context_item_value)
+        for step in self.steps[1:]:
+            items = self.map_items(items, step, variable_map=variable_map, lxml_etree=lxml_etree)
+
+        return items
+
+    @staticmethod
+    def map_items(items, step, variable_map, lxml_etree):
+        """
+        Evaluate a step with every item as context item
+
+        :param items: Iterable of items
+        :return: Generator of the items of the outcomes
+        """
+        budget = current_budget()
+        for position, context_item in enumerate(items, start=1):
+            if budget is not None:
+                budget.item()
+
+            # Outcomes of function calls in the step differ per context item, so every item gets a frame of its own
+            with EvaluationFrame(position=position, context_item=context_item, variables=variable_map):
+                value = resolve_expression(step, variable_map=variable_map, lxml_etree=lxml_etree,
+                                           context_item_value=context_item)
+
+            yield from sequence_items(value)
+
+
+class QuantifiedExpression(Expr):
+    def __init__(self, quantifier, bindings, satisfies_expr):
+        """
+        Quantified expression: some/every $x in S satisfies P. https://www.w3.org/TR/xpath-3/#id-quantified-expressions
+
+        The items of S are bound one at a time. Evaluation stops at the first item that satisfies P (some),
+        or at the first item that does not (every). Multiple bindings are nested loops, so the combinations
+        of items are produced one at a time as well.
+
+        :param quantifier: "some" or "every"
+        :param bindings: List of VariableBinding
+        :param satisfies_expr: Test expression
+        """
+        self.quantifier = quantifier
+        self.bindings = bindings
+        self.satisfies_expr = satisfies_expr
+
+        self.calls_functions = any(isinstance(node, FunctionCall) for node in walk(satisfies_expr))
+
+    @property
+    def _children(self):
+        return [binding.expr for binding in self.bindings] + [self.satisfies_expr]
+
+    def outcomes(self, variable_map, lxml_etree, context_item_value=None):
+        """
+        Evaluate the test expression for every combination of bound items
+
+        :return: Generator of effective boolean values
+        """
+        for scope in bound_scopes(self.bindings, variable_map=variable_map, lxml_etree=lxml_etree,
+                                  context_item_value=context_item_value):
+            if self.calls_functions:
+                with EvaluationFrame(variables=scope):
+                    outcome = resolve_expression(self.satisfies_expr, variable_map=scope, lxml_etree=lxml_etree,
+                                                 context_item_value=context_item_value)
+            else:
+                outcome = resolve_expression(self.satisfies_expr, variable_map=scope, lxml_etree=lxml_etree,
+                                             context_item_value=context_item_value)
+
+            yield effective_boolean_value(outcome)
+
+    def answer(self, variable_map, lxml_etree, context_item_value=None):
+        outcomes = self.outcomes(variable_map=variable_map, lxml_etree=lxml_etree,
+                                 context_item_value=context_item_value)
+        if self.quantifier == "some":
+            return any(outcomes)
+        return all(outcomes)
+
+
+def bound_scopes(bindings, variable_map, lxml_etree, context_item_value=None, binding_index=0):
+    """
+    Bind the variables to every combination of their items, as nested loops. The items of the first binding
+    are streamed, the items of the other bindings are evaluated for every item they are nested in.
+
+    :param bindings: List of VariableBinding
+    :param variable_map: Variables the expressions of the bindings can refer to
+    :return: Generator of variable scopes, with the bound variables in front of the variable map
+    """
+    binding = bindings[binding_index]
+    variable_name = binding.qname.__repr__()
+
+    if binding_index == 0:
+        items = iterate_expression(binding.expr, variable_map=variable_map, lxml_etree=lxml_etree,
+                                   context_item_value=context_item_value)
+    else:
+        # Items of inner bindings can depend on the variables of the outer bindings
+        with EvaluationFrame(variables=variable_map):
+            items = list(iterate_expression(binding.expr, variable_map=variable_map, lxml_etree=lxml_etree,
+                                            context_item_value=context_item_value))
+
+    budget = current_budget()
+    for item in items:
+        if budget is not None:
+            budget.item()
+
+        scope = ChainMap({variable_name: BoundValue(item)}, variable_map)
+
+        if binding_index + 1 < len(bindings):
+            yield from bound_scopes(bindings, variable_map=scope, lxml_etree=lxml_etree,
+                                    context_item_value=context_item_value, binding_index=binding_index + 1)
         else:
+            yield scope
+
+
+def get_for_binding(toks):
+    # $ VarName in ExprSingle
+    return VariableBinding(qname=toks[1], expr=toks[3])
+
 
-            return_expr = resolve_expression(expression=self.else_expr, variable_map=variable_map, lxml_etree=lxml_etree)
-        return return_expr
+def get_for_expr(toks):
+    bindings = [tok for tok in toks if isinstance(tok, VariableBinding)]
+    return ForExpression(bindings=bindings, return_expr=toks[-1])
+
+
+def get_quantified_expr(toks):
+    bindings = [tok for tok in toks if isinstance(tok, VariableBinding)]
+    return QuantifiedExpression(quantifier=toks[0], bindings=bindings, satisfies_expr=toks[-1])
+
+
+t_SimpleForBinding.setParseAction(get_for_binding)
+t_ForExpr.setParseAction(get_for_expr)
+t_QuantifiedExpr.setParseAction(get_quantified_expr)
 
 
 class PathExpression:
-    def __init__(self, steps):
+    def __init__(self, steps, relative=False):
+        """
+        Path expression, which is evaluated by LXML.
+
+        Predicates of the steps are compiled into the query for LXML where possible. The first predicate of a step
+        which can not be compiled, and the predicates after it, are evaluated in Python for the nodes that LXML
+        found, per context node of the step. The steps after that step are then queried from each remaining node.
+
+        :param steps: List of Axis steps
+        :param relative: If True, the path is evaluated relative to the context item (like @contextRef)
+        """
 
         if isinstance(steps, list):
             self.steps = steps
         else:
             self.steps = [steps]
 
-    def to_str(self):
-        return_string = ""
-        for step in self.steps:
-            return_string += str(step.axis) # ex: //
-            return_string += str(step.step) # ex maindoc (qname)
+        self.relative = relative
 
-            for predicate in step.predicatelist:
-                return_string += f"[{str(predicate.val.expr)}]"
-                # return_string += f"{str(predicate.val.expr)}"
+        # Query for LXML, predicates that are evaluated in Python and the path that follows these predicates
+        self.query = None
+        self.python_predicates = []
+        self.remainder = None
 
-        return return_string
+        # Names of the variables the query refers to. Their values are passed to LXML.
+        self.variables = set()
 
-    def resolve_path(self, lxml_etree):
+        self.compile()
+
+        # Name of a path like //ns:X, of which the elements can be looked up in the ElementIndex of the document
+        first_step = self.steps[0] if self.steps else None
+        if not self.relative and first_step is not None and isinstance(first_step.step, QName) and \
+                self.query == f"//{first_step.step}":
+            self.indexed_name = first_step.step
+        else:
+            self.indexed_name = None
+
+    def compile(self):
         """
-        Attempt to resolve path queries
+        Decide per predicate if it can be pushed into the query for LXML, and build the query.
+        Decisions are added to the pushdown report of the Parser.
+        """
+        query = "." if self.relative and self.steps and str(self.steps[0].axis) in ["/", "//"] else ""
 
-        :param lxml_etree: LXML etree which the query is run against
-        :return:
+        for i, step in enumerate(self.steps):
+            query += str(step.axis)  # ex: //
+            query += str(step.step)  # ex maindoc (qname)
+
+            for j, predicate in enumerate(step.predicatelist):
+                predicate_str = predicate.to_str()
+                if predicate_str is None:
+                    # Evaluate this and the following predicates of the step in Python
+                    self.python_predicates = step.predicatelist[j:]
+                    for python_predicate in self.python_predicates:
+                        report_pushdown(step, python_predicate, pushed=False)
+
+                    if i + 1 < len(self.steps):
+                        self.remainder = PathExpression(steps=self.steps[i + 1:], relative=True)
+                    self.query = query
+                    return
+
+                report_pushdown(step, predicate, pushed=True)
+                self.variables.update(predicate.variables)
+                query += f"[{predicate_str}]"
+
+        self.query = query
+
+    @property
+    def _children(self):
+        return [predicate for step in self.steps for predicate in step.predicatelist]
+
+    def to_str(self):
+        """
+        Get the path as XPath string
+
+        :return: XPath string, or None if not all predicates can be evaluated by LXML
+        """
+        if self.python_predicates:
+            return None
+        return self.query
+
+    def select(self, lxml_etree, context_item=None, variable_map=None):
         """
+        Select the nodes of the path
 
-        found_values = []
-        if lxml_etree is not None:
-            query_str = self.to_str()
-            results = lxml_etree.xpath(query_str, namespaces=lxml_etree.nsmap)
-            for result in results:
-                # Try to cast the value to int if applicable.
-                try:
-                    found_values.append(int(result.text))
-                except:
-                    found_values.append(result.text)
+        :param lxml_etree: LXML etree which the query is run against
+        :param context_item: Node which relative paths are evaluated from
+        :param variable_map: Variables the predicates refer to. If None, the variables of the current frame are used.
+        :return: List of nodes (or attribute values)
+        """
+        if self.relative and isinstance(context_item, lxml.etree._Element):
+            node = context_item
         else:
+            node = lxml_etree
+
+        if variable_map is None:
+            frame = current_frame()
+            variable_map = frame.variables if frame is not None else {}
+
+        namespaces = lxml_etree.nsmap if lxml_etree is not None else node.nsmap
+        xpath_variables = {
+            name: xpath_variable_value(variable_value(QName(localname=name), variable_map=variable_map,
+                                                      lxml_etree=lxml_etree, context_item_value=context_item))
+            for name in self.variables
+        }
+        results = None
+        frame = current_frame()
+        prefetched_paths = frame.prefetched_paths if frame is not None else None
+        if prefetched_paths is not None and prefetched_paths.root is lxml_etree and not self.relative:
+            results = prefetched_paths.elements(self.query)
+        if results is None and self.indexed_name is not None:
+            results = self.indexed_elements(lxml_etree, namespaces)
+        if results is None:
+            results = node.xpath(self.query, namespaces=namespaces, **xpath_variables)
+
+        budget = current_budget()
+        if budget is not None:
+            budget.item(len(results))
+
+        if self.python_predicates:
+            results = self.filter_per_context_node(results, variable_map=variable_map, lxml_etree=lxml_etree)
+
+            if self.remainder is not None:
+                # Query the rest of the path from every node. Elements can be found more than once, attribute values
+                # of different nodes can be equal and are all kept.
+                remaining_results = []
+                seen = set()
+                for result in results:
+                    for remaining_result in self.remainder.select(lxml_etree=lxml_etree, context_item=result,
+                                                                  variable_map=variable_map):
+                        if isinstance(remaining_result, lxml.etree._Element):
+                            if remaining_result in seen:
+                                continue
+                            seen.add(remaining_result)
+                        remaining_results.append(remaining_result)
+                results = remaining_results
+
+        return results
+
+    def filter_per_context_node(self, results, variable_map, lxml_etree):
+        """
+        Apply the predicates that are evaluated in Python to the nodes of the step they belong to.
+
+        Positions in a predicate are positions among the nodes a step selects from one context node, so //a/b[1] is
+        the first b of every a. The steps select children and attributes, of which the context node is the parent,
+        so the nodes are grouped by their parent and the predicates are applied to each group. The nodes that remain
+        are returned in the order of the results.
+
+        :param results: Nodes of the query, in document order
+        :return: List of the nodes that match the predicates
+        """
+        groups = {}
+        for result in results:
+            getparent = getattr(result, "getparent", None)
+            parent = getparent() if getparent is not None else None
+            # Elements are compared by identity. Keeping the parent as key makes LXML return the same object for it.
+            groups.setdefault(parent, []).append(result)
+
+        selected = set()
+        for group in groups.values():
+            for predicate in self.python_predicates:
+                if predicate.position is not None:
+                    group = group[predicate.position]
+                else:
+                    group = PostfixExpr.filter(group, predicate, variable_map=variable_map, lxml_etree=lxml_etree)
+            selected.update(id(node) for node in group)
+
+        return [result for result in results if id(result) in selected]
+
+    def indexed_elements(self, lxml_etree, namespaces):
+        """
+        Look the elements of a path like //ns:X up in the ElementIndex of the evaluation, if it indexes the document
+
+        :return: List of elements, or None if the path needs to be queried
+        """
+        frame = current_frame()
+        index = frame.element_index if frame is not None else None
+        if index is None or index.root is not lxml_etree:
+            return None
+
+        name = self.indexed_name
+        if name.prefix:
+            if name.prefix not in namespaces:
+                # Let LXML raise the error of the undefined prefix
+                return None
+            return index.elements(namespaces[name.prefix], name.localname)
+        return index.elements(None, name.localname)
+
+    def resolve_path(self, lxml_etree, context_item=None, variable_map=None):
+        """
+        Get the outcome of the path. Nodes are cast to their typed values by the functions and comparisons that use them.
+
+        :param lxml_etree: LXML etree which the query is run against
+        :param context_item: Node which relative paths are evaluated from
+        :param variable_map: Variables the predicates refer to
+        :return: List of nodes, a single node if exactly one node was found, or None if there is no document
+        """
+        if lxml_etree is None and not (self.relative and isinstance(context_item, lxml.etree._Element)):
             return None
 
-        return found_values
+        results = self.select(lxml_etree=lxml_etree, context_item=context_item, variable_map=variable_map)
+        if len(results) == 1:
+            return results[0]
 
+        return results
 
-def resolve_expression(expression, variable_map, lxml_etree, context_item_value=None):
-    """
-    Loops though parsed results using dynamic content. This is the main loop of our interpreting step
 
+class ExpressionPath:
+    def __init__(self, expr, steps):
+        """
+        Path of which the first step is an expression instead of an axis step, like $facts/@contextRef or
+        $facts[@contextRef = 'c1']//ns:Member. The rest of the path is evaluated from every node of the expression.
 
-    :return:
+        :param expr: Variable reference, with or without predicates
+        :param steps: List of Axis steps after the expression
+        """
+        self.expr = expr
+        self.path = PathExpression(steps=steps, relative=True)
+
+    @property
+    def _children(self):
+        return [self.expr] + self.path._children
 
+    def resolve_path(self, variable_map, lxml_etree, context_item_value=None):
+        """
+        Get the outcome of the path: the nodes (or attribute values) the steps select from the nodes of the expression
+
+        :return: List of nodes, or a single node if exactly one node was found
+        :raises TypeError: If the expression gives an item that is not a node
+        """
+        items = resolve_expression(self.expr, variable_map=variable_map, lxml_etree=lxml_etree,
+                                   context_item_value=context_item_value)
+        if not isinstance(items, (list, tuple)):
+            items = [] if items is None else [items]
+
+        results = []
+        seen = set()
+        for item in items:
+            if not isinstance(item, lxml.etree._Element):
+                raise TypeError(f"Path steps can only be taken from nodes, not from '{item}'")
+
+            for result in self.path.select(lxml_etree=lxml_etree, context_item=item, variable_map=variable_map):
+                if isinstance(result, lxml.etree._Element):
+                    # Nodes that are reached from more than one node are only selected once
+                    if result in seen:
+                        continue
+                    seen.add(result)
+                results.append(result)
+
+        if len(results) == 1:
+            return results[0]
+        return results
+
+
+def xpath_variable_value(value):
     """
+    Get the value of a variable as it is passed to LXML. LXML does not know decimals.
+    """
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
 
-    # Set variable map and lxml etree. These should not be set at this time
 
-    def resolve_fn(fn):
+class PredicatePushdown:
+    def __init__(self, step, predicate, pushed):
         """
-        Wrapper function to run Functions
-        :param fn:
-        :return:
+        Decision whether a predicate of a path step is evaluated by LXML (pushed) or in Python.
+
+        :param step: Name test of the step, like "ns:Revenue"
+        :param predicate: XPath string of the predicate, or None if it could not be compiled
+        :param pushed: True if the predicate is part of the query for LXML
         """
+        self.step = step
+        self.predicate = predicate
+        self.pushed = pushed
+
+    def __repr__(self):
+        where = "lxml" if self.pushed else "python"
+        return f"PredicatePushdown({self.step}[{self.predicate if self.predicate else '...'}] -> {where})"
 
-        resolve_paths(fn=fn, lxml_etree=lxml_etree)
-        # cast_parameters(fn=fn, paramlist=variable_map)
 
-        # Then get the value by running the function
-        value = fn()
+# Pushdown decisions of the expression that is being parsed. Set by the Parser.
+pushdown_report = ContextVar("pushdown_report", default=None)
 
-        # Put the output value of the function into the AST as a number
 
-        return value
+def report_pushdown(step, predicate, pushed):
+    report = pushdown_report.get()
+    if report is not None:
+        report.append(PredicatePushdown(step=str(step.step), predicate=predicate.to_str(), pushed=pushed))
+
 
+# XPath 1.0 operators of comparisons and arithmetic which LXML evaluates the same as we do
+xpath_comparison_symbols = {
+    operator.eq: "=",
+    operator.ne: "!=",
+    operator.lt: "<",
+    operator.le: "<=",
+    operator.gt: ">",
+    operator.ge: ">=",
+}
+
+xpath_arithmetic_symbols = {
+    operator.add: "+",
+    operator.sub: "-",
+    operator.mul: "*",
+    operator.truediv: "div",
+    operator.mod: "mod",
+}
+
+# Functions which are part of XPath 1.0, and can be evaluated by LXML
+xpath_functions = {
+    "fn:position": "position",
+    "fn:last": "last",
+    "fn:count": "count",
+    "fn:sum": "sum",
+    "fn:not": "not",
+    "fn:number": "number",
+}
+
+
+# XPath 1.0 compares both operands of these operators as numbers, also when they are strings
+xpath_relational_operators = (operator.lt, operator.le, operator.gt, operator.ge)
+
+# Functions of xpath_functions which return a number
+xpath_numeric_functions = ("fn:position", "fn:last", "fn:count", "fn:sum", "fn:number")
+
+
+def is_numeric_operand(expression):
+    """
+    Check if an operand of a comparison is a number in XPath 1.0 as well as in Python: a numeric literal, or
+    arithmetic or a function that gives a number.
+    """
     if isinstance(expression, XPath):
-        # Expression needs to be unpacked:
-        rootexpr = expression.expr
-    else:
-        rootexpr = expression
+        expression = expression.expr
 
-    if isinstance(rootexpr, int):
-        # Is a primary
-        return rootexpr
+    if isinstance(expression, bool):
+        return False
+    if isinstance(expression, (int, float, Decimal)):
+        return True
+    if isinstance(expression, UnaryOperator):
+        return expression.op in ["-", "+"] and is_numeric_operand(expression.operand)
+    if isinstance(expression, BinaryOperator):
+        return expression.op in xpath_arithmetic_symbols.keys()
+    return isinstance(expression, FunctionCall) and expression.qname in xpath_numeric_functions
 
-    elif isinstance(rootexpr, str):
-        # Is a primary
-        return rootexpr
 
-    elif isinstance(rootexpr, float):
-        # Is a primary
-        return rootexpr
+def predicate_to_xpath(expression, variables=None):
+    """
+    Compile the expression of a predicate into an XPath 1.0 string, which can be evaluated by LXML (libxml2).
+    Only expressions which depend on nothing but the node (and variables), and which have the same meaning in
+    XPath 1.0, can be compiled.
+
+    :param expression: Expression of the predicate
+    :param variables: Set to which the names of the variables the XPath string refers to are added.
+        If None, expressions with variables are not compiled.
+    :return: XPath string, or None if the expression can not be compiled
+    """
+    if isinstance(expression, XPath):
+        expression = expression.expr
+
+    if isinstance(expression, bool):
+        return None
+
+    elif isinstance(expression, int):
+        return str(expression)
+
+    elif isinstance(expression, float):
+        if expression != expression or expression in (float("inf"), float("-inf")):
+            return None
+        # XPath 1.0 numbers have no exponent
+        return format(Decimal(repr(expression)), "f")
 
-    elif isinstance(rootexpr, list):
-        # Is a sequence with multiple values
-        return rootexpr
+    elif isinstance(expression, Decimal):
+        if not expression.is_finite():
+            return None
+        return format(expression, "f")
+
+    elif isinstance(expression, str):
+        if "'" not in expression:
+            return f"'{expression}'"
+        elif '"' not in expression:
+            return f'"{expression}"'
+        return None
+
+    elif isinstance(expression, ContextItem):
+        return "."
+
+    elif isinstance(expression, QName):
+        # Child element of the context item
+        return str(expression)
+
+    elif isinstance(expression, Parameter):
+        # Values of variables are passed to LXML when the query is run
+        if variables is None or expression.qname.prefix is not None:
+            return None
+        variables.add(expression.qname.localname)
+        return f"${expression.qname.localname}"
+
+    elif isinstance(expression, PathExpression):
+        if expression.relative and expression.to_str() is not None:
+            if expression.variables:
+                if variables is None:
+                    return None
+                variables.update(expression.variables)
+            return expression.to_str()
+        return None
+
+    elif isinstance(expression, Compare) and expression.op in xpath_comparison_symbols.keys() \
+            and len(expression.comparators) == 1:
+        if expression.op in xpath_relational_operators and \
+                not any(is_numeric_operand(operand) for operand in (expression.left, expression.comparators[0])):
+            # Strings would be compared as numbers by LXML, so 'a' < 'b' would be false
+            return None
 
-    if isinstance(rootexpr, functools.partial):
-        # Main node is a Function. Resolve this and add the answer to the Syntax Tree.
-        # return rootexpr()
-        function_outcome = rootexpr()
+        left = predicate_to_xpath(expression.left, variables)
+        right = predicate_to_xpath(expression.comparators[0], variables)
+        if left is None or right is None:
+            return None
+        return f"{left} {xpath_comparison_symbols[expression.op]} {right}"
+
+    elif isinstance(expression, (AndComparison, OrComparison)):
+        values = [predicate_to_xpath(value, variables) for value in expression.values]
+        if None in values:
+            return None
+        keyword = " and " if isinstance(expression, AndComparison) else " or "
+        return f"({keyword.join(values)})"
+
+    elif isinstance(expression, BinaryOperator) and expression.op in xpath_arithmetic_symbols.keys():
+        left = predicate_to_xpath(expression.left, variables)
+        right = predicate_to_xpath(expression.right, variables)
+        if left is None or right is None:
+            return None
+        return f"({left} {xpath_arithmetic_symbols[expression.op]} {right})"
+
+    elif isinstance(expression, UnaryOperator) and expression.op in ["-", "+"]:
+        operand = predicate_to_xpath(expression.operand, variables)
+        if operand is None:
+            return None
+        return f"-({operand})" if expression.op == "-" else operand
+
+    elif isinstance(expression, FunctionCall) and expression.qname in xpath_functions.keys():
+        args = expression.args[0] if expression.args else []
+        if not isinstance(args, list):
+            args = [args]
+        compiled_args = [predicate_to_xpath(arg, variables) for arg in args]
+        if None in compiled_args:
+            return None
+        return f"{xpath_functions[expression.qname]}({', '.join(compiled_args)})"
+
+    return None
+
+
+# How nodes are evaluated by resolve_expression
+LEAF, WRAPPER, SEQUENCE, OPERATOR, AND, OR, IF = range(1, 8)
+
+# Kind of evaluation by type of node, filled when a type of node is evaluated for the first time
+evaluation_kinds = {}
+
+
+def evaluation_kind(node_type):
+    """
+    Get the kind of evaluation of a type of node. Nodes whose value only depends on the values of their child nodes
+    are evaluated on the stack of resolve_expression, other nodes (leaves of the stack) by resolve_node.
+    """
+    kind = evaluation_kinds.get(node_type)
+    if kind is None:
+        if issubclass(node_type, XPath):
+            kind = WRAPPER
+        elif issubclass(node_type, (list, pyparsing.ParseResults)):
+            kind = SEQUENCE
+        elif issubclass(node_type, (Operator, Compare)):
+            kind = OPERATOR
+        elif issubclass(node_type, AndComparison):
+            kind = AND
+        elif issubclass(node_type, OrComparison):
+            kind = OR
+        elif issubclass(node_type, IfExpression):
+            kind = IF
+        else:
+            kind = LEAF
+        evaluation_kinds[node_type] = kind
+
+    return kind
+
+
+class Continuation:
+    __slots__ = ("node", "kind", "index")
+
+    def __init__(self, node, kind, index):
+        """
+        Step of the evaluation of a node which waits for the values of its child nodes
+
+        :param node: Node that is being evaluated
+        :param kind: Kind of evaluation of the node
+        :param index: Number of child values the step takes (operators, comparisons and sequences), or the position
+            of the operand that is being evaluated (and, or)
+        """
+        self.node = node
+        self.kind = kind
+        self.index = index
+
+
+def resolve_expression(expression, variable_map, lxml_etree, context_item_value=None):
+    """
+    Loops though parsed results using dynamic content. This is the main loop of our interpreting step.
+
+    Sequences, operators, comparisons, and/or and if expressions are evaluated with an explicit stack instead of
+    recursion, so deeply nested expressions (like long sums or long if/else if chains) do not run into the
+    recursion limit. The stack holds the nodes that still need to be evaluated, and continuations of the nodes
+    that wait for the values of their child nodes. Values are put on a stack of their own, so the memory that is
+    used grows with the depth of the syntax tree, not with the number of nodes.
+
+    The syntax tree is not changed while it is evaluated: values are passed on to the parent expression, and
+    outcomes of function calls are kept in the current evaluation frame.
+
+    :param expression: (Part of the) syntax tree
+    :param variable_map: Dict of variable name to value
+    :param lxml_etree: LXML etree which paths are evaluated against
+    :param context_item_value: Value of the context item
+    :return: Value of the expression
+    """
+    kind = evaluation_kind(type(expression))
+    while kind == WRAPPER:
+        expression = expression.expr
+        kind = evaluation_kind(type(expression))
+
+    frame = current_frame()
+    budget = frame.budget if frame is not None else None
+
+    # Values of subtrees of an earlier evaluation that are still valid, when evaluating incrementally
+    subtree_values = frame.subtree_values if frame is not None else None
+    if subtree_values is not None:
+        value = subtree_values.lookup(expression)
+        if value is not subtree_values.MISSING:
+            return value
+
+    # Calls of coroutine functions are started before they are needed, if they run on an event loop. This is done
+    # for the whole expression, and for every branch or operand that is taken by if, and or or.
+    starts_calls = frame is not None and frame.event_loop is not None
+    if starts_calls:
+        start_calls([expression])
+
+    if kind == LEAF:
+        if budget is not None:
+            budget.step()
+        value = resolve_node(expression, variable_map=variable_map, lxml_etree=lxml_etree,
+                             context_item_value=context_item_value)
+        if subtree_values is not None:
+            subtree_values.store(expression, value)
+        return value
+
+    kinds = evaluation_kinds
+    tasks = [expression]
+    values = []
+
+    while tasks:
+        node = tasks.pop()
+
+        if budget is not None:
+            budget.step()
+
+        if type(node) is Continuation:
+            step = node
+            node, kind = step.node, step.kind
+
+            if kind == AND or kind == OR:
+                # 'or' stops at the first operand that is true, 'and' at the first operand that is false
+                decisive = kind == OR
+                if effective_boolean_value(values.pop()) is decisive:
+                    values.append(decisive)
+                elif step.index + 1 < len(node.values):
+                    tasks.append(Continuation(node, kind, step.index + 1))
+                    tasks.append(node.values[step.index + 1])
+                    if starts_calls:
+                        start_calls([node.values[step.index + 1]])
+                    continue
+                else:
+                    values.append(not decisive)
+
+            elif kind == IF:
+                # The outcome of the if expression is the outcome of the branch, which takes the place of the node
+                tasks.append(node.branch(values.pop()))
+                if starts_calls:
+                    start_calls([tasks[-1]])
+                continue
+
+            else:
+                # The child values are on top of the stack, from left to right
+                start = len(values) - step.index
+                child_values = values[start:]
+                del values[start:]
+
+                if kind == SEQUENCE:
+                    values.append(concatenate(child_values))
+                else:
+                    values.append(node.apply(*child_values))
+
+            if subtree_values is not None:
+                subtree_values.store(node, values[-1])
+            continue
+
+        kind = kinds.get(type(node)) or evaluation_kind(type(node))
+        while kind == WRAPPER:
+            node = node.expr
+            kind = kinds.get(type(node)) or evaluation_kind(type(node))
+
+        if subtree_values is not None:
+            value = subtree_values.lookup(node)
+            if value is not subtree_values.MISSING:
+                values.append(value)
+                continue
+
+        if kind == LEAF:
+            values.append(resolve_node(node, variable_map=variable_map, lxml_etree=lxml_etree,
+                                       context_item_value=context_item_value))
+            if subtree_values is not None:
+                subtree_values.store(node, values[-1])
+
+        elif kind == OPERATOR:
+            # Operands are evaluated from left to right
+            children = node._children
+            for child in children:
+                # Operands which are function calls can have a value of an earlier evaluation
+                if subtree_values is not None or (kinds.get(type(child)) or evaluation_kind(type(child))) != LEAF:
+                    tasks.append(Continuation(node, kind, len(children)))
+                    tasks.extend(reversed(children))
+                    break
+            else:
+                # Operators of primaries, variables and function calls (like $i mod 2) are applied right away
+                values.append(node.apply(*[
+                    resolve_node(child, variable_map=variable_map, lxml_etree=lxml_etree,
+                                 context_item_value=context_item_value)
+                    for child in children
+                ]))
+
+        elif kind == SEQUENCE:
+            # Is a sequence with multiple values
+            tasks.append(Continuation(node, kind, len(node)))
+            tasks.extend(reversed(node))
+
+        elif kind == IF:
+            tasks.append(Continuation(node, kind, 0))
+            tasks.append(node.test_expr)
+
+        else:
+            tasks.append(Continuation(node, kind, 0))
+            tasks.append(node.values[0])
+
+    return values.pop()
+
+
+def start_calls(nodes):
+    """
+    Start the calls of coroutine functions among nodes which are all going to be evaluated, like the operands of
+    an operator or the arguments of a function, so they run concurrently instead of one after the other.
+    Calls within the operands of operators and the arguments of other functions are started as well, as these are
+    evaluated in the same frame. Of and/or and if expressions, only the first operand and the test are always
+    evaluated. Calls within for expressions and predicates are not started.
+
+    :param nodes: List of nodes of the syntax tree
+    """
+    stack = list(reversed(nodes))
+    while stack:
+        node = stack.pop()
+        while isinstance(node, XPath):
+            node = node.expr
+
+        if isinstance(node, FunctionCall):
+            if node.is_async:
+                node.start()
+            else:
+                stack.extend(reversed(node._children))
+
+        elif isinstance(node, (list, pyparsing.ParseResults, Operator, Compare)):
+            stack.extend(reversed(child_nodes(node)))
+
+        elif isinstance(node, (AndComparison, OrComparison)):
+            stack.append(node.values[0])
+
+        elif isinstance(node, IfExpression):
+            stack.append(node.test_expr)
+
+
+def resolve_node(expression, variable_map, lxml_etree, context_item_value=None):
+    """
+    Evaluate a node which is not evaluated on the stack of resolve_expression, like a primary, a function call,
+    a path or a for expression
+
+    :param expression: Node of the syntax tree
+    :return: Value of the node
+    """
+    if isinstance(expression, (int, str, float, Decimal)):
+        # Is a primary
+        return expression
+
+    if isinstance(expression, functools.partial):
+        # Main node is a Function. Its arguments are evaluated in the current frame.
+        function_outcome = expression()
         if isinstance(function_outcome, types.GeneratorType):
             answers = []
             for ans in function_outcome:
@@ -272,75 +1146,231 @@ def resolve_expression(expression, variable_map, lxml_etree, context_item_value=
                 answers.append(ans)
             return answers
 
-
         else:
             return function_outcome
 
-        # return resolve_fn(rootexpr)
-
-    elif isinstance(rootexpr, Parameter):
-        param_value = rootexpr.resolve_parameter(paramlist=variable_map)
-        return param_value
-
-    elif isinstance(rootexpr, Operator):
-        if context_item_value is None:
-            rootexpr.resolve(variable_map, lxml_etree)
+    elif isinstance(expression, Parameter):
+        return variable_value(expression.qname, variable_map=variable_map, lxml_etree=lxml_etree,
+                              context_item_value=context_item_value)
 
+    elif isinstance(expression, (LetExpression, QuantifiedExpression)):
+        return expression.answer(variable_map=variable_map, lxml_etree=lxml_etree,
+                                 context_item_value=context_item_value)
 
-        return rootexpr.answer(variable_map=variable_map,
-            lxml_etree=lxml_etree, context_item_value=context_item_value)
+    elif isinstance(expression, (ForExpression, SimpleMapExpression)):
+        return list(expression.iterate(variable_map=variable_map, lxml_etree=lxml_etree,
+                                       context_item_value=context_item_value))
 
-    elif isinstance(rootexpr, IfExpression):
-        # Replace the if statement with its outcome
-
-        # First get the outcome of the test by passing the test expression to the loop
-        outcome_of_test = resolve_expression(
-            expression=rootexpr.test_expr,
-            variable_map=variable_map,
-            lxml_etree=lxml_etree,
-        )
-        # Then, get the 'then' or 'else'  expression and continue
-        return rootexpr.resolve_expression(test_outcome=outcome_of_test, variable_map=variable_map,
-            lxml_etree=lxml_etree)
+    elif isinstance(expression, PostfixExpr):
+        items = stream_expression(expression, variable_map=variable_map, lxml_etree=lxml_etree,
+                                  context_item_value=context_item_value)
+        if items is not None:
+            # Predicates are applied while the items are produced, so [1] stops after the first item
+            return list(items)
 
-    elif isinstance(rootexpr, PostfixExpr):
         # Need to resolve the predicate (filter), pass  arguments to the rootexpr as if it is a function or perform a lookup
-        return rootexpr.resolve_secondary(
+        return expression.resolve_secondary(
             variable_map=variable_map,
             lxml_etree=lxml_etree,
+            context_item_value=context_item_value,
         )
 
-    elif isinstance(rootexpr, XPath):
-        # Need to recursively run the child
+    elif isinstance(expression, ExpressionPath):
+        return expression.resolve_path(variable_map=variable_map, lxml_etree=lxml_etree,
+                                       context_item_value=context_item_value)
+
+    elif isinstance(expression, PathExpression):
+        # Run the path expression against the LXML etree
+        return expression.resolve_path(lxml_etree=lxml_etree, context_item=context_item_value,
+                                       variable_map=variable_map)
+
+    elif isinstance(expression, ContextItem):
+        return context_item_value
+
+    # Give back the now resolved expression
+    return expression
+
+
+def concatenate(values):
+    """
+    Concatenate the values of the items of a sequence. Sequences are flattened, as XPath has no nested sequences.
+
+    :param values: List of values
+    :return: List of items
+    """
+    budget = current_budget()
+    if budget is not None:
+        # Checked before the items are put in a list, as a range can have more items than fit in memory
+        budget.item(sum(len(value) if isinstance(value, (list, tuple, range, IntegerRange)) else 1
+                        for value in values))
+
+    items = []
+    for value in values:
+        if isinstance(value, (list, tuple, range, IntegerRange)):
+            items.extend(value)
+        elif value is not None:
+            items.append(value)
+
+    return items
+
+
+def resolve_sequence(items, variable_map, lxml_etree, context_item_value=None):
+    """
+    Evaluate the items of a sequence, like (1, //a, $b)
+
+    :param items: List of expressions
+    :return: List of values
+    """
+    return resolve_expression(list(items), variable_map=variable_map, lxml_etree=lxml_etree,
+                              context_item_value=context_item_value)
+
+
+def sequence_items(value):
+    """
+    Get the items of a value. A single item is a sequence of one item, and None is the empty sequence.
+
+    :return: Iterable of items
+    """
+    if value is None:
+        return ()
+    if isinstance(value, (list, tuple, range, IntegerRange)):
+        return value
+    return (value,)
+
+
+def stream_expression(expression, variable_map, lxml_etree, context_item_value=None):
+    """
+    Get the items of an expression whose items are produced one at a time, like a for expression.
+
+    :return: Iterator of items, or None if the expression is not streamed
+    """
+    while isinstance(expression, XPath) and not isinstance(expression.expr, (list, pyparsing.ParseResults)):
+        # Parenthesized expression
+        expression = expression.expr
+
+    if isinstance(expression, (ForExpression, SimpleMapExpression)):
+        return expression.iterate(variable_map=variable_map, lxml_etree=lxml_etree,
+                                  context_item_value=context_item_value)
+
+    elif isinstance(expression, PostfixExpr) and expression.streams():
+        primary = expression.expr
+        while isinstance(primary, XPath) and not isinstance(primary.expr, (list, pyparsing.ParseResults)):
+            primary = primary.expr
+        if isinstance(primary, (ForExpression, SimpleMapExpression, PostfixExpr)):
+            return expression.iterate(variable_map=variable_map, lxml_etree=lxml_etree,
+                                      context_item_value=context_item_value)
+
+    return None
+
+
+def iterate_expression(expression, variable_map, lxml_etree, context_item_value=None):
+    """
+    Iterate over the items of the outcome of an expression. Streamed expressions produce their items when
+    they are asked for, other expressions are evaluated first.
+
+    :return: Iterator of items
+    """
+    items = stream_expression(expression, variable_map=variable_map, lxml_etree=lxml_etree,
+                              context_item_value=context_item_value)
+    if items is not None:
+        return items
+
+    value = resolve_expression(expression, variable_map=variable_map, lxml_etree=lxml_etree,
+                               context_item_value=context_item_value)
+    return iter(sequence_items(value))
+
+
+def child_nodes(node):
+    """
+    Get the child nodes of a node of the syntax tree
+    """
+    if isinstance(node, (list, tuple, pyparsing.ParseResults)):
+        return list(node)
+    return getattr(node, "_children", [])
+
+
+def walk(expression):
+    """
+    Iterate over all nodes of (a part of) the syntax tree, depth first
+
+    :param expression: Node to start from
+    :return: Generator of nodes
+    """
+    stack = [expression]
+    while stack:
+        node = stack.pop()
+        yield node
+        stack.extend(reversed(child_nodes(node)))
+
+
+def arithmetic_operand(value):
+    """
+    Get the value of an operand of an arithmetic operator. Nodes are cast to their typed value.
+    """
+    if isinstance(value, lxml.etree._Element):
+        return current_atomizer().atomize_element(value)
+    return value
+
+
+def atomized_items(value):
+    """
+    Iterate over the items of a value as atomic values. Single values are treated as a sequence of one item,
+    LXML elements are cast to their (typed) text value and None is treated as the empty sequence.
+
+    :param value: Value of an (already resolved) expression
+    :return: Generator of atomic values
+    """
+    if value is None:
+        return
+
+    if isinstance(value, (list, tuple, range, IntegerRange, pyparsing.ParseResults)):
+        for item in value:
+            if item is None:
+                continue
+            if isinstance(item, lxml.etree._Element):
+                yield cast_lxml_elements(item)
+            else:
+                yield item
+
+    elif isinstance(value, lxml.etree._Element):
+        yield cast_lxml_elements(value)
+
+    else:
+        yield value
+
+
+def effective_boolean_value(value):
+    """
+    Get the effective boolean value of a resolved expression
+    https://www.w3.org/TR/xpath-3/#id-ebv
+
+    :param value: Value of an (already resolved) expression
+    :return: True or False
+    """
+    if value is None:
+        return False
 
-        # Resolve the expression and substitute the expression for the answer
-        return resolve_expression(
-            expression=rootexpr,
-            variable_map=variable_map,
-            lxml_etree=lxml_etree,
-        )
+    elif isinstance(value, bool):
+        return value
 
-    elif isinstance(rootexpr, PathExpression):
-        # Run the path expression against the LXML etree
-        resolved_expr = rootexpr.resolve_path(lxml_etree=lxml_etree)
-        # if resolved_expr is not None:
-        return resolved_expr
+    elif isinstance(value, (list, tuple, range, IntegerRange, pyparsing.ParseResults)):
+        first_item = next((item for item in value if item is not None), None)
+        if first_item is None:
+            # Empty sequence
+            return False
+        elif isinstance(first_item, lxml.etree._Element) or len(value) > 1:
+            return True
+        return effective_boolean_value(first_item)
 
-    elif isinstance(rootexpr, Compare):
-        # Pass data into the comparator
+    elif isinstance(value, (int, float, Decimal)):
+        # NaN is the only value that is not equal to itself
+        return value != 0 and value == value
 
-        if context_item_value is None:
-            # If we are not dealing with a context item, we can 'collapse' the expression
-            rootexpr.resolve(variable_map=variable_map, lxml_etree=lxml_etree, context_item_value=context_item_value)
+    elif isinstance(value, str):
+        return len(value) > 0
 
-        # Get answer
-        return rootexpr.answer(variable_map=variable_map, lxml_etree=lxml_etree, context_item_value=context_item_value)
-    elif isinstance(rootexpr, pyparsing.ParseResults):
-        l = list(rootexpr)
-        return l
+    return True
 
-    # Give back the now resolved expression
-    return rootexpr
 
 """
 TESTS
@@ -453,13 +1483,12 @@ class XPath:
         self.variable_map = variable_map if variable_map else {}
         self.lxml_etree = xml_etree
 
-    def resolve_child(self):
-        return resolve_expression(
-            self.expr, variable_map=self.variable_map, lxml_etree=self.lxml_etree
-        )
+    @property
+    def _children(self):
+        return [self.expr]
 
 
-t_Expr = t_ExprSingle + ZeroOrMore(Literal(","), t_ExprSingle)
+t_Expr = t_ExprSingle + ZeroOrMore(Suppress(Literal(",")) + t_ExprSingle)
 t_Expr.setName("Expr")
 
 def parse_expr(toks):
@@ -532,6 +1561,103 @@ class Predicate:
     def __init__(self, val):
         self.val = val
 
+        # Positional predicates are known when parsing, so they can be applied by slicing the sequence
+        positional = get_positional_slice(val)
+        if positional is not None:
+            self.position, self.position_str = positional
+        else:
+            self.position, self.position_str = None, None
+
+        # XPath string of the predicate if it can be evaluated by LXML, compiled when parsing,
+        # and the names of the variables it refers to
+        self.variables = set()
+        if self.position_str is not None:
+            self.xpath_str = self.position_str
+        else:
+            self.xpath_str = predicate_to_xpath(val, variables=self.variables)
+
+    @property
+    def _children(self):
+        return [self.val]
+
+    def to_str(self):
+        """
+        Get the predicate as XPath string, to be used in a query for LXML
+
+        :return: XPath string, or None if the predicate can not be evaluated by LXML
+        """
+        return self.xpath_str
+
+
+# Symbols of comparisons with fn:position(), as used in XPath
+position_symbols = {
+    operator.eq: "=",
+    operator.lt: "<",
+    operator.le: "<=",
+    operator.gt: ">",
+    operator.ge: ">=",
+}
+
+
+def is_function_call(expression, qname):
+    """
+    Check if the expression is a call to the function with the given name, without arguments
+    """
+    return isinstance(expression, FunctionCall) and expression.qname == qname and not any(expression.args)
+
+
+def position_slice(op, position):
+    """
+    Get the slice of a sequence with the items for which "position() op position" is true
+    """
+    if op is operator.eq:
+        return slice(position - 1, position) if position >= 1 else slice(0, 0)
+    elif op is operator.lt:
+        return slice(0, max(position - 1, 0))
+    elif op is operator.le:
+        return slice(0, max(position, 0))
+    elif op is operator.gt:
+        return slice(max(position, 0), None)
+    elif op is operator.ge:
+        return slice(max(position - 1, 0), None)
+
+
+def get_positional_slice(expression):
+    """
+    Check if a predicate selects items by their position only, like [1], [last()], [last() - 1] or
+    [position() < 3]. Instead of evaluating these predicates for every item, the sequence is sliced.
+
+    :param expression: Expression of the predicate
+    :return: Tuple of (slice, XPath string of the predicate), or None if the predicate is not positional
+    """
+    if isinstance(expression, XPath):
+        expression = expression.expr
+
+    if isinstance(expression, (float, Decimal)):
+        if expression != int(expression):
+            # No position is equal to this number
+            return slice(0, 0), str(expression)
+        expression = int(expression)
+
+    if isinstance(expression, int) and not isinstance(expression, bool):
+        return position_slice(operator.eq, expression), str(expression)
+
+    elif is_function_call(expression, "fn:last"):
+        return slice(-1, None), "last()"
+
+    elif isinstance(expression, BinaryOperator) and expression.op is operator.sub \
+            and is_function_call(expression.left, "fn:last") and isinstance(expression.right, int):
+        offset = expression.right
+        return slice(-offset - 1, -offset if offset > 0 else None), f"last() - {offset}"
+
+    elif isinstance(expression, Compare) and expression.op in position_symbols.keys() \
+            and is_function_call(expression.left, "fn:position") \
+            and len(expression.comparators) == 1 and isinstance(expression.comparators[0], int):
+        position = expression.comparators[0]
+        return position_slice(expression.op, position), f"position() {position_symbols[expression.op]} {position}"
+
+    return None
+
 
 def predicate(v):
     # print(f"Getting predicate: {v[0]}")
@@ -566,8 +1692,7 @@ t_Argument = t_ExprSingle | t_ArgumentPlaceholder
 t_Argument.setName("Argument")
 t_ArgumentList = (
     l_par_l
-    + t_Argument
-    + Optional(ZeroOrMore(Suppress(Literal(",")) + t_Argument))
+    + Optional(t_Argument + ZeroOrMore(Suppress(Literal(",")) + t_Argument))
     + l_par_r
 )
 t_ArgumentList.setName("ArgumentList")
@@ -585,7 +1710,15 @@ t_EQName.setName("EQName")
 
 tx_FunctionName = t_EQName
 
-t_FunctionCall = tx_FunctionName + t_ArgumentList
+# Names of kind tests and other expressions with parentheses, which can not be used as function name
+# https://www.w3.org/TR/xpath-3/#id-reserved-fn-names
+tx_ReservedFunctionName = MatchFirst(Keyword(name) for name in [
+    "attribute", "comment", "document-node", "element", "empty-sequence", "function", "if", "item",
+    "namespace-node", "node", "processing-instruction", "schema-attribute", "schema-element", "switch", "text",
+    "typeswitch",
+]) + l_par_l
+
+t_FunctionCall = ~tx_ReservedFunctionName + tx_FunctionName + t_ArgumentList
 
 t_FunctionCall.setName("FunctionCall")
 t_FunctionCall.setParseAction(get_function)
@@ -595,6 +1728,8 @@ t_FunctionCall.setParseAction(get_function)
 """ Parentisized Expressions """
 t_ParenthesizedExpr = l_par_l + Optional(t_Expr) + l_par_r
 t_ParenthesizedExpr.setName("ParenthesizedExpr")
+# () is the empty sequence
+t_ParenthesizedExpr.setParseAction(lambda toks: toks if len(toks) > 0 else XPath(expr=[]))
 
 """ end Parentisized Expressions  """
 
@@ -621,38 +1756,123 @@ class PostfixExpr(Expr):
             else:
                 self.secondary = [secondary]
 
-    def resolve_secondary(self, variable_map, lxml_etree):
+    @property
+    def _children(self):
+        return [self.expr] + self.secondary
+
+    def resolve_secondary(self, variable_map, lxml_etree, context_item_value=None):
+
+        sequence = resolve_expression(self.expr, variable_map=variable_map, lxml_etree=lxml_etree,
+                                      context_item_value=context_item_value)
+        if sequence is None:
+            sequence = []
+        elif not isinstance(sequence, (list, tuple, range, IntegerRange)):
+            sequence = list(sequence) if isinstance(sequence, pyparsing.ParseResults) else [sequence]
 
         for secondary in self.secondary:
             if isinstance(secondary, Predicate):
-                """
-                Here I'd want to probably run the predicate (filter) for every instance of the primary expression.
+                if secondary.position is not None:
+                    # Positional predicates index the sequence directly. Ranges are sliced without being expanded.
+                    sequence = sequence[secondary.position]
+                else:
+                    sequence = self.filter(sequence, secondary, variable_map=variable_map, lxml_etree=lxml_etree)
+            else:
+                # Lookup and arguments not yet supported
+                pass
+
+        if isinstance(sequence, IntegerRange) and len(sequence) > 1:
+            # Slices of ranges are ranges, which do not need to be expanded
+            return sequence
+
+        # Return all items that match the predicates.
+        return list(sequence)
+
+    def streams(self):
+        """
+        Check if the predicates can be applied while the items of a stream are produced, without knowing
+        the number of items. This is not the case for predicates that refer to the end of the sequence.
+        """
+        for secondary in self.secondary:
+            if not isinstance(secondary, Predicate):
+                return False
 
-                That would mean: make a generator of the primary expr.
-                """
+            if secondary.position is not None:
+                position = secondary.position
+                if (position.start is not None and position.start < 0) \
+                        or (position.stop is not None and position.stop < 0):
+                    return False
 
-                filtered_items = []
+            elif any(is_function_call(node, "fn:last") for node in walk(secondary.val)):
+                return False
 
-                # Try each context_item
-                for context_item in self.expr.expr:
-                    ans = resolve_expression(
-                        secondary.val,
-                        variable_map=variable_map,
-                        lxml_etree=lxml_etree,
-                        context_item_value=context_item,
-                    )
+        return True
 
-                    if ans is True:
-                        filtered_items.append(context_item)
+    def iterate(self, variable_map, lxml_etree, context_item_value=None):
+        """
+        Apply the predicates to the items of the primary expression, one item at a time
 
-                # Return all items that match the predicate.
-                return filtered_items
+        :return: Iterator of the items that match the predicates, or a range if the predicates are positions
+            in a range
+        """
+        items = stream_expression(self.expr, variable_map=variable_map, lxml_etree=lxml_etree,
+                                  context_item_value=context_item_value)
+        if items is None:
+            items = sequence_items(resolve_expression(self.expr, variable_map=variable_map, lxml_etree=lxml_etree,
+                                                      context_item_value=context_item_value))
+
+        for predicate in self.secondary:
+            if predicate.position is not None and isinstance(items, IntegerRange):
+                # Positions in a range are computed, not counted
+                items = items[predicate.position]
+            elif predicate.position is not None:
+                items = itertools.islice(items, predicate.position.start, predicate.position.stop)
             else:
-                # Lookup and arguments not yet supported
-                pass
+                items = self.select_items(items, predicate, variable_map=variable_map, lxml_etree=lxml_etree)
+
+        return items
+
+    @staticmethod
+    def filter(sequence, predicate, variable_map, lxml_etree):
+        """
+        Evaluate the predicate for every item of the sequence.
+
+        :return: List of items that match the predicate
+        """
+        return list(PostfixExpr.select_items(sequence, predicate, variable_map=variable_map, lxml_etree=lxml_etree,
+                                             size=len(sequence)))
+
+    @staticmethod
+    def select_items(items, predicate, variable_map, lxml_etree, size=None):
+        """
+        Evaluate the predicate for every item.
 
-            pass  # Attempt to do something with the secondary expressions
-        pass
+        :param items: Iterable of items
+        :param size: Number of items, or None if the items are streamed
+        :return: Generator of the items that match the predicate
+        """
+        budget = current_budget()
+        for position, context_item in enumerate(items, start=1):
+            if budget is not None:
+                budget.item()
+
+            # Outcomes of function calls in the predicate can differ per context item,
+            # so every context item gets a frame of its own.
+            with EvaluationFrame(position=position, size=size, context_item=context_item, variables=variable_map):
+                ans = resolve_expression(
+                    predicate.val,
+                    variable_map=variable_map,
+                    lxml_etree=lxml_etree,
+                    context_item_value=context_item,
+                )
+
+            if isinstance(ans, (int, float, Decimal)) and not isinstance(ans, bool):
+                # A numeric outcome selects the item at that position
+                matches = ans == position
+            else:
+                matches = effective_boolean_value(ans)
+
+            if matches:
+                yield context_item
 
 
 def postfix_expr(toks):
@@ -663,7 +1883,7 @@ def postfix_expr(toks):
     :return:
     """
 
-    if len(toks) > 1 and isinstance(toks[0], XPath):
+    if len(toks) > 1 and isinstance(toks[0], (XPath, Parameter)):
         # We only need to create a PostfixExpr when there are secondary expressions to add.
         # Otherwise It'll just create overhead
         return PostfixExpr(toks[0], toks[1:])
@@ -705,7 +1925,10 @@ class Axis:
 
 def get_single_path_expr(toks):
 
-    if len(toks) == 2:
+    if len(toks) > 2 and toks[1] == "@":
+        # Abbreviated attribute step, like /@contextRef
+        return Axis(axis=toks[0], step=f"@{toks[2]}", predicatelist=toks[3:])
+    elif len(toks) == 2:
         return Axis(axis=toks[0], step=toks[1])
     elif len(toks) > 2:
         return Axis(axis=toks[0], step=toks[1], predicatelist=toks[2:])
@@ -721,6 +1944,15 @@ t_RelativePathExpr.setName("RelativePathExpr")
 
 
 
+def is_variable_reference(token):
+    """
+    Check if a token is a variable reference, with or without predicates
+    """
+    if isinstance(token, PostfixExpr):
+        token = token.expr
+    return isinstance(token, Parameter)
+
+
 def get_path_expr(toks):
     """
 
@@ -755,33 +1987,24 @@ def get_path_expr(toks):
         https://www.w3.org/TR/xpath-3/#abbrev
         """
     elif toks[0] == "@":
-        # attribute::
-        steps.append(Axis(axis="attribute::", step=toks[1]))
+        # attribute:: steps are relative to the context item, so they are resolved when the expression is evaluated
+        steps.append(Axis(axis="attribute::", step=toks[1], predicatelist=list(toks[2:])))
+        return PathExpression(steps=steps, relative=True)
     elif toks[0] == "..":
         # parent::node()
         steps.append(Axis(axis="parent::node()", step=toks[1]))
 
+    elif is_variable_reference(toks[0]) and len(toks) > 1 and all(isinstance(tok, Axis) for tok in toks[1:]):
+        # Steps from the nodes of a variable, like $facts/@contextRef
+        return ExpressionPath(expr=toks[0], steps=list(toks[1:]))
+
     else:
         # If we didn't find anything axis-like, we probably need to return all toks
         return toks
 
 
-    path_expression = PathExpression(steps=steps)
-    # todo: Path expression also needs to be handled while parsing if we want partial functions to work.
-    #  this probably means that we should let the whole 'parse first, intepret later' part go :/
-
-    query_singleton = QuerySingleton()
-    query = path_expression.to_str()
-    if query_singleton.lxml_tree is not None:
-        # Only try to query the lxml xpath if this actually exist
-        result = query_singleton.lxml_tree.xpath(query, namespaces=query_singleton.lxml_tree.nsmap)
-    else:
-        return [None]
-
-    if len(result) < 1:
-        return [None]
-
-    return result
+    # The path is queried when the expression is evaluated, against the document of the evaluation
+    return PathExpression(steps=steps)
 
 
 t_PathExpr = (
@@ -873,8 +2096,35 @@ if xpath_version == "2.0":
     t_ValueExpr.setName("ValueExpr")
 elif xpath_version == "3.1":
 
-    t_SimpleMapExpr = t_PathExpr + ZeroOrMore(Literal("!") + t_PathExpr)
+    class SimpleMapSymbol:
+        """
+        Marks a ! operator between the tokens of the operands, so it can not be confused with a string literal
+        """
+
+    def get_simple_map_expr(toks):
+        """
+        The results of a path expression are spread over multiple tokens, so all tokens between two ! operators
+        are one step.
+        """
+        if not any(isinstance(tok, SimpleMapSymbol) for tok in toks):
+            return toks
+
+        steps = [[]]
+        for tok in toks:
+            if isinstance(tok, SimpleMapSymbol):
+                steps.append([])
+            else:
+                steps[-1].append(tok)
+
+        return SimpleMapExpression(steps=[step[0] if len(step) == 1 else step for step in steps])
+
+    # ! but not !=
+    tx_SimpleMapSymbol = Regex(r"!(?!=)")
+    tx_SimpleMapSymbol.setParseAction(lambda: SimpleMapSymbol())
+
+    t_SimpleMapExpr = t_PathExpr + ZeroOrMore(tx_SimpleMapSymbol + t_PathExpr)
     t_SimpleMapExpr.setName("SimpleMapExpr")
+    t_SimpleMapExpr.setParseAction(get_simple_map_expr)
 
     t_ValueExpr = t_SimpleMapExpr
     t_ValueExpr.setName("ValueExpr")
@@ -938,15 +2188,67 @@ t_InstanceofExpr.setName("InstanceofExpr")
 
 """Combining node sequences"""
 
-t_IntersectExceptExpr = t_InstanceofExpr + ZeroOrMore(
-    MatchFirst(Keyword("intersect"), Keyword("except")) + t_InstanceofExpr
-)
+set_operators = {
+    "union": union,
+    "|": union,
+    "intersect": intersect,
+    "except": except_,
+}
+
+
+class SetOperatorSymbol:
+    def __init__(self, op):
+        """
+        Marks a union, intersect or except operator between the tokens of the operands.
+        Unlike a plain string, it can not be confused with a string literal.
+        """
+        self.op = op
+
+
+def get_set_operator_symbol(toks):
+    return SetOperatorSymbol(op=set_operators[toks[0]])
+
+
+def get_node_set_expr(toks):
+    """
+    Chain the operands of union, intersect or except operators (from left to right).
+    The results of a path expression are spread over multiple tokens, so all tokens between two operators
+    are one operand.
+    """
+    if not any(isinstance(tok, SetOperatorSymbol) for tok in toks):
+        return toks
+
+    operands = [[]]
+    ops = []
+    for tok in toks:
+        if isinstance(tok, SetOperatorSymbol):
+            ops.append(tok.op)
+            operands.append([])
+        else:
+            operands[-1].append(tok)
+
+    operands = [operand[0] if len(operand) == 1 else operand for operand in operands]
+
+    node = operands[0]
+    for op, operand in zip(ops, operands[1:]):
+        node = NodeSetOperator(left=node, op=op, right=operand)
+
+    return node
+
+
+tx_IntersectExceptSymbol = MatchFirst([Keyword("intersect"), Keyword("except")])
+tx_IntersectExceptSymbol.setParseAction(get_set_operator_symbol)
+
+t_IntersectExceptExpr = t_InstanceofExpr + ZeroOrMore(tx_IntersectExceptSymbol + t_InstanceofExpr)
 t_IntersectExceptExpr.setName("IntersectExceptExpr")
+t_IntersectExceptExpr.setParseAction(get_node_set_expr)
 
-t_UnionExpr = t_IntersectExceptExpr + ZeroOrMore(
-    MatchFirst(Keyword("union") | Literal("|")) + t_IntersectExceptExpr
-)
+tx_UnionSymbol = MatchFirst([Keyword("union"), Literal("|")])
+tx_UnionSymbol.setParseAction(get_set_operator_symbol)
+
+t_UnionExpr = t_IntersectExceptExpr + ZeroOrMore(tx_UnionSymbol + t_IntersectExceptExpr)
 t_UnionExpr.setName("UnionExpr")
+t_UnionExpr.setParseAction(get_node_set_expr)
 """end Combining node sequences"""
 
 
@@ -966,22 +2268,22 @@ tx_MultiplicativeExpr.setName("MultiplicativeExpr")
 
 
 def get_nodes(l_values):
-    # First loop though the whole equation and look for multiplication/dividing/modulo operators
-
-    for i, val in enumerate(l_values):
-        if val in ["*", "div", "mod"]:
-            # if  val in [operator.mul, operator.truediv]:
-            newlist = add_node(i=i, l_values=l_values)
-            return get_nodes(newlist)
+    """
+    Replace the operators and their operands by BinaryOperator nodes, in place. Multiplication, division and
+    modulo go first, then addition and subtraction, and operators of the same precedence are applied from left
+    to right. Long sums are handled in a loop, so they do not run into the recursion limit.
+    """
+    for symbols in (["*", "div", "mod"], ["+", "-"]):
+        i = 0
+        while i < len(l_values):
+            if l_values[i] in symbols:
+                # The operator and its operands are replaced by a node at the position of the left operand,
+                # so the next operator is at the same position as this one
+                add_node(i=i, l_values=l_values)
+            else:
+                i += 1
 
-    # If mul/div operators have been handled, continue on with adding and subtracting
-    for i, val in enumerate(l_values):
-        # go though list of values, try to find operators in order of precedence.
-        if val in ["+", "-"]:
-            # if  val in [operator.add, operator.sub]:
-            # Create a node for these
-            newlist = add_node(i=i, l_values=l_values)
-            return get_nodes(newlist)
+    return l_values
 
 
 def get_additive_expr(v):
@@ -1023,7 +2325,8 @@ t_RangeExpr.setName("RangeExpr")
 def range_expr(toks):
     if len(toks) > 1:
         if toks[1] == "to":
-            return range(toks[0], toks[2])
+            # The bounds can be expressions, so the range is created when the expression is evaluated
+            return BinaryOperator(left=toks[0], op=integer_range, right=toks[2])
 
     # Don't return range if 'to' isn't found.
     return toks
@@ -1047,13 +2350,14 @@ t_ValueComp = (
 t_ValueComp.setName("ValueComp")
 
 
+# '<=' and '>=' need to be tried before '<' and '>', otherwise only the first character would be matched
 t_GeneralComp = (
     Literal("=")
     | Literal("!=")
-    | Literal("<")
     | Literal("<=")
-    | Literal(">")
+    | Literal("<")
     | Literal(">=")
+    | Literal(">")
 )
 t_GeneralComp.setName("GeneralComp")
 
@@ -1071,9 +2375,6 @@ class SyntaxTreeNodeMixin(object):
         """
         raise NotImplementedError
 
-    def process_children(self):
-        raise NotImplementedError
-
 
 class Operator:
     pass
@@ -1085,22 +2386,18 @@ class Operator:
 
     def answer(self, variable_map, lxml_etree, context_item_value=None):
         """
-        Returns the answer of the operator
+        Returns the answer of the operator. The values of the operands are not stored in the syntax tree.
 
         :param context_item_value:
         :return:
         """
-        raise NotImplementedError
+        return resolve_expression(self, variable_map=variable_map, lxml_etree=lxml_etree,
+                                  context_item_value=context_item_value)
 
-    def resolve(self, variable_map, lxml_etree):
+    def apply(self, *operands):
         """
-        Resolves the operator by calling the resolve_expression loop on its children
-
-        :param variable_map:
-        :param lxml_etree:
-        :return:
+        Apply the operator to the values of the operands (the child nodes, from left to right)
         """
-
         raise NotImplementedError
 
 
@@ -1109,40 +2406,8 @@ class UnaryOperator(SyntaxTreeNodeMixin, Operator):
         self.operand = operand
         self.op = operator
 
-    def resolve(self, variable_map, lxml_etree):
-        """
-        Resolve parameter, path expression and context item of children
-
-        :param variable_map:
-        :param lxml_etree:
-        :return:
-        """
-
-        if isinstance(self.operand, functools.partial):
-
-            resolve_paths(fn=self.operand, lxml_etree=lxml_etree)
-            # cast_parameters(fn=self.operand, paramlist=variable_map)
-        else:
-            print("Operand of unary operator type not known")
-
-    def answer(self, variable_map, lxml_etree, context_item_value=None):
-
-        if isinstance(self.operand, int):
-            # If the value is an int, we can just use this value
-            operand = self.operand
-
-        elif isinstance(self.operand, Operator):
-            # If the value is an Operator, we need to get to calculate its value first
-            operand = self.operand.answer()
-
-        elif isinstance(self.operand, functools.partial):
-            # Get the value from the function
-            operand = self.operand()
-
-        else:
-
-            # Is an XPath expression that needs to be resolved.
-            operand = self.operand.resolve_expression()
+    def apply(self, operand):
+        operand = arithmetic_operand(operand)
 
         if self.op == "+":
             return +operand
@@ -1155,11 +2420,6 @@ class UnaryOperator(SyntaxTreeNodeMixin, Operator):
     def _children(self):
         return [self.operand]
 
-    def process_children(self):
-        new_operand = yield self.operand
-        if new_operand is not None:
-            self.operand = new_operand
-
 
 class BinaryOperator(SyntaxTreeNodeMixin, Operator):
     def __init__(self, left, op, right):
@@ -1171,83 +2431,35 @@ class BinaryOperator(SyntaxTreeNodeMixin, Operator):
     def _children(self) -> list:
         return [self.left, self.right]
 
-    def process_children(self):
-        new_left = yield self.left
-        if new_left is not None:
-            self.left = new_left
-
-        new_right = yield self.right
-        if new_right is not None:
-            self.right = new_right
-
-    def resolve(self, variable_map, lxml_etree):
-        """
-        Resolve parameter, path expression and context item of children
-
-        :param variable_map:
-        :param lxml_etree:
-        :return:
-        """
-        if isinstance(self.left, functools.partial):
-
-            resolve_paths(self.left, lxml_etree=lxml_etree)
-            # self.left.resolve_paths(lxml_etree=lxml_etree)
-            # cast_parameters(self.left, paramlist=variable_map)
-            # self.left.cast_parameters(paramlist=variable_map)
-
-
-        if isinstance(self.right, functools.partial):
-            # self.right.resolve_paths(lxml_etree=lxml_etree)
-            # self.right.cast_parameters(paramlist=variable_map)
-
-            resolve_paths(self.right, lxml_etree=lxml_etree)
-            # cast_parameters(self.right, paramlist=variable_map)
+    def apply(self, left, right):
+        left, right = arithmetic_operand(left), arithmetic_operand(right)
 
-    def answer(self, variable_map, lxml_etree, context_item_value=None):
-
-        if isinstance(self.left, int) or isinstance(self.left, float):
-            # If the value is an int, we can just use this value
-            left = self.left
-
-        elif isinstance(self.left, Operator):
-            # If the value is an Operator, we need to get to calculate its value first
-            left = resolve_expression(expression=self.left, variable_map=variable_map, lxml_etree=lxml_etree)
-
-            # left = left.answer()
-
-        elif isinstance(self.left, functools.partial):
-            # Get the value from the function
-
-            left = self.left()
-
-        elif isinstance(self.left, ContextItem):
-            left = context_item_value
-
-        else:
-
-            # Is an XPath expression that needs to be resolved.
-            left = self.left.resolve_child()
+        left, right = promote_operands(left, right)
+        if self.op is operator.truediv and in_decimal_mode() and not isinstance(left, float) \
+                and not isinstance(right, float):
+            # In decimal mode, dividing integers or decimals gives a decimal
+            return Decimal(left) / Decimal(right)
 
-        if isinstance(self.right, int) or isinstance(self.right, float):
-            right = self.right
-
-        elif isinstance(self.right, Operator):
-            right = resolve_expression(expression=self.right, variable_map=variable_map, lxml_etree=lxml_etree)
+        return self.op(left, right)
 
-            # If the value is an Operator, we need to get to calculate its value first
-            # right = right.answer()
 
-        elif isinstance(self.right, functools.partial):
-            # Get the value from the function
-            right = self.right()
+class NodeSetOperator(Operator):
+    def __init__(self, left, op, right):
+        """
+        Union, intersect or except of two node sequences
+        https://www.w3.org/TR/xpath-3/#combining_seq
 
-        elif isinstance(self.right, ContextItem):
-            right = context_item_value
+        :param op: Set operation from the nodesets module
+        """
+        self.left = left
+        self.op = op
+        self.right = right
 
-        else:
-            # Is an XPath expression that needs to be resolved.
-            right = self.right.resolve_child()
+    @property
+    def _children(self):
+        return [self.left, self.right]
 
+    def apply(self, left, right):
         return self.op(left, right)
 
 
@@ -1297,38 +2509,6 @@ class Compare(SyntaxTreeNodeMixin):
     def _children(self) -> list:
         return [self.left] + self.comparators
 
-    def process_children(self):
-        new_left = yield self.left
-        if new_left is not None:
-            self.left = new_left
-
-        for i, comparator in enumerate(self.comparators):
-            new_comparator = yield comparator
-            if new_comparator is not None:
-                self.comparators[i] = new_comparator
-
-    def resolve(self, variable_map, lxml_etree, context_item_value):
-
-        for i, child in enumerate(self.comparators):
-            ans = resolve_expression(
-                child,
-                variable_map=variable_map,
-                lxml_etree=lxml_etree,
-                context_item_value=context_item_value
-            )
-            if ans is not None:
-                self.comparators[i] = ans
-
-        # Do the same with the left operand
-        ans_left = resolve_expression(
-            self.left,
-            variable_map=variable_map,
-            lxml_etree=lxml_etree,
-            context_item_value=context_item_value
-        )
-        if ans_left is not None:
-            self.left = ans_left
-
     def answer(self, variable_map, lxml_etree, context_item_value=None):
         """
         Gives the answer of the Operator. If the operator contains any nested functions,
@@ -1338,33 +2518,16 @@ class Compare(SyntaxTreeNodeMixin):
 
         :return: Answer of operator
         """
-        if isinstance(self.left, functools.partial):
-            left = self.left()
-
-        elif isinstance(self.left, Operator):
-            # Need to get the value of the operator
-            left = self.left.answer(variable_map=variable_map, lxml_etree=lxml_etree, context_item_value=context_item_value)
-
-        elif isinstance(self.left, ContextItem):
-            left = context_item_value
-
-        else:
-            left = self.left
-
-        for i, comparator in enumerate(self.comparators):
-
-            # Resolve function or operator if this is a nested function
-            if isinstance(comparator, functools.partial):
-                self.comparators[i] = comparator()
-                comparator = comparator()
-
-            elif isinstance(comparator, Operator):
-                self.comparators[i] = comparator.answer()
-                comparator = comparator.answer()
+        return resolve_expression(self, variable_map=variable_map, lxml_etree=lxml_etree,
+                                  context_item_value=context_item_value)
 
-            elif isinstance(self.comparators[i], ContextItem):
-                comparator = context_item_value
+    def apply(self, left, *comparators):
+        """
+        Compare the values of the operands
 
+        :return: Answer of operator
+        """
+        for comparator in comparators:
             if self.op(left, comparator) is False:
                 return False
 
@@ -1378,7 +2541,30 @@ class CompareValue(Compare):
 
 class CompareGeneral(Compare):
     # https://www.w3.org/TR/xpath-3/#id-general-comparisons
-    pass
+
+    def apply(self, left, *comparators):
+        """
+        General comparisons are existentially quantified: the comparison is true if any pair of (atomized) items
+        from the operands satisfies the comparison. Pairs are tried one by one, and we stop at the first match.
+
+        :return: Answer of operator
+        """
+        for comparator in comparators:
+            if self.op is operator.eq and isinstance(comparator, IntegerRange):
+                # Membership of a range is checked without going through its items
+                if not any(left_item in comparator for left_item in atomized_items(left)):
+                    return False
+                continue
+
+            # The right hand side is iterated for every left item, so it needs to be materialized once.
+            right_items = list(atomized_items(comparator))
+
+            if not any(self.op(left_item, right_item)
+                       for left_item in atomized_items(left)
+                       for right_item in right_items):
+                return False
+
+        return True
 
 
 class CompareNode(Compare):
@@ -1387,17 +2573,17 @@ class CompareNode(Compare):
 
 
 comp_expr = {
-    "=": operator.is_,  # General comparison
+    "=": operator.eq,  # General comparison
     "eq": operator.eq,  # value comparison
-    "!=": operator.is_not,
+    "!=": operator.ne,
     "ne": operator.ne,
-    "<": "<",
+    "<": operator.lt,
     "lt": operator.lt,
-    "<=": "<=",
+    "<=": operator.le,
     "le": operator.le,
-    ">": ">",
+    ">": operator.gt,
     "gt": operator.gt,
-    ">=": ">=",
+    ">=": operator.ge,
     "ge": operator.ge,
 }
 
@@ -1450,24 +2636,50 @@ elif xpath_version == "3.1":
 
 class AndComparison:
     def __init__(self, values):
+        """
+        N-ary 'and' expression. Operands are only evaluated when needed: evaluation stops at the first operand
+        with an effective boolean value of False.
+
+        :param values: List of operands, in the order they appear in the expression
+        """
         self.values = values
 
-    def answer(self):
+    @property
+    def _children(self):
+        return self.values
+
+    def answer(self, variable_map=None, lxml_etree=None, context_item_value=None):
 
         for value in self.values:
-            if value is False:
+            outcome = resolve_expression(
+                value, variable_map=variable_map, lxml_etree=lxml_etree, context_item_value=context_item_value
+            )
+            if effective_boolean_value(outcome) is False:
                 return False
         return True
 
 
 class OrComparison:
     def __init__(self, values):
+        """
+        N-ary 'or' expression. Operands are only evaluated when needed: evaluation stops at the first operand
+        with an effective boolean value of True.
+
+        :param values: List of operands, in the order they appear in the expression
+        """
         self.values = values
 
-    def answer(self):
+    @property
+    def _children(self):
+        return self.values
+
+    def answer(self, variable_map=None, lxml_etree=None, context_item_value=None):
 
         for value in self.values:
-            if value is True:
+            outcome = resolve_expression(
+                value, variable_map=variable_map, lxml_etree=lxml_etree, context_item_value=context_item_value
+            )
+            if effective_boolean_value(outcome) is True:
                 return True
         return False
 
@@ -1475,8 +2687,8 @@ class OrComparison:
 def get_and(v):
     if len(v) > 1:
         if v[1] == "and":
-
-            return AndComparison(values=[v[0], v[2]])
+            # Operands are on the even positions, the 'and' keywords in between
+            return AndComparison(values=list(v[0::2]))
 
     return v
 
@@ -1490,8 +2702,8 @@ t_AndExpr.setParseAction(get_and)
 def get_or(v):
     if len(v) > 1:
         if v[1] in ["OR", "or"]:
-
-            return OrComparison(values=[v[0], v[2]])
+            # Operands are on the even positions, the 'or' keywords in between
+            return OrComparison(values=list(v[0::2]))
 
     return v
 
@@ -1536,6 +2748,81 @@ t_SimpleLetClause.setName("SimpleLetClause")
 t_LetExpr = t_SimpleLetClause + Keyword("return") + t_ExprSingle
 t_LetExpr.setName("LetExpr")
 
+
+class LazyValue(BoundValue):
+    def __init__(self, expr, variable_map, lxml_etree, context_item_value=None):
+        """
+        Value of a variable that is bound by a let expression. The expression is evaluated when the variable is
+        referenced for the first time, and the value is reused after that. A binding that is never referenced is
+        never evaluated.
+
+        :param expr: Expression of the binding
+        :param variable_map: Variables the expression can refer to
+        """
+        self.expr = expr
+        self.variable_map = variable_map
+        self.lxml_etree = lxml_etree
+        self.context_item_value = context_item_value
+
+        # The frame is created with the let expression, so the binding is evaluated in the context of the
+        # let expression, wherever the variable is referenced.
+        self.frame = EvaluationFrame(variables=variable_map, context_item=context_item_value)
+
+        self.evaluated = False
+        self._value = None
+
+    @property
+    def value(self):
+        if not self.evaluated:
+            with self.frame:
+                self._value = resolve_expression(self.expr, variable_map=self.variable_map,
+                                                 lxml_etree=self.lxml_etree,
+                                                 context_item_value=self.context_item_value)
+            self.evaluated = True
+
+        return self._value
+
+
+class LetExpression(Expr):
+    def __init__(self, bindings, return_expr):
+        """
+        Let expression: let $x := E return R. https://www.w3.org/TR/xpath-3/#id-let-expressions
+
+        :param bindings: List of VariableBinding. A binding can refer to the variables of the bindings before it.
+        :param return_expr: Expression that is evaluated with the bound variables
+        """
+        self.bindings = bindings
+        self.return_expr = return_expr
+
+    @property
+    def _children(self):
+        return [binding.expr for binding in self.bindings] + [self.return_expr]
+
+    def answer(self, variable_map, lxml_etree, context_item_value=None):
+        scope = variable_map
+        for binding in self.bindings:
+            lazy_value = LazyValue(binding.expr, variable_map=scope, lxml_etree=lxml_etree,
+                                   context_item_value=context_item_value)
+            scope = ChainMap({binding.qname.__repr__(): lazy_value}, scope)
+
+        with EvaluationFrame(variables=scope):
+            return resolve_expression(self.return_expr, variable_map=scope, lxml_etree=lxml_etree,
+                                      context_item_value=context_item_value)
+
+
+def get_let_binding(toks):
+    # $ VarName := ExprSingle
+    return VariableBinding(qname=toks[1], expr=toks[3])
+
+
+def get_let_expr(toks):
+    bindings = [tok for tok in toks if isinstance(tok, VariableBinding)]
+    return LetExpression(bindings=bindings, return_expr=toks[-1])
+
+
+t_SimpleLetBinding.setParseAction(get_let_binding)
+t_LetExpr.setParseAction(get_let_expr)
+
 # Set ExprSingle with actual expressions
 
 t_ExprSingle <<= t_IfExpr ^ t_ForExpr ^ t_OrExpr ^ t_QuantifiedExpr ^ t_LetExpr
@@ -0,0 +1,228 @@
+"""
+Aggregates of paths over a document that only grows, like a filing that is assembled fact by fact.
+
+Assertions like sum(//ns:X) = //ns:Total are evaluated again after every fact that is added. A FactStream keeps
+the count, sum, minimum and maximum of every path that is the argument of fn:count, fn:sum, fn:avg, fn:min or fn:max,
+and updates them with each element that is appended, instead of running the query over the whole document again.
+
+Paths of which the aggregates are kept are absolute paths of child (/) and descendant (//) steps with a name test,
+without predicates: whether an appended element is selected by such a path only depends on its name and the names
+of its ancestors. Aggregates of other paths are computed as usual.
+"""
+from lxml import etree
+
+from ..conversion.aggregates import RunningAggregate
+from ..conversion.atomize import current_atomizer
+from ..conversion.document import Document
+from ..conversion.frame import EvaluationFrame
+from ..conversion.function import FunctionCall, streaming_functions
+from ..conversion.qname import QName
+from .expressions import PathExpression, XPath, walk
+
+
+def aggregated_path(function_call):
+    """
+    Get the path of which the aggregate can be kept, if the node is a call of an aggregate function on such a path
+
+    :return: PathExpression, or None
+    """
+    if not isinstance(function_call, FunctionCall) or function_call.qname not in streaming_functions:
+        return None
+
+    arguments = function_call._children
+    if len(arguments) != 1:
+        return None
+
+    path = arguments[0]
+    while isinstance(path, XPath):
+        path = path.expr
+
+    if not isinstance(path, PathExpression) or path.relative:
+        return None
+
+    for step in path.steps:
+        if str(step.axis) not in ("/", "//") or step.predicatelist:
+            return None
+        if not isinstance(step.step, QName) and step.step != "*":
+            return None
+
+    return path
+
+
+def clark_name(name, namespaces):
+    """
+    Get the tag of the elements LXML gives for a name test, like {http://example}X for ns:X
+
+    :param name: QName
+    :param namespaces: Dict of prefix to namespace the prefixes of the path are resolved with
+    """
+    if name.prefix:
+        return f"{{{namespaces.get(name.prefix)}}}{name.localname}"
+    return name.localname
+
+
+def name_matches(node, name, namespaces):
+    """
+    Check if an element has a name of a name test
+
+    :param name: QName or "*"
+    :param namespaces: Dict of prefix to namespace the prefixes of the path are resolved with
+    """
+    if not isinstance(node.tag, str):
+        # Comments and processing instructions
+        return False
+    if name == "*":
+        return True
+    return node.tag == clark_name(name, namespaces)
+
+
+def path_matches(node, steps, namespaces, index=None):
+    """
+    Check if an element is selected by an absolute path of child and descendant name tests, by matching the
+    steps against the element and its ancestors, from the last step to the first.
+
+    :param steps: Axis steps of the path
+    :param index: Index of the step the element should match. Defaults to the last step.
+    """
+    if index is None:
+        index = len(steps) - 1
+
+    step = steps[index]
+    if not name_matches(node, step.step, namespaces):
+        return False
+
+    parent = node.getparent()
+    if index == 0:
+        # /name selects the root element, //name any element
+        return str(step.axis) == "//" or parent is None
+
+    if str(step.axis) == "/":
+        return parent is not None and path_matches(parent, steps, namespaces, index - 1)
+
+    ancestor = parent
+    while ancestor is not None:
+        if path_matches(ancestor, steps, namespaces, index - 1):
+            return True
+        ancestor = ancestor.getparent()
+    return False
+
+
+class TrackedPath:
+    def __init__(self, path, atomizer, decimal_mode):
+        """
+        Path of which the aggregate is kept, for the atomizer and decimal mode of a Parser
+
+        :param path: PathExpression
+        """
+        self.steps = path.steps
+        self.atomizer = atomizer
+        self.decimal_mode = decimal_mode
+        self.aggregate = RunningAggregate()
+
+    def add(self, elements):
+        """
+        Add the values of elements to the aggregate
+        """
+        with EvaluationFrame(atomizer=self.atomizer, decimal_mode=self.decimal_mode):
+            atomize_item = current_atomizer().atomize_item
+            for element in elements:
+                self.aggregate.add(atomize_item(element))
+
+
+class FactStream:
+    def __init__(self, xml=None):
+        """
+        Document which facts are appended to, with the aggregates of the paths of the expressions that are
+        evaluated against it. Appending an element updates the aggregates of the paths that select it, in
+        constant time per path. Elements should only be added with append(), and not be changed after that.
+
+        For example:
+        stream = FactStream("<xbrl xmlns:ns='http://example'/>")
+        assertion = Parser("sum(//ns:X) = //ns:Total", no_resolve=True)
+        for fact in facts:
+            stream.append(fact)
+            print(stream.evaluate(assertion))
+
+        :param xml: Document to start with, or anything Document.load accepts
+        """
+        self.lxml_etree = Document.load(xml).root if xml is not None else None
+
+        # Per path query, atomizer and decimal mode, the path of which the aggregate is kept
+        self.paths = {}
+        # Per Parser, the id of every path argument of an aggregate function to the path that keeps its aggregate
+        self.parsers = {}
+
+    def track(self, parser):
+        """
+        Start keeping the aggregates of the paths of an expression. The aggregates of new paths are computed from
+        the elements that are already in the document.
+
+        :param parser: Parser of the expression
+        :return: Dict of id of path argument to RunningAggregate, as it is passed to the evaluation frame
+        """
+        if parser in self.parsers:
+            return self.parsers[parser]
+
+        tracked = {}
+        for node in walk(parser.XPath):
+            path = aggregated_path(node)
+            if path is None:
+                continue
+
+            key = (path.query, id(parser.atomizer), parser.decimal_mode)
+            if key not in self.paths:
+                tracked_path = TrackedPath(path, parser.atomizer, parser.decimal_mode)
+                if self.lxml_etree is not None:
+                    tracked_path.add(path.select(lxml_etree=self.lxml_etree, variable_map={}))
+                self.paths[key] = tracked_path
+
+            tracked[id(node._children[0])] = self.paths[key]
+
+        self.parsers[parser] = tracked
+        return tracked
+
+    def append(self, element, parent=None):
+        """
+        Append an element (with its descendants) to the document, and add it to the aggregates of the paths
+        that select it.
+
+        :param element: LXML element, or a byte string or string of XML of the element
+        :param parent: Element to append to. Defaults to the root element.
+        :return: The appended element
+        """
+        if not isinstance(element, etree._Element):
+            element = Document.load(element).root
+
+        if parent is None and self.lxml_etree is None:
+            # The first element is the root of the document
+            self.lxml_etree = element
+        else:
+            (parent if parent is not None else self.lxml_etree).append(element)
+
+        namespaces = self.lxml_etree.nsmap
+        elements = list(element.iter())
+        for tracked_path in self.paths.values():
+            tracked_path.add(node for node in elements if path_matches(node, tracked_path.steps, namespaces))
+
+        return element
+
+    def aggregates(self, parser):
+        """
+        Get the aggregates of the paths of an expression
+
+        :return: Dict of id of path argument to RunningAggregate
+        """
+        return {key: tracked_path.aggregate for key, tracked_path in self.track(parser).items()}
+
+    def evaluate(self, parser, variable_map=None, **limits):
+        """
+        Evaluate an expression against the document. Aggregate functions of tracked paths use the aggregates that
+        are kept, other parts of the expression are evaluated as usual.
+
+        :param parser: Parser of the expression
+        :param variable_map: Dict of variables. If None, the variables of the Parser are used.
+        :param limits: max_steps, max_items, deadline or budget, as for Parser.evaluate()
+        :return: Result of XPath expression
+        """
+        return parser.evaluate(xml=self.lxml_etree, variable_map=variable_map, aggregates=self.aggregates(parser),
+                               **limits)
@@ -0,0 +1,235 @@
+"""
+Incremental evaluation of an expression with changing variables.
+
+An editor of formulas evaluates the same expression again and again, with one variable changed each time. The
+parts of the expression that do not refer to the changed variable, like sum(//Revenue) in
+sum(//Revenue) * $rate, have the same value as in the previous evaluation and are not evaluated again.
+
+Every subtree which is evaluated with the variables of the expression itself (operands, sequence items,
+function arguments and the conditions and branches of if, and and or) keeps its value, together with the names
+of the variables it refers to. When the variables change, the values of the subtrees that refer to one of the
+changed variables are dropped. Everything else is reused.
+"""
+from decimal import Decimal
+
+from ..conversion.function import FunctionCall
+from ..conversion.qname import Parameter
+from .expressions import AND, IF, OPERATOR, OR, SEQUENCE, WRAPPER, ContextItem, child_nodes, evaluation_kind
+from .qualified_names import VariableRegistry
+
+var_reg = VariableRegistry()
+
+
+def variable_dependencies(expression):
+    """
+    Get the names of the variables every node of the syntax tree refers to, within its subtree.
+
+    :param expression: Root of the syntax tree
+    :return: Dict of id of node to frozenset of variable names
+    """
+    dependencies = {}
+
+    # Nodes are visited after their children, without recursion
+    stack = [(expression, False)]
+    while stack:
+        node, children_done = stack.pop()
+        if id(node) in dependencies:
+            continue
+
+        children = child_nodes(node)
+        if not children_done and children:
+            stack.append((node, True))
+            stack.extend((child, False) for child in children)
+            continue
+
+        names = set()
+        for child in children:
+            names.update(dependencies.get(id(child), ()))
+        if isinstance(node, Parameter):
+            names.add(repr(node.qname))
+        dependencies[id(node)] = frozenset(names)
+
+    return dependencies
+
+
+def reusable_nodes(expression):
+    """
+    Get the nodes of which the value can be kept between evaluations: the nodes that are always evaluated with the
+    variables and context item of the expression itself. Nodes within for, let and quantified expressions,
+    predicates and paths are evaluated with other variables or context items, so only the expression as a whole
+    is kept. Literals and variable references are cheap to evaluate, and are left out.
+
+    :param expression: Root of the syntax tree
+    :return: List of nodes
+    """
+    nodes = []
+    stack = [expression]
+    while stack:
+        node = stack.pop()
+        kind = evaluation_kind(type(node))
+
+        if kind == WRAPPER:
+            stack.append(node.expr)
+            continue
+
+        if kind in (SEQUENCE, OPERATOR, AND, OR, IF):
+            if kind != IF:
+                # The value of an if expression is the value of its branch
+                nodes.append(node)
+            stack.extend(child_nodes(node))
+
+        elif isinstance(node, FunctionCall):
+            nodes.append(node)
+            stack.extend(node._children)
+
+        elif not isinstance(node, (int, float, str, Decimal, Parameter, ContextItem)):
+            # Paths, for, let and quantified expressions
+            nodes.append(node)
+
+    return nodes
+
+
+def same_value(a, b):
+    """
+    Check if two variable values are the same. Values of other types are not the same, as 1 and 1.0 are different
+    values in XPath.
+    """
+    if a is b:
+        return True
+    if type(a) is not type(b):
+        return False
+    if isinstance(a, (list, tuple)):
+        return len(a) == len(b) and all(same_value(item_a, item_b) for item_a, item_b in zip(a, b))
+    try:
+        return bool(a == b)
+    except Exception:
+        return False
+
+
+def refers_to_variables(value):
+    """
+    Check if a variable value can refer to other variables: string values are parsed as XPath expressions.
+    """
+    if isinstance(value, (list, tuple)):
+        return any(refers_to_variables(item) for item in value)
+    return isinstance(value, str)
+
+
+class SubtreeValues:
+    # Returned by lookup when the value of a node is not known
+    MISSING = object()
+
+    def __init__(self, expression):
+        """
+        Values of the subtrees of an expression, kept between evaluations with different variables.
+
+        :param expression: Root of the syntax tree
+        """
+        dependencies = variable_dependencies(expression)
+        self.dependencies = {id(node): dependencies[id(node)] for node in reusable_nodes(expression)}
+        self.names = dependencies[id(expression)]
+
+        # Id of node to value, of the nodes that are still valid for the current variables
+        self.values = {}
+
+        self.variables = {}
+        self.document = None
+        self.context_item = None
+
+        # Number of subtrees that were reused and evaluated by the last evaluation
+        self.reused = 0
+        self.evaluated = 0
+
+    def variable(self, name, variable_map):
+        """
+        Get the value of a variable, as variable_value would look it up
+        """
+        if name in variable_map:
+            return variable_map[name]
+        return var_reg.variables.get(name, self.MISSING)
+
+    def update(self, variable_map, document, context_item):
+        """
+        Drop the values of the subtrees that refer to variables that changed. If the document or context item
+        changed, all values are dropped.
+
+        :return: Set of names of the variables that changed
+        """
+        if document is not self.document or context_item is not self.context_item:
+            self.values.clear()
+
+        names = set(self.names) | set(variable_map) | set(self.variables)
+        variables = {name: self.variable(name, variable_map) for name in names}
+        changed = {name for name in names
+                   if not same_value(variables[name], self.variables.get(name, self.MISSING))}
+
+        if changed and self.values:
+            # Variables with string values are XPath expressions, which can refer to any variable
+            indirect = {name for name in names
+                        if refers_to_variables(variables[name]) or refers_to_variables(self.variables.get(name))}
+            stale = changed | indirect
+            self.values = {key: value for key, value in self.values.items() if not self.dependencies[key] & stale}
+
+        self.variables = variables
+        self.document = document
+        self.context_item = context_item
+        self.reused = self.evaluated = 0
+
+        return changed
+
+    def lookup(self, node):
+        """
+        Get the value of a node from an earlier evaluation
+
+        :return: The value, or SubtreeValues.MISSING if the node needs to be evaluated
+        """
+        value = self.values.get(id(node), self.MISSING)
+        if value is self.MISSING:
+            return value
+
+        self.reused += 1
+        # Callers get a list of their own
+        return list(value) if isinstance(value, list) else value
+
+    def store(self, node, value):
+        """
+        Keep the value of a node, if it is a subtree of which the value can be reused
+        """
+        key = id(node)
+        if key in self.dependencies:
+            self.values[key] = list(value) if isinstance(value, list) else value
+            self.evaluated += 1
+
+
+class IncrementalEvaluation:
+    def __init__(self, parser, xml=None, context_item=None):
+        """
+        Evaluate an expression again and again with changing variables, evaluating only the parts of the expression
+        that refer to variables that changed.
+
+        An incremental evaluation is meant for one thread at a time. Functions are assumed to give the same outcome
+        for the same arguments and document.
+
+        :param parser: Parser of the expression
+        :param xml: XML document to evaluate the expression against. If None, the document of the Parser is used.
+        :param context_item: Context item of the expression. If None, the context item of the Parser is used.
+        """
+        self.parser = parser
+        self.lxml_etree = parser.get_tree(xml) if xml is not None else parser.lxml_etree
+        self.context_item = context_item if context_item is not None else parser.context_item
+        self.subtree_values = SubtreeValues(parser.XPath)
+
+    def evaluate(self, variable_map=None, **limits):
+        """
+        Evaluate the expression with the variables. Subtrees that do not refer to variables that changed since the
+        previous evaluation keep their values.
+
+        :param variable_map: Dict of variables. If None, the variables of the Parser are used.
+        :param limits: max_steps, max_items, deadline or budget, as for Parser.evaluate()
+        :return: Result of XPath expression
+        """
+        variable_map = variable_map if variable_map is not None else self.parser.variable_map
+        self.subtree_values.update(variable_map, self.lxml_etree, self.context_item)
+
+        return self.parser.evaluate(xml=self.lxml_etree, variable_map=variable_map, context_item=self.context_item,
+                                    subtree_values=self.subtree_values, **limits)
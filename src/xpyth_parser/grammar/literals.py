@@ -10,7 +10,7 @@ from pyparsing import (
     Suppress,
 )
 
-from ..conversion.primaries import str_to_int, str_to_float
+from ..conversion.primaries import str_to_int, str_to_float, str_to_decimal_literal
 
 xpath_version = "3.1"
 
@@ -30,15 +30,18 @@ https://www.w3.org/TR/xpath20/#id-primary-expressions
 t_IntegerLiteral = Word(nums)
 t_IntegerLiteral.addParseAction(str_to_int)
 
-t_DecimalLiteral = Combine(l_dot + t_IntegerLiteral) | Combine(
-    t_IntegerLiteral + l_dot + Optional(t_IntegerLiteral)
+# Digits of decimal and double literals are kept as text, so leading zeros of the fraction (like in 1.05) are kept
+t_Digits = Word(nums)
+
+t_DecimalLiteral = Combine(l_dot + t_Digits) | Combine(
+    t_Digits + l_dot + Optional(t_Digits)
 )
-t_DecimalLiteral.addParseAction(str_to_float)
+t_DecimalLiteral.addParseAction(str_to_decimal_literal)
 
 # https://www.w3.org/TR/xpath20/#doc-xpath-DoubleLiteral
 t_DoubleLiteral = (
-    Combine(l_dot + t_IntegerLiteral)
-    | Combine(t_IntegerLiteral + Optional(l_dot + Optional(t_IntegerLiteral)))
+    Combine(l_dot + t_Digits)
+    | Combine(t_Digits + Optional(l_dot + Optional(t_Digits)))
     + (Literal("e") | Literal("E"))
     + Optional(Literal("+") | Literal("-"))
     + t_IntegerLiteral
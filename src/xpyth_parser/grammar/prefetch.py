@@ -0,0 +1,140 @@
+"""
+Evaluation of a set of expressions, like all assertions of a taxonomy, against one document.
+
+Every path is a query of its own for LXML, which walks the tree to answer it. A set of 3000 assertions walks the tree
+3000 times. A FormulaSet collects the simple paths of all its expressions, like //ns:Revenue and /xbrl/ns:Revenue, and
+finds the elements of all of them in a single walk over the document. Those paths then take their elements from that
+walk, other paths are queried as usual.
+
+Simple paths are absolute paths of child (/) and descendant (//) steps with a name test, without predicates: whether
+an element is selected by such a path only depends on its name and the names of its ancestors.
+"""
+from lxml import etree
+
+from ..conversion.document import Document
+from ..conversion.qname import QName
+from .expressions import PathExpression, walk
+from .facts import clark_name, path_matches
+
+
+def is_simple_path(path):
+    """
+    Check if the elements of a path can be found by matching the names of an element and its ancestors
+    """
+    if path.relative or not path.steps or path.python_predicates:
+        return False
+
+    for step in path.steps:
+        if str(step.axis) not in ("/", "//") or step.predicatelist:
+            return False
+        if not isinstance(step.step, QName) and step.step != "*":
+            return False
+    return True
+
+
+def simple_paths(expression):
+    """
+    Get the simple paths of an expression, including those within predicates and function arguments
+
+    :param expression: Syntax tree
+    :return: Dict of query to PathExpression
+    """
+    return {node.query: node for node in walk(expression) if isinstance(node, PathExpression) and is_simple_path(node)}
+
+
+class PrefetchedPaths:
+    def __init__(self, root, paths):
+        """
+        Elements of simple paths, found in one walk over a document
+
+        :param root: Root element of the document
+        :param paths: Iterable of simple PathExpressions
+        """
+        self.root = root
+        namespaces = root.nsmap
+
+        # Query to list of elements in document order
+        self.results = {}
+        # Tag of the last step to the paths that end with it. Paths ending with * are checked for every element.
+        paths_by_tag = {}
+        any_tag = []
+        for path in paths:
+            names = [step.step for step in path.steps if isinstance(step.step, QName)]
+            if any(name.prefix and name.prefix not in namespaces for name in names):
+                # Left to LXML, which raises the error of the undefined prefix
+                continue
+
+            self.results[path.query] = []
+            last_step = path.steps[-1]
+            # Paths of a single descendant step (//ns:X) select every element with the tag
+            any_ancestors = len(path.steps) == 1 and str(last_step.axis) == "//"
+            if last_step.step == "*":
+                any_tag.append((path, any_ancestors))
+            else:
+                paths_by_tag.setdefault(clark_name(last_step.step, namespaces), []).append((path, any_ancestors))
+
+        for element in root.getroottree().iter(etree.Element):
+            candidates = paths_by_tag.get(element.tag)
+            if candidates is None and not any_tag:
+                continue
+
+            for path, any_ancestors in (candidates or []) + any_tag:
+                if any_ancestors or path_matches(element, path.steps, namespaces):
+                    self.results[path.query].append(element)
+
+    def elements(self, query):
+        """
+        Get the elements of a path
+
+        :param query: Query of the path
+        :return: New list of elements, or None if the path was not prefetched
+        """
+        elements = self.results.get(query)
+        return list(elements) if elements is not None else None
+
+    def __repr__(self):
+        return f"PrefetchedPaths(paths={len(self.results)})"
+
+
+class FormulaSet:
+    def __init__(self, parsers):
+        """
+        Set of expressions which are evaluated against the same documents. The simple paths of all expressions are
+        collected once, and answered in one walk over each document that the set is evaluated against.
+
+        For example:
+        formula_set = FormulaSet([Parser(assertion, no_resolve=True) for assertion in assertions])
+        for instance in instances:
+            print(formula_set.evaluate(xml=instance))
+
+        :param parsers: Parsers of the expressions
+        """
+        self.parsers = list(parsers)
+
+        self.paths = {}
+        for parser in self.parsers:
+            self.paths.update(simple_paths(parser.XPath))
+
+    def prefetch(self, xml):
+        """
+        Find the elements of the simple paths of all expressions in a document
+
+        :param xml: Document, or anything Document.load accepts
+        :return: PrefetchedPaths
+        """
+        return PrefetchedPaths(Document.load(xml).root, self.paths.values())
+
+    def evaluate(self, xml, variable_map=None, **limits):
+        """
+        Evaluate all expressions against a document, walking the document once for the simple paths of all of them
+
+        :param xml: Document, or anything Document.load accepts
+        :param variable_map: Dict of variables. If None, the variables of each Parser are used.
+        :param limits: max_steps, max_items, deadline or budget, as for Parser.evaluate(). Steps, items and deadline
+            apply to each expression on its own, a budget is shared by all of them.
+        :return: List of the results of the expressions, in the order of the parsers
+        """
+        document = Document.load(xml)
+        prefetched_paths = self.prefetch(document)
+        return [parser.evaluate(xml=document, variable_map=variable_map, prefetched_paths=prefetched_paths, **limits)
+                for parser in self.parsers]
@@ -0,0 +1,235 @@
+"""
+Evaluation of expressions against documents that do not fit in memory.
+
+Instances can be several gigabytes, too large to build a tree of. Expressions of which every path is the argument of
+fn:count, fn:sum, fn:avg, fn:min, fn:max, fn:exists or fn:empty can be evaluated in a single pass over the document
+with iterparse. The aggregates of the paths are computed while the document is read, and elements are cleared as
+soon as they have been read, so the memory that is used does not grow with the size of the document. Paths of which
+only the number of elements is used, like count(//xbrl), count elements when they start, so their content is never
+kept. Only the content of elements that predicates or atomization need is kept until the element ends.
+
+Paths are absolute paths of child (/) and descendant (//) steps with a name test, like //ns:Revenue or
+/xbrl/ns:Revenue. The last step can have predicates which only look at the element itself and its content,
+like [@contextRef = 'c1'] or [. > 0]. Predicates on the position of an element or on other parts of the document
+need the whole document, as do paths anywhere else in the expression.
+"""
+import io
+import mmap
+import os
+
+from lxml import etree
+
+from ..conversion.aggregates import RunningAggregate
+from ..conversion.atomize import current_atomizer
+from ..conversion.frame import EvaluationFrame
+from ..conversion.function import FunctionCall, streaming_functions
+from ..conversion.qname import QName
+from .expressions import (
+    ContextItem, PathExpression, XPath, child_nodes, variable_value, walk, xpath_variable_value,
+)
+from .facts import clark_name, path_matches
+
+# Functions whose path argument is aggregated while the document is read
+streamed_functions = streaming_functions | {"fn:exists", "fn:empty"}
+# Functions which only use the number of elements of their path argument
+counting_functions = {"fn:count", "fn:exists", "fn:empty"}
+
+# Parts of compiled predicates which refer to other nodes than the element and its content, or to its position
+non_local_predicates = ("..", "//", "parent::", "ancestor", "preceding", "following", "position(", "last(")
+
+
+class StreamedPath:
+    def __init__(self, path, function_name):
+        """
+        Path of which the aggregate is computed while the document is read
+
+        :param path: PathExpression
+        :param function_name: Name of the function the path is the argument of, like fn:count
+        """
+        self.path = path
+        self.steps = path.steps
+        self.aggregate = RunningAggregate()
+
+        # XPath of the predicates of the last step, compiled when the namespaces of the document are known
+        predicates = [predicate.to_str() for predicate in path.steps[-1].predicatelist]
+        self.predicate_str = "self::node()" + "".join(f"[{predicate}]" for predicate in predicates) \
+            if predicates else None
+        self.predicate = None
+        self.xpath_variables = {}
+
+        # Tag of the elements the last step selects, known once the namespaces of the document are known
+        self.tag = None
+        # Paths of a single descendant step (//ns:X) select every element with the tag
+        self.any_ancestors = len(self.steps) == 1 and str(self.steps[0].axis) == "//"
+        # Elements are counted when they start if neither predicates nor the function look at their content
+        self.needs_content = self.predicate_str is not None or function_name not in counting_functions
+
+    def prepare(self, namespaces, variable_map):
+        """
+        Compile the predicates with the namespaces of the document, and look up the variables they refer to
+        """
+        self.tag = clark_name(self.steps[-1].step, namespaces)
+
+        if self.predicate_str is not None:
+            self.predicate = etree.XPath(self.predicate_str, namespaces=namespaces)
+            self.xpath_variables = {
+                name: xpath_variable_value(variable_value(QName(localname=name), variable_map=variable_map,
+                                                          lxml_etree=None))
+                for name in self.path.variables
+            }
+
+    def matches(self, element, namespaces):
+        """
+        Check if the steps of the path select an element with the tag of the path. The ancestors of an element are
+        known when it starts.
+        """
+        return self.any_ancestors or path_matches(element, self.steps, namespaces)
+
+    def selects(self, element):
+        """
+        Check if the predicates of the path select an element the steps matched, that was read completely
+        """
+        return self.predicate is None or bool(self.predicate(element, **self.xpath_variables))
+
+
+def streaming_problem(path):
+    """
+    Check if the aggregate of a path can be computed while streaming
+
+    :return: Description of why it can not, or None if it can
+    """
+    if path.relative:
+        return f"path '{path.query}' is relative"
+
+    for i, step in enumerate(path.steps):
+        if str(step.axis) not in ("/", "//"):
+            return f"step '{step.axis}{step.step}' is not a child or descendant step"
+        if not isinstance(step.step, QName) and (step.step != "*" or i == len(path.steps) - 1):
+            return f"step '{step.step}' is not a name test"
+        if step.predicatelist and i < len(path.steps) - 1:
+            return f"step '{step.step}' has predicates, only the last step can have predicates"
+
+        for predicate in step.predicatelist:
+            predicate_str = predicate.to_str()
+            if predicate_str is None or predicate.position is not None or \
+                    any(part in predicate_str for part in non_local_predicates):
+                return f"predicate of step '{step.step}' does not only refer to the element itself"
+            for node in walk(predicate.val):
+                if isinstance(node, PathExpression) and not node.relative:
+                    return f"predicate of step '{step.step}' refers to other elements"
+
+    return None
+
+
+def streamed_paths(expression):
+    """
+    Get the paths of an expression of which the aggregates are computed while streaming
+
+    :param expression: Syntax tree
+    :return: Dict of id of path argument to StreamedPath
+    :raises ValueError: If the expression can not be evaluated while streaming
+    """
+    paths = {}
+    stack = [expression]
+    while stack:
+        node = stack.pop()
+
+        if isinstance(node, FunctionCall) and node.qname in streamed_functions and len(node._children) == 1:
+            argument = node._children[0]
+            path = argument
+            while isinstance(path, XPath):
+                path = path.expr
+
+            if isinstance(path, PathExpression):
+                problem = streaming_problem(path)
+                if problem is not None:
+                    raise ValueError(f"Expression can not be evaluated while streaming: {problem}")
+                paths[id(argument)] = StreamedPath(path, node.qname)
+                continue
+
+        if isinstance(node, (PathExpression, ContextItem)):
+            raise ValueError("Expression can not be evaluated while streaming: paths are only supported as the "
+                             f"argument of {', '.join(sorted(streamed_functions))}")
+
+        stack.extend(child_nodes(node))
+
+    return paths
+
+
+def stream_source(source):
+    """
+    Get something iterparse can read from
+
+    :param source: Path of a file (str or os.PathLike), binary file object, mmap.mmap or bytes
+    """
+    if isinstance(source, os.PathLike):
+        return os.fspath(source)
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return io.BytesIO(source)
+    if isinstance(source, mmap.mmap):
+        source.seek(0)
+    return source
+
+
+def evaluate_streaming(parser, source, variable_map=None):
+    """
+    Evaluate an expression in a single pass over a document, without building a tree of the whole document
+
+    :param parser: Parser of the expression
+    :param source: Path of a file (str or os.PathLike), binary file object, mmap.mmap or bytes
+    :param variable_map: Dict of variables. If None, the variables of the Parser are used.
+    :return: Result of XPath expression
+    :raises ValueError: If the expression can not be evaluated while streaming
+    """
+    variable_map = variable_map if variable_map is not None else parser.variable_map
+    paths = streamed_paths(parser.XPath)
+
+    # Elements which a path that needs their content selects, with those paths. Such an element is kept until it has
+    # been read completely, so predicates and atomization see all of its content. All other elements are cleared
+    # when they end, unless they are part of the content of such an element.
+    open_candidates = []
+    paths_by_tag = None
+    namespaces = None
+
+    with EvaluationFrame(atomizer=parser.atomizer, decimal_mode=parser.decimal_mode, variables=variable_map):
+        atomize_item = current_atomizer().atomize_item
+
+        for event, element in etree.iterparse(stream_source(source), events=("start", "end"), huge_tree=True,
+                                              remove_blank_text=True):
+            if paths_by_tag is None:
+                # The first element is the root, which declares the namespaces the paths are resolved with
+                namespaces = element.nsmap
+                paths_by_tag = {}
+                for streamed_path in paths.values():
+                    streamed_path.prepare(namespaces, variable_map)
+                    paths_by_tag.setdefault(streamed_path.tag, []).append(streamed_path)
+
+            if event == "start":
+                content_paths = []
+                for streamed_path in paths_by_tag.get(element.tag, ()):
+                    if not streamed_path.matches(element, namespaces):
+                        continue
+                    if streamed_path.needs_content:
+                        content_paths.append(streamed_path)
+                    else:
+                        streamed_path.aggregate.add_count()
+                if content_paths:
+                    open_candidates.append((element, content_paths))
+                continue
+
+            if open_candidates and open_candidates[-1][0] is element:
+                _, content_paths = open_candidates.pop()
+                for streamed_path in content_paths:
+                    if streamed_path.selects(element):
+                        streamed_path.aggregate.add(atomize_item(element))
+
+            if not open_candidates:
+                # No element that is still open needs this element as its content
+                element.clear()
+                parent = element.getparent()
+                if parent is not None:
+                    while element.getprevious() is not None:
+                        del parent[0]
+
+    aggregates = {key: streamed_path.aggregate for key, streamed_path in paths.items()}
+    return parser.evaluate(variable_map=variable_map, aggregates=aggregates)
@@ -1,72 +1,121 @@
+import asyncio
+import functools
+
 from lxml import etree
 from lxml.etree import Element
 from typing import Union, Optional
-from .grammar.expressions import t_XPath, resolve_expression
-from .conversion.functions.generic import FunctionRegistry, QuerySingleton
+from .grammar.expressions import t_XPath, resolve_expression, pushdown_report
+from .conversion.atomize import Atomizer
+from .conversion.budget import EvaluationBudget, current_budget
+from .conversion.cache import ResultCache, document_fingerprint, fingerprint
+from .conversion.document import Document
+from .conversion.frame import EvaluationFrame
+from .conversion.nodesets import DocumentOrders
+from .conversion.xbrl_index import XbrlIndexes
+from .conversion.primaries import decimal_literals
+from .conversion.ranges import IntegerRange
+from .conversion.functions.generic import FunctionRegistry
+from .grammar.incremental import IncrementalEvaluation
+from .grammar.streaming import evaluate_streaming
 from .grammar.qualified_names import VariableRegistry
 
 
 
+def result_value(value):
+    """
+    Get the outcome of an evaluation as it is returned to the caller. Ranges like 1 to 100 are kept as IntegerRange
+    while the expression is evaluated, so aggregates and positions are computed from their bounds. A range that is
+    the outcome itself is returned as a list, as other sequences are. Its items count towards the budget.
+    """
+    if isinstance(value, IntegerRange):
+        budget = current_budget()
+        if budget is not None:
+            budget.item(len(value))
+        return list(value)
+    return value
+
+
 class Parser:
     def __init__(
         self,
         xpath_expr: str,
         parseAll: bool = True,
         variable_map: Optional[dict] = None,
-        xml:Union[bytes, str, Element, None] = None,
+        xml:Union[Document, bytes, str, Element, None] = None,
         context_item: Union[str, list, None] = None,
         no_resolve=False,
-        custom_functions=None
+        custom_functions=None,
+        type_hints: Optional[dict] = None,
+        decimal_mode: bool = False,
     ):
         """
 
         :param xpath_expr: String of the XPath expression
         :param parseAll: Boolean passed to PyParsing. If set to true, Parsing will fail if any part of the string is not understood.
         :param variable_map: Dict of variables which Parameters can be mapped to.
-        :param xml: Byte string of an XML object to be parsed
+        :param xml: XML document: a Document, or a byte string or string of XML to be parsed. Load documents that are
+            evaluated against by more than one Parser with Document.load, so they are only parsed once.
         :param no_resolve: If set to True, only grammar is parsed but the expression is not resolved. This can be used for debugging.
+        :param type_hints: Dict of element name to XML Schema (or XBRL item) type, used to cast element values.
+            For example: {"ns:Revenue": "xs:decimal"}. Prefixes are resolved using the namespaces of the XML.
+        :param decimal_mode: If set to True, decimal literals and untyped decimal values are Decimals instead of floats,
+            so arithmetic on them (like summing monetary values) is exact.
 
         For example:
         parsed_expr = Parser("(1 + 2) = (2 + 1)")
-        parsed_expr.XPath would contain the resolved tree
+        parsed_expr.XPath would contain the syntax tree
         parsed_expr.resolved_answer == True. This is the answer of the expression
+
+        The syntax tree is not changed by evaluating it. Parser.evaluate() evaluates it again, for example with
+        another document or other variables, also from multiple threads at once.
         """
 
         # First, add the custom functions to the function registry.
         FunctionRegistry(custom_functions=custom_functions)
         VariableRegistry(variables=variable_map)
 
-        if xml is not None:
-            if isinstance(xml, bytes):
-                tree = etree.fromstring(xml)
-            elif isinstance(xml, str):
-                tree = etree.fromstring(bytes(xml, encoding="utf-8"))
+        self.lxml_etree = self.get_tree(xml)
+        # Document of the Parser, of which the ElementIndex is used once it is built
+        self.document = xml if isinstance(xml, Document) else None
+        # Positions of nodes and XBRL contexts and units of the tree of the Parser, if that is not a Document
+        self.document_orders = DocumentOrders()
+        self.xbrl_indexes = XbrlIndexes()
+        # Fingerprint of the document of the Parser, computed when a result cache is first used
+        self._document_key = None
 
-            else:
-                tree = xml
+        self.no_resolve = no_resolve
 
-            QuerySingleton(lxml_tree=tree)
+        self.decimal_mode = decimal_mode
+        self.type_hints = type_hints
 
-            self.lxml_etree = tree
+        if type_hints is not None:
+            namespaces = self.lxml_etree.nsmap if self.lxml_etree is not None else None
+            self.atomizer = Atomizer(type_hints=type_hints, namespaces=namespaces, exact_decimals=decimal_mode)
         else:
-            self.lxml_etree = None
+            self.atomizer = None
 
-        self.no_resolve = no_resolve
+        self.xpath_expr = xpath_expr
 
         if isinstance(xpath_expr, str):
             # Parse the Grammar
 
-            parsed_grammar = t_XPath.parseString(xpath_expr, parseAll=parseAll)
+            # Predicates of path expressions that were (not) pushed into the queries for LXML
+            self.pushdown_report = []
+
+            token = decimal_literals.set(decimal_mode)
+            report_token = pushdown_report.set(self.pushdown_report)
+            try:
+                parsed_grammar = t_XPath.parseString(xpath_expr, parseAll=parseAll)
+            finally:
+                pushdown_report.reset(report_token)
+                decimal_literals.reset(token)
             if len(parsed_grammar) > 1:
                 raise ("Did not expect more than 1 expressions")
             else:
                 self.XPath = parsed_grammar[0]
-                self.XPath.xml_etree = self.lxml_etree
         else:
             print("Expected a string as input for an XPath Expression")
 
-        # Add variable map to self and child expression
-        self.XPath.variable_map = variable_map if variable_map else {}
         self.variable_map = variable_map if variable_map else {}
 
         self.context_item = context_item
@@ -76,12 +125,183 @@ class Parser:
 
         if no_resolve is False:
             # Resolve parameters and path queries the of expression
-            self.resolved_answer = resolve_expression(
+            self.resolved_answer = self.evaluate()
+
+    @staticmethod
+    def get_tree(xml):
+        """
+        Get the LXML etree of an XML document
+
+        :param xml: Document, byte string or string of an XML document, memory map, path of a file as os.PathLike,
+            or an LXML element
+        :return: LXML element, or None if no document is given
+        """
+        if xml is None:
+            return None
+        elif isinstance(xml, etree._Element):
+            return xml
+
+        return Document.load(xml).root
+
+    @property
+    def fingerprint(self) -> str:
+        """
+        Fingerprint of the compiled expression: the expression and the options that change its outcome
+        """
+        type_hints = sorted(self.type_hints.items()) if self.type_hints else ""
+        return fingerprint(self.xpath_expr, self.decimal_mode, type_hints)
+
+    def document_key(self, xml=None) -> str:
+        """
+        Fingerprint of the document an evaluation runs against. The fingerprint of the document of the Parser is
+        only computed once.
+        """
+        if isinstance(xml, Document):
+            return xml.fingerprint
+        if xml is not None:
+            return document_fingerprint(xml)
+
+        if self._document_key is None:
+            self._document_key = document_fingerprint(self.lxml_etree)
+        return self._document_key
+
+    def evaluate(self, xml=None, variable_map: Optional[dict] = None, context_item=None,
+                 max_steps: Optional[int] = None, max_items: Optional[int] = None, deadline=None,
+                 budget: Optional[EvaluationBudget] = None, event_loop=None, cache: Optional[ResultCache] = None,
+                 subtree_values=None, aggregates: Optional[dict] = None, prefetched_paths=None):
+        """
+        Evaluate the expression. All intermediate values are kept in an evaluation frame of this call,
+        so the same Parser can be evaluated any number of times, also by multiple threads at once.
+
+        The work of the evaluation can be limited, for expressions that come from users. If a limit is exceeded,
+        BudgetExceeded is raised. Its 'limit' attribute tells which limit that was.
+
+        :param xml: XML document to evaluate the expression against. If None, the document of the Parser is used.
+            Paths like //ns:X use the ElementIndex of a Document, if Document.build_index() was called. The document
+            order of nodes, which union, intersect and except need, is kept by a Document and by the Parser for its
+            own document. Other trees are numbered again for every evaluation, so pass a Document to evaluate many
+            expressions against the same tree.
+        :param variable_map: Dict of variables. If None, the variables of the Parser are used.
+        :param context_item: Context item of the expression. If None, the context item of the Parser is used.
+        :param max_steps: Maximum number of evaluation steps (nodes, function calls and predicates per item)
+        :param max_items: Maximum number of items going through predicates, for expressions and sequences
+        :param deadline: Number of seconds the evaluation may take, or the datetime.datetime by which it should
+            be finished
+        :param budget: EvaluationBudget to use instead of max_steps, max_items and deadline. Calling its cancel()
+            method from another thread stops the evaluation.
+        :param event_loop: Asyncio event loop that coroutine custom functions are run on. Used by evaluate_async.
+            Without an event loop, every coroutine function call runs on an event loop of its own.
+        :param cache: ResultCache to look the result up in. If the expression was evaluated before against the same
+            document content, variables and context item, the cached result is returned without evaluating.
+        :param subtree_values: SubtreeValues of an incremental evaluation. Used by Parser.incremental().
+        :param aggregates: Dict of id of path argument to RunningAggregate, of aggregate functions whose outcome is
+            kept up to date by a FactStream. Used by FactStream.evaluate().
+        :param prefetched_paths: PrefetchedPaths of the document, of which simple paths take their elements. Used by
+            FormulaSet.evaluate().
+        :return: Result of XPath expression
+        """
+        variable_map = variable_map if variable_map is not None else self.variable_map
+        context_item = context_item if context_item is not None else self.context_item
+
+        if cache is not None:
+            # Variables that are not passed are looked up in the registry, so those are part of the key as well
+            variables = {**VariableRegistry().variables, **variable_map}
+            key = cache.key(self.fingerprint, self.document_key(xml), variables, context_item)
+            result = cache.get(key)
+            if result is ResultCache.MISSING:
+                result = self.evaluate(xml=xml, variable_map=variable_map, context_item=context_item, budget=budget,
+                                       max_steps=max_steps, max_items=max_items, deadline=deadline,
+                                       event_loop=event_loop, prefetched_paths=prefetched_paths)
+                cache.set(key, result)
+            return result
+
+        if budget is None and (max_steps is not None or max_items is not None or deadline is not None):
+            budget = EvaluationBudget(max_steps=max_steps, max_items=max_items, deadline=deadline)
+
+        lxml_etree = self.get_tree(xml) if xml is not None else self.lxml_etree
+        document = xml if xml is not None else self.document
+        element_index = document.index if isinstance(document, Document) else None
+        # Positions of nodes and XBRL contexts and units are kept by a Document, by the Parser for its own tree, or
+        # else by this evaluation
+        if isinstance(document, Document):
+            document_orders, xbrl_indexes = document.document_orders, document.xbrl_indexes
+        elif xml is None:
+            document_orders, xbrl_indexes = self.document_orders, self.xbrl_indexes
+        else:
+            document_orders, xbrl_indexes = DocumentOrders(), XbrlIndexes()
+
+        with EvaluationFrame(atomizer=self.atomizer, decimal_mode=self.decimal_mode, variables=variable_map,
+                             document=lxml_etree, context_item=context_item, budget=budget,
+                             event_loop=event_loop, subtree_values=subtree_values, aggregates=aggregates,
+                             element_index=element_index, prefetched_paths=prefetched_paths,
+                             document_orders=document_orders, xbrl_indexes=xbrl_indexes):
+            return result_value(resolve_expression(
                 expression=self.XPath,
-                variable_map=self.variable_map,
-                lxml_etree=self.lxml_etree,
-            )
+                variable_map=variable_map,
+                lxml_etree=lxml_etree,
+                context_item_value=context_item,
+            ))
+
+    async def evaluate_async(self, xml=None, variable_map: Optional[dict] = None, context_item=None, executor=None,
+                             cache: Optional[ResultCache] = None, **limits):
+        """
+        Evaluate the expression without blocking the event loop. The evaluation runs in an executor, and
+        custom functions which are coroutine functions are run on the event loop of the caller. Calls of
+        coroutine functions which are operands of the same operator (like both sides of a comparison), items of the
+        same sequence or arguments of the same function run concurrently.
+
+        If the awaiting task is cancelled, the evaluation is cancelled as well.
 
+        :param xml: XML document to evaluate the expression against. If None, the document of the Parser is used.
+        :param variable_map: Dict of variables. If None, the variables of the Parser are used.
+        :param context_item: Context item of the expression. If None, the context item of the Parser is used.
+        :param executor: concurrent.futures.Executor to evaluate in. If None, the default executor of the loop is used.
+        :param cache: ResultCache to look the result up in, as for evaluate()
+        :param limits: max_steps, max_items, deadline or budget, as for evaluate()
+        :return: Result of XPath expression
+        """
+        loop = asyncio.get_running_loop()
+
+        budget = limits.pop("budget", None)
+        if budget is None:
+            budget = EvaluationBudget(**limits)
+
+        evaluation = functools.partial(self.evaluate, xml=xml, variable_map=variable_map, context_item=context_item,
+                                       budget=budget, event_loop=loop, cache=cache)
+        try:
+            return await loop.run_in_executor(executor, evaluation)
+        except asyncio.CancelledError:
+            budget.cancel()
+            raise
+
+    def evaluate_streaming(self, source, variable_map: Optional[dict] = None):
+        """
+        Evaluate the expression in a single pass over a document that is too large to build a tree of. Only
+        expressions of which every path is the argument of fn:count, fn:sum, fn:avg, fn:min, fn:max, fn:exists or
+        fn:empty can be evaluated this way, like "count(//ns:Revenue[@contextRef = 'c1']) > 0".
+
+        :param source: Path of a file (str or os.PathLike), binary file object, mmap.mmap or bytes
+        :param variable_map: Dict of variables. If None, the variables of the Parser are used.
+        :return: Result of XPath expression
+        :raises ValueError: If the expression can not be evaluated while streaming
+        """
+        return evaluate_streaming(self, source, variable_map=variable_map)
+
+    def incremental(self, xml=None, context_item=None) -> IncrementalEvaluation:
+        """
+        Prepare to evaluate the expression repeatedly with changing variables, like in an editor of formulas.
+        Each evaluation only evaluates the parts of the expression that refer to variables that changed.
+
+        For example:
+        evaluation = Parser("sum(//Revenue) * $rate", no_resolve=True).incremental(xml=xml)
+        evaluation.evaluate({"rate": 1.1})
+        evaluation.evaluate({"rate": 1.2})  # sum(//Revenue) is not evaluated again
+
+        :param xml: XML document to evaluate the expression against. If None, the document of the Parser is used.
+        :param context_item: Context item of the expression. If None, the context item of the Parser is used.
+        :return: IncrementalEvaluation
+        """
+        return IncrementalEvaluation(self, xml=xml, context_item=context_item)
 
     def run(self):
         """
@@ -90,14 +310,7 @@ class Parser:
         :return: Result of XPath expression
         """
         if self.no_resolve is True:
+            return self.evaluate()
 
-            answer = resolve_expression(
-                expression=self.XPath,
-                variable_map=self.variable_map,
-                lxml_etree=self.lxml_etree,
-            )
-        else:
-            # Otherwise return the answer that is resolved beforehand
-            return self.resolved_answer
-
-        return answer
+        # Otherwise return the answer that is resolved beforehand
+        return self.resolved_answer
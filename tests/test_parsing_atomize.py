@@ -0,0 +1,69 @@
+import unittest
+from datetime import date
+from decimal import Decimal
+
+from lxml import etree
+
+from src.xpyth_parser.conversion.atomize import Atomizer, INTEGER, DOUBLE, STRING
+from src.xpyth_parser.parse import Parser
+
+
+class AtomizationTests(unittest.TestCase):
+    """
+    Casting element values to typed values
+    """
+
+    def create_elements(self, *values, tag="fact"):
+        facts = "".join(f"<{tag}>{value}</{tag}>" for value in values)
+        return etree.fromstring(bytes(f"<root>{facts}</root>", encoding="utf-8")).xpath(f"//{tag}")
+
+    def test_classification(self):
+        atomizer = Atomizer()
+        values = atomizer.atomize(self.create_elements("12", " -7 ", "1.5", ".5", "1e3", "INF", "2021-12-31", "abc"))
+
+        self.assertEqual(values[:2], [12, -7])
+        self.assertTrue(all(isinstance(value, int) for value in values[:2]))
+        self.assertEqual(values[2:6], [1.5, 0.5, 1000.0, float("inf")])
+        self.assertTrue(all(isinstance(value, float) for value in values[2:6]))
+        self.assertEqual(values[6], date(2021, 12, 31))
+        self.assertEqual(values[7], "abc")
+
+        # Values that are not elements are kept as they are
+        self.assertEqual(atomizer.atomize([1, "a"]), [1, "a"])
+
+    def test_derived_types(self):
+        atomizer = Atomizer()
+        atomizer.atomize(self.create_elements("1", "2", tag="integers"))
+        self.assertEqual(atomizer.derived_types["integers"], INTEGER)
+
+        # The derived type is widened when a value does not fit
+        self.assertEqual(atomizer.atomize(self.create_elements("1", "2.5", "3", tag="numbers")), [1, 2.5, 3.0])
+        self.assertEqual(atomizer.derived_types["numbers"], DOUBLE)
+
+        atomizer.atomize(self.create_elements("a", tag="strings"))
+        self.assertEqual(atomizer.derived_types["strings"], STRING)
+
+    def test_type_hints(self):
+        atomizer = Atomizer(
+            type_hints={"ns:amount": "xbrli:monetaryItemType", "{http://example.com}count": "xs:integer"},
+            namespaces={"ns": "http://example.com"},
+        )
+        root = etree.fromstring(
+            b'<root xmlns:ns="http://example.com"><ns:amount>1000</ns:amount><ns:amount>0.10</ns:amount>'
+            b'<ns:count>3</ns:count></root>'
+        )
+        self.assertEqual(atomizer.atomize(root), [Decimal("1000"), Decimal("0.10"), 3])
+        self.assertTrue(isinstance(atomizer.atomize_element(root[0]), Decimal))
+
+        self.assertRaises(ValueError, Atomizer, type_hints={"unknown:amount": "xs:decimal"})
+        self.assertRaises(ValueError, Atomizer, type_hints={"amount": "xs:unknownType"})
+
+    def test_typed_aggregates(self):
+        xml = b'<root xmlns:ns="http://example.com"><ns:amount>0.1</ns:amount><ns:amount>0.2</ns:amount></root>'
+
+        # Values that look like decimals are no longer cast to strings
+        self.assertAlmostEqual(Parser("sum(//ns:amount)", xml=xml).run(), 0.3)
+
+        # With a type hint, the values are exact decimals
+        self.assertEqual(Parser("sum(//ns:amount)", xml=xml, type_hints={"ns:amount": "xs:decimal"}).run(),
+                         Decimal("0.3"))
@@ -0,0 +1,53 @@
+import datetime
+import threading
+import unittest
+
+from src.xpyth_parser.conversion.budget import BudgetExceeded, EvaluationBudget
+from src.xpyth_parser.parse import Parser
+
+
+class BudgetTests(unittest.TestCase):
+    """
+    Limits on the work of an evaluation
+    """
+
+    def assert_exceeds(self, expression, limit, xml=None, **kwargs):
+        parser = Parser(expression, xml=xml, no_resolve=True)
+        with self.assertRaises(BudgetExceeded) as context:
+            parser.evaluate(**kwargs)
+
+        self.assertEqual(context.exception.limit, limit)
+        return context.exception
+
+    def test_max_items(self):
+        exceeded = self.assert_exceeds("(1 to 100000000)[. mod 7 = 0]", "max_items", max_items=1000)
+        self.assertEqual(exceeded.maximum, 1000)
+        self.assertEqual(exceeded.used, 1001)
+
+        self.assert_exceeds("sum(for $i in 1 to 100000000 return $i)", "max_items", max_items=1000)
+        self.assert_exceeds("(1 to 100000000, 5)", "max_items", max_items=1000)
+
+        xml = "<root>" + "<a><b/><b/></a>" * 100 + "</root>"
+        self.assert_exceeds("count(//a[count(//b[count(//a) > 0]) > 0])", "max_items", xml=xml, max_items=5000)
+
+        # Aggregates of ranges do not go through the items
+        self.assertEqual(Parser("count(1 to 100000000)", no_resolve=True).evaluate(max_items=10), 100000000)
+
+    def test_max_steps(self):
+        self.assert_exceeds("(1 to 100000000)[. mod 7 = 0]", "max_steps", max_steps=1000)
+        self.assertEqual(Parser("(1, 2, 3)[. > 1]", no_resolve=True).evaluate(max_steps=1000), [2, 3])
+
+    def test_deadline(self):
+        self.assert_exceeds("count((1 to 100000000)[. mod 7 = 0])", "deadline", deadline=0.1)
+
+        deadline = datetime.datetime.now() + datetime.timedelta(milliseconds=100)
+        self.assert_exceeds("count((1 to 100000000)[. mod 7 = 0])", "deadline", deadline=deadline)
+
+    def test_cancel(self):
+        budget = EvaluationBudget()
+        timer = threading.Timer(0.1, budget.cancel)
+        timer.start()
+        try:
+            self.assert_exceeds("sum(for $i in 1 to 100000000 return $i)", "cancelled", budget=budget)
+        finally:
+            timer.cancel()
@@ -0,0 +1,148 @@
+import os
+import tempfile
+import unittest
+from decimal import Decimal
+
+from src.xpyth_parser.conversion.cache import DiskResultCache, MemoryResultCache, ResultCache, variables_fingerprint
+from src.xpyth_parser.conversion.functions.generic import FunctionRegistry
+from src.xpyth_parser.grammar.qualified_names import VariableRegistry
+from src.xpyth_parser.parse import Parser
+
+
+class ResultCacheTests(unittest.TestCase):
+    """
+    Results of evaluations are cached by expression, document content and variables
+    """
+
+    xml = b"<root><a>1</a><a>2</a><a>3</a></root>"
+
+    def setUp(self):
+        self.calls = []
+
+        def counted(*args, **kwargs):
+            self.calls.append(args)
+            return args[0]
+
+        FunctionRegistry(custom_functions={"test:cache-counted": counted}, overwrite_functions=True)
+        self.parser = Parser("test:cache-counted(sum(//a)) + $offset", no_resolve=True)
+
+    def assert_cached(self, cache):
+        self.assertEqual(self.parser.evaluate(xml=self.xml, variable_map={"offset": 1}, cache=cache), 7)
+        self.assertEqual(len(self.calls), 1)
+
+        # The same document content and variables
+        self.assertEqual(self.parser.evaluate(xml=self.xml.decode("utf-8"), variable_map={"offset": 1}, cache=cache), 7)
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(cache.stats.hits, 1)
+
+        # Another document or other variables are evaluated
+        self.assertEqual(self.parser.evaluate(xml=self.xml, variable_map={"offset": 2}, cache=cache), 8)
+        self.assertEqual(self.parser.evaluate(xml=b"<root><a>5</a></root>", variable_map={"offset": 2}, cache=cache), 7)
+        self.assertEqual(len(self.calls), 3)
+
+        # As is another expression
+        other = Parser("test:cache-counted(sum(//a)) - $offset", no_resolve=True)
+        self.assertEqual(other.evaluate(xml=self.xml, variable_map={"offset": 1}, cache=cache), 5)
+        self.assertEqual(len(self.calls), 4)
+
+        self.assertEqual(cache.stats.misses, 4)
+        self.assertEqual(cache.stats.stores, 4)
+
+    def test_memory_cache(self):
+        self.assert_cached(MemoryResultCache())
+
+    def test_disk_cache(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "results.sqlite")
+            cache = DiskResultCache(path)
+            try:
+                self.assert_cached(cache)
+            finally:
+                cache.close()
+
+            # Results are kept between runs
+            cache = DiskResultCache(path)
+            try:
+                self.assertEqual(self.parser.evaluate(xml=self.xml, variable_map={"offset": 1}, cache=cache), 7)
+                self.assertEqual(len(self.calls), 4)
+                self.assertEqual(len(cache), 4)
+            finally:
+                cache.close()
+
+    def test_eviction(self):
+        cache = MemoryResultCache(maxsize=2)
+        for offset in range(3):
+            self.parser.evaluate(xml=self.xml, variable_map={"offset": offset}, cache=cache)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.stats.evictions, 1)
+
+        # The least recently used result was evicted
+        self.parser.evaluate(xml=self.xml, variable_map={"offset": 0}, cache=cache)
+        self.assertEqual(len(self.calls), 4)
+
+        with tempfile.TemporaryDirectory() as directory:
+            cache = DiskResultCache(os.path.join(directory, "results.sqlite"), max_bytes=20)
+            try:
+                for offset in range(10):
+                    self.parser.evaluate(xml=self.xml, variable_map={"offset": offset}, cache=cache)
+                self.assertLessEqual(cache.size, 20)
+                self.assertGreater(cache.stats.evictions, 0)
+                self.assertEqual(len(cache) + cache.stats.evictions, 10)
+            finally:
+                cache.close()
+
+    def test_uncacheable(self):
+        cache = MemoryResultCache()
+        parser = Parser("//a", no_resolve=True)
+        self.assertEqual(len(parser.evaluate(xml=self.xml, cache=cache)), 3)
+        self.assertEqual(len(parser.evaluate(xml=self.xml, cache=cache)), 3)
+        self.assertEqual(cache.stats.uncacheable, 2)
+        self.assertEqual(len(cache), 0)
+
+        # Cached lists are not shared with callers
+        parser = Parser("(1, 2)", no_resolve=True)
+        parser.evaluate(cache=cache).append(3)
+        self.assertEqual(parser.evaluate(cache=cache), [1, 2])
+
+    def test_attribute_values(self):
+        # Attribute values are cached as plain strings, which do not keep the tree alive
+        xml = b"<root><a id='x'/><a id='y'/></root>"
+        parser = Parser("//a/@id", no_resolve=True)
+
+        with tempfile.TemporaryDirectory() as directory:
+            disk_cache = DiskResultCache(os.path.join(directory, "results.sqlite"))
+            try:
+                for cache in [MemoryResultCache(), disk_cache]:
+                    with self.subTest(cache=cache):
+                        parser.evaluate(xml=xml, cache=cache)
+                        self.assertEqual(cache.stats.stores, 1)
+
+                        values = parser.evaluate(xml=xml, cache=cache)
+                        self.assertEqual(values, ["x", "y"])
+                        self.assertEqual([type(value) for value in values], [str, str])
+            finally:
+                disk_cache.close()
+
+    def test_registry_variables(self):
+        # Variables that are not passed come from the registry, and are part of the key
+        variables = VariableRegistry().variables
+        variables["cache_registry_offset"] = 1
+        try:
+            cache = MemoryResultCache()
+            parser = Parser("test:cache-counted(sum(//a)) + $cache_registry_offset", no_resolve=True)
+            self.assertEqual(parser.evaluate(xml=self.xml, cache=cache), 7)
+
+            variables["cache_registry_offset"] = 2
+            self.assertEqual(parser.evaluate(xml=self.xml, cache=cache), 8)
+            self.assertEqual(len(self.calls), 2)
+        finally:
+            del variables["cache_registry_offset"]
+
+    def test_variables_fingerprint(self):
+        self.assertEqual(variables_fingerprint({"a": 1, "b": [1, 2]}), variables_fingerprint({"b": [1, 2], "a": 1}))
+        self.assertEqual(variables_fingerprint({"a": Decimal("1.0")}), variables_fingerprint({"a": Decimal("1.00")}))
+        self.assertNotEqual(variables_fingerprint({"a": 1}), variables_fingerprint({"a": "1"}))
+        self.assertNotEqual(variables_fingerprint({"a": 1}), variables_fingerprint({"a": 1.0}))
+
+        self.assertNotEqual(ResultCache.key("expression", "document", {"a": 1}),
+                            ResultCache.key("expression", "document", {"a": 1}, context_item=1))
@@ -1,6 +1,6 @@
 import unittest
 
-from src.xpyth_parser.grammar.expressions import Compare
+from src.xpyth_parser.grammar.expressions import Compare, AndComparison, OrComparison
 from src.xpyth_parser.parse import Parser
 
 
@@ -27,3 +27,65 @@ class ComparisonTests(unittest.TestCase):
         self.assertTrue(Parser(f"2 = (1 + 1)").run())  # General comparison
         self.assertTrue(Parser(f"2 eq (1 + 1)").run())  # Value comparison
         self.assertTrue(Parser(f"(1 + 2) = (2 + 1)").run())
+
+    def test_existential_general_comparisons(self):
+        """
+        General comparisons are true if any pair of items satisfies the comparison
+        """
+        self.assertTrue(Parser("(1, 2, 3) = 3").run())
+        self.assertFalse(Parser("(1, 2, 3) = (4, 5)").run())
+        self.assertTrue(Parser("(1, 2, 3) < (0, 2)").run())
+        self.assertFalse(Parser("(5, 6) <= (1, 4)").run())
+        self.assertTrue(Parser("(5, 6) >= 6").run())
+
+    def test_general_comparisons_compare_values(self):
+        """
+        General comparisons compare the values of items, not whether they are the same object
+        """
+        self.assertTrue(Parser("1.5 = 1.5").run())
+        self.assertTrue(Parser("1000000 = 1000000").run())
+        self.assertFalse(Parser("1000000 != 1000000").run())
+        self.assertTrue(Parser('"abc" = "abc"').run())
+        self.assertFalse(Parser('"abc" != "abc"').run())
+        self.assertTrue(Parser("(1000, 2000) = 2000").run())
+        self.assertTrue(Parser("1000000 = (1 to 2000000)").run())
+        self.assertTrue(Parser("0.1 + 0.2 = 0.3", decimal_mode=True).run())
+        self.assertEqual(Parser("0.1 + 0.2 = 0.3", decimal_mode=True).run(),
+                         Parser("0.1 + 0.2 eq 0.3", decimal_mode=True).run())
+
+        xml = "<root><fact>1000</fact><fact>2000</fact></root>"
+        self.assertEqual(Parser("for $f in //fact return $f = 1000", xml=xml).run(), [True, False])
+        # The same as the comparison LXML evaluates in a predicate
+        self.assertEqual(Parser("count(//fact[. = 1000])", xml=xml).run(), 1)
+
+
+class LogicalExpressionTests(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+
+        def expensive_check(*args, **kwargs):
+            self.calls.append(args)
+            return True
+
+        self.custom_functions = {"test:expensive-check": expensive_check}
+
+    def test_n_ary_logical_expressions(self):
+        self.assertTrue(isinstance(Parser("1 = 1 and 2 = 2 and 3 = 3", no_resolve=True).XPath.expr, AndComparison))
+        self.assertEqual(len(Parser("1 = 1 and 2 = 2 and 3 = 3", no_resolve=True).XPath.expr.values), 3)
+        self.assertTrue(isinstance(Parser("1 = 2 or 2 = 3 or 3 = 3", no_resolve=True).XPath.expr, OrComparison))
+
+        self.assertTrue(Parser("1 = 1 and 2 = 2 and 3 = 3").run())
+        self.assertFalse(Parser("1 = 1 and 2 = 2 and 3 = 4").run())
+        self.assertTrue(Parser("1 = 2 or 2 = 3 or 3 = 3").run())
+        self.assertFalse(Parser("1 = 2 or 2 = 3 or 3 = 4").run())
+
+    def test_short_circuit(self):
+        # Guard style assertion: the expensive check should not be evaluated
+        self.assertTrue(Parser("empty(//missing) or test:expensive-check(1)",
+                               custom_functions=self.custom_functions).run())
+        self.assertFalse(Parser("1 = 2 and test:expensive-check(1)", custom_functions=self.custom_functions).run())
+        self.assertEqual(self.calls, [])
+
+        # If the first operand does not decide the outcome, the next operand is evaluated
+        self.assertTrue(Parser("1 = 2 or test:expensive-check(1)", custom_functions=self.custom_functions).run())
+        self.assertEqual(len(self.calls), 1)
@@ -0,0 +1,78 @@
+import unittest
+from decimal import Decimal
+
+from src.xpyth_parser.conversion import vectorized
+from src.xpyth_parser.parse import Parser
+
+
+class DecimalModeTests(unittest.TestCase):
+    """
+    Exact xs:decimal arithmetic
+    """
+
+    def create_xml(self, values, tag="Revenue"):
+        facts = "".join(f"<{tag}>{value}</{tag}>" for value in values)
+        return f"<xbrl>{facts}</xbrl>"
+
+    def test_decimal_literals(self):
+        self.assertEqual(Parser("0.1 + 0.2", decimal_mode=True).run(), Decimal("0.3"))
+        self.assertEqual(Parser("0.1 + 0.2").run(), 0.1 + 0.2)
+
+        # Dividing integers gives a decimal, doubles are not promoted to decimal
+        self.assertEqual(Parser("1 div 4", decimal_mode=True).run(), Decimal("0.25"))
+        self.assertEqual(Parser("1.5 * 2e0", decimal_mode=True).run(), 3.0)
+        self.assertIsInstance(Parser("1.5 * 2e0", decimal_mode=True).run(), float)
+
+    def test_sum_of_facts(self):
+        values = [f"{i}.{i % 100:02d}" for i in range(5000)]
+        expected = sum(Decimal(value) for value in values)
+
+        numpy_module = vectorized.numpy
+        for module in [numpy_module, None]:
+            vectorized.numpy = module
+            try:
+                total = Parser("sum(//Revenue)", xml=self.create_xml(values), decimal_mode=True).run()
+                average = Parser("avg(//Revenue)", xml=self.create_xml(values), decimal_mode=True).run()
+            finally:
+                vectorized.numpy = numpy_module
+
+            self.assertIsInstance(total, Decimal)
+            self.assertEqual(total, expected)
+            self.assertEqual(average, expected / len(values))
+
+    def test_avg_of_empty_sequence(self):
+        for expression in ["avg(//Revenue)", "avg(())"]:
+            with self.subTest(expression=expression):
+                self.assertEqual(Parser(expression, xml=self.create_xml([], tag="Cost"), decimal_mode=True).run(), [])
+
+    def test_sum_with_mixed_scales(self):
+        values = ["0.1"] * 2000 + ["0.25", "3"]
+        total = Parser("sum(//Revenue)", xml=self.create_xml(values), decimal_mode=True).run()
+
+        self.assertEqual(total, Decimal("203.25"))
+
+    def test_sum_of_integers(self):
+        values = [str(i) for i in range(2000)]
+        total = Parser("sum(//Revenue)", xml=self.create_xml(values), decimal_mode=True).run()
+
+        self.assertEqual(total, sum(range(2000)))
+        self.assertIsInstance(total, int)
+
+    def test_sum_is_not_rounded(self):
+        # More significant digits than the precision of the default decimal context
+        values = ["12345678901234567890.01"] * 3
+        total = Parser("sum(//Revenue)", xml=self.create_xml(values), decimal_mode=True).run()
+
+        self.assertEqual(total, Decimal("37037036703703703670.03"))
+
+    def test_typed_double_facts(self):
+        values = ["1.5"] * 2000
+        total = Parser(
+            "sum(//Revenue)",
+            xml=self.create_xml(values),
+            type_hints={"Revenue": "xs:double"},
+            decimal_mode=True,
+        ).run()
+
+        self.assertIsInstance(total, float)
+        self.assertEqual(total, 3000.0)
@@ -0,0 +1,81 @@
+import mmap
+import os
+import pathlib
+import tempfile
+import threading
+import unittest
+
+from lxml import etree
+
+from src.xpyth_parser.conversion.cache import MemoryResultCache
+from src.xpyth_parser.conversion.document import Document, xml_parser
+from src.xpyth_parser.parse import Parser
+
+
+class DocumentTests(unittest.TestCase):
+    """
+    Documents are loaded once, from any kind of source, and evaluated against any number of times
+    """
+
+    xml = b"<?xml version='1.0' encoding='utf-8'?>\n<root>\n  <a>1</a>\n  <a>2</a>\n</root>"
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "instance.xml")
+        with open(self.path, "wb") as file:
+            file.write(self.xml)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_load(self):
+        with open(self.path, "rb") as file:
+            memory_map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                sources = [
+                    pathlib.Path(self.path),
+                    memory_map,
+                    self.xml,
+                    bytearray(self.xml),
+                    self.xml.decode("utf-8"),
+                    self.xml.decode("utf-8").split("\n", 1)[1],
+                    etree.fromstring(self.xml),
+                    etree.ElementTree(etree.fromstring(self.xml)),
+                ]
+                for source in sources:
+                    document = Document.load(source)
+                    self.assertEqual(document.root.tag, "root")
+                    self.assertEqual(Parser("sum(//a)", xml=document).run(), 3)
+            finally:
+                memory_map.close()
+
+        document = Document.load(pathlib.Path(self.path))
+        self.assertIs(Document.load(document), document)
+        self.assertEqual(document.path, self.path)
+
+        # Whitespace between elements is not kept
+        self.assertIsNone(document.root.text)
+
+        with self.assertRaises(TypeError):
+            Document.load(42)
+
+    def test_reuse(self):
+        document = Document.load(pathlib.Path(self.path))
+        parsers = [Parser("count(//a)", no_resolve=True), Parser("sum(//a)", no_resolve=True)]
+        self.assertEqual([parser.evaluate(xml=document) for parser in parsers], [2, 3])
+        self.assertIs(Parser.get_tree(document), document.root)
+
+        # Cached results are found by the content of the file
+        cache = MemoryResultCache()
+        parsers[1].evaluate(xml=document, cache=cache)
+        self.assertEqual(parsers[1].evaluate(xml=pathlib.Path(self.path), cache=cache), 3)
+        self.assertEqual(cache.stats.hits, 1)
+
+    def test_parser_per_thread(self):
+        self.assertIs(xml_parser(), xml_parser())
+
+        parsers = []
+        thread = threading.Thread(target=lambda: parsers.append(xml_parser()))
+        thread.start()
+        thread.join()
+        self.assertIsNot(parsers[0], xml_parser())
@@ -1,7 +1,12 @@
 import functools
+import operator
 import os
 import unittest
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
 
+from src.xpyth_parser.conversion.budget import BudgetExceeded
+from src.xpyth_parser.conversion.functions.generic import FunctionRegistry
 from src.xpyth_parser.conversion.qname import QName
 from src.xpyth_parser.grammar.expressions import (
     t_PrimaryExpr,
@@ -12,6 +17,11 @@ from src.xpyth_parser.grammar.expressions import (
     ContextItem,
     UnaryOperator,
     BinaryOperator,
+    CompareValue,
+    AndComparison,
+    OrComparison,
+    IfExpression,
+    resolve_expression,
 )
 from src.xpyth_parser.parse import Parser
 
@@ -157,20 +167,21 @@ class ExpressionTests(unittest.TestCase):
         # Evaluate the expression
         self.assertTrue(xpath_count.run())
 
-        xpath_avg_false = Parser(
+        # General and value comparisons both compare the values
+        xpath_avg_general = Parser(
             "avg($var_to_list) = $var_to_value_avg",
             variable_map=variable_map,
             no_resolve=True,
         )
 
-        xpath_avg_true = Parser(
+        xpath_avg_value = Parser(
             "avg($var_to_list) eq $var_to_value_avg",
             variable_map=variable_map,
             no_resolve=True,
         )
 
-        self.assertFalse(xpath_avg_false.run())
-        self.assertTrue(xpath_avg_true.run())
+        self.assertTrue(xpath_avg_general.run())
+        self.assertTrue(xpath_avg_value.run())
 
     def test_if_expressions(self):
         direct_xpath = t_XPath.parseString("if(1 = 1) then a else b", parseAll=True)[0]
@@ -178,7 +189,7 @@ class ExpressionTests(unittest.TestCase):
         self.assertEqual(direct_xpath.expr.test_expr.expr.left, 1)
         self.assertEqual(direct_xpath.expr.test_expr.expr.comparators[0], 1)
         self.assertTrue(
-            str(direct_xpath.expr.test_expr.expr.op) == "<built-in function is_>"
+            str(direct_xpath.expr.test_expr.expr.op) == "<built-in function eq>"
         )
         self.assertEqual(direct_xpath.expr.then_expr, QName(localname="a"))
         self.assertEqual(direct_xpath.expr.else_expr, QName(localname="b"))
@@ -262,12 +273,210 @@ class ExpressionTests(unittest.TestCase):
         )
 
     def test_range_expression(self):
-        self.assertEqual(Parser("1 to 100").resolved_answer, range(1, 100))
-        self.assertEqual(Parser("(1 to 100)").resolved_answer, range(1, 100))
+        # Both bounds are included
+        self.assertEqual(Parser("1 to 100").resolved_answer, list(range(1, 101)))
+        self.assertEqual(Parser("(1 to 100)").resolved_answer, list(range(1, 101)))
+
+        # A range that is the outcome is returned as a list
+        self.assertIs(type(Parser("1 to 3").resolved_answer), list)
+        self.assertIs(type(Parser("(5 to 1)").resolved_answer), list)
+        with self.assertRaises(BudgetExceeded):
+            Parser("1 to 100000000000", no_resolve=True).evaluate(max_items=1000)
+        self.assertEqual(Parser("count(5 to 1)").resolved_answer, 0)
+        self.assertEqual(Parser("let $n := 4 return sum(1 to $n)").resolved_answer, 10)
+
+        # Aggregates, positions and membership are computed from the bounds, without going through the items
+        self.assertEqual(Parser("count(1 to 100000000000)").resolved_answer, 100000000000)
+        self.assertEqual(Parser("sum(1 to 100000000000)").resolved_answer, 5000000000050000000000)
+        self.assertEqual(Parser("avg(1 to 10)").resolved_answer, 5.5)
+        self.assertEqual(Parser("min(3 to 100000000000)").resolved_answer, 3)
+        self.assertEqual(Parser("max(3 to 100000000000)").resolved_answer, 100000000000)
+        self.assertEqual(Parser("(1 to 100000000000)[last()]").resolved_answer, [100000000000])
+        self.assertEqual(Parser("count((1 to 100000000000)[position() > 5])").resolved_answer, 99999999995)
+        self.assertEqual(Parser("99999999999 = (1 to 100000000000)").resolved_answer, True)
+        self.assertEqual(Parser("5.5 = (1 to 10)").resolved_answer, False)
 
     def test_predicate(self):
 
         self.assertEqual(
             Parser("(1 to 100)[. mod 5 eq 0]").resolved_answer,
-            [5, 10, 15, 20, 25, 30, 35, 40, 45, 50, 55, 60, 65, 70, 75, 80, 85, 90, 95],
+            [5, 10, 15, 20, 25, 30, 35, 40, 45, 50, 55, 60, 65, 70, 75, 80, 85, 90, 95, 100],
         )
+
+    def test_positional_predicate(self):
+        self.assertEqual(Parser("(4, 5, 6)[2]").resolved_answer, [5])
+        self.assertEqual(Parser("(4, 5, 6)[last()]").resolved_answer, [6])
+        self.assertEqual(Parser("(4, 5, 6)[last() - 1]").resolved_answer, [5])
+        self.assertEqual(Parser("(4, 5, 6)[position() < 3]").resolved_answer, [4, 5])
+        self.assertEqual(Parser("(4, 5, 6)[position() = 3]").resolved_answer, [6])
+        self.assertEqual(Parser("(4, 5, 6)[4]").resolved_answer, [])
+        self.assertEqual(Parser("(4, 5, 6)[0]").resolved_answer, [])
+
+        # Predicates are applied one after another
+        self.assertEqual(Parser("(4, 5, 6)[. > 4][1]").resolved_answer, [5])
+
+        # Position and size are available in predicates that are not positional
+        self.assertEqual(Parser("(4, 5, 6)[position() > 1 and . < 6]").resolved_answer, [5])
+        self.assertEqual(Parser("(4, 5, 6)[. - 3 eq last()]").resolved_answer, [6])
+
+        # Ranges are indexed without being expanded
+        self.assertEqual(Parser("(1 to 100000000)[5]").resolved_answer, [5])
+
+    def test_reevaluate(self):
+        """
+        Evaluating an expression does not change its syntax tree, so it can be evaluated again with other variables
+        and other documents, also from multiple threads at once.
+        """
+        parser = Parser("sum(//fact) + $offset = count(//fact) * $factor", no_resolve=True,
+                        variable_map={"offset": 0, "factor": 1})
+        compare = parser.XPath.expr
+        left, comparators = compare.left, list(compare.comparators)
+
+        def evaluate(i):
+            facts = "<fact>2</fact>" * (i % 10)
+            return parser.evaluate(xml=f"<root>{facts}</root>", variable_map={"offset": i % 3, "factor": 2 + i % 3})
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            outcomes = list(executor.map(evaluate, range(1000)))
+
+        # Every evaluation got its own answer, while the parsed tree stayed the same
+        self.assertEqual(outcomes, [i % 3 == 0 or i % 10 == 1 for i in range(1000)])
+        self.assertIs(compare.left, left)
+        self.assertEqual(compare.comparators, comparators)
+
+        # Variables that refer to another variable are looked up per evaluation as well
+        parser = Parser("$a * 2", variable_map={"a": "$b + 1", "b": 1})
+        self.assertEqual(parser.run(), 4)
+        self.assertEqual(parser.evaluate(variable_map={"a": "$b + 1", "b": 5}), 12)
+
+    def test_for_expression(self):
+        self.assertEqual(Parser("for $x in (1, 2, 3) return $x * 2").run(), [2, 4, 6])
+        self.assertEqual(Parser("for $x in (1, 2), $y in (10, 20) return $x + $y").run(), [11, 21, 12, 22])
+        self.assertEqual(Parser("for $x in (1, 2, 3) return ($x, $x)").run(), [1, 1, 2, 2, 3, 3])
+
+        # Function calls in the return expression are evaluated for every item
+        self.assertEqual(Parser("for $x in (1, 2, 3) return count(($x, 5, $x)[. eq $x])").run(), [2, 2, 2])
+
+        # Aggregates consume the items while they are produced
+        self.assertEqual(Parser("sum(for $x in (1, 2, 3) return $x * 2)").run(), 12)
+        self.assertEqual(Parser("avg(for $x in (1, 2, 3) return $x)").run(), 2)
+        self.assertEqual(Parser("max(for $x in (1, 2, 3) return -$x)").run(), -1)
+        self.assertEqual(Parser("count((for $x in (1, 2, 3, 4) return $x * 2)[. > 4])").run(), 2)
+
+        # Aggregates of an empty stream are the empty sequence, like those of an empty range
+        self.assertEqual(Parser("avg(for $x in () return $x)").run(), [])
+        self.assertEqual(Parser("max(for $x in () return $x)").run(), [])
+        self.assertEqual(Parser("min((for $x in (1, 2) return $x)[. > 5])").run(), [])
+        self.assertEqual(Parser("sum(for $x in () return $x)").run(), 0)
+
+        # Predicates on the items stop the evaluation when they have what they need
+        self.assertEqual(Parser("(for $x in 1 to 100000000 return $x * 2)[position() < 4]").run(), [2, 4, 6])
+
+        xml = "<root><fact c='a'>1</fact><fact c='b'>5</fact><fact c='a'>2</fact></root>"
+        self.assertEqual(Parser("sum(for $fact in //fact return $fact * 10)", xml=xml).run(), 80)
+        self.assertEqual(Parser("for $c in ('a', 'b') return sum(//fact[@c = $c])", xml=xml).run(), [3, 5])
+
+    def test_let_expression(self):
+        self.assertEqual(Parser("let $x := 2, $y := $x * 3 return $x + $y").run(), 8)
+
+        # Bound values are not parsed as XPath, unlike string values of variables that are passed to the Parser
+        self.assertEqual(Parser("let $s := 'a + b' return $s").run(), "a + b")
+
+        xml = "<root><fact c='a'>1</fact><fact c='b'>5</fact></root>"
+        self.assertEqual(Parser("let $facts := //fact return sum($facts) + count($facts)", xml=xml).run(), 8)
+        self.assertEqual(Parser("let $c := 'b' return sum(//fact[@c = $c])", xml=xml).run(), 5)
+
+    def test_filters_and_paths_on_variables(self):
+        xml = "<root><fact c='a'>1<m>x</m></fact><fact c='b'>5</fact><fact c='a'>2<m>y</m></fact></root>"
+
+        # Predicates filter the bound value
+        self.assertEqual(Parser("let $f := //fact return count($f[@c = 'a'])", xml=xml).run(), 2)
+        self.assertEqual(Parser("let $f := //fact return sum($f[@c = 'a'])", xml=xml).run(), 3)
+        self.assertEqual(Parser("let $f := //fact return sum($f[2])", xml=xml).run(), 5)
+        self.assertEqual(Parser("let $x := (1, 2, 3) return $x[. > 1]").run(), [2, 3])
+
+        # Steps are taken from every node of the bound value
+        self.assertEqual(Parser("let $f := //fact return $f/@c", xml=xml).run(), ["a", "b", "a"])
+        self.assertEqual(Parser("for $f in //fact return $f/@c", xml=xml).run(), ["a", "b", "a"])
+        self.assertEqual(Parser("let $f := //fact return count($f//m)", xml=xml).run(), 2)
+        self.assertEqual([m.text for m in Parser("let $f := //fact return $f[@c = 'a']/m", xml=xml).run()],
+                         ["x", "y"])
+        self.assertTrue(Parser("let $f := //fact return $f/@c = 'b'", xml=xml).run())
+
+        with self.assertRaises(TypeError):
+            Parser("let $x := (1, 2) return $x/@c", xml=xml).run()
+
+        # Bindings are evaluated once, when they are referenced for the first time
+        calls = []
+
+        def expensive(*args, **kwargs):
+            calls.append(args[0])
+            return args[0]
+
+        FunctionRegistry(custom_functions={"test:expensive": expensive}, overwrite_functions=True)
+        self.assertEqual(Parser("let $a := test:expensive(5), $b := test:expensive(7) return $a * $a + $a").run(), 30)
+        self.assertEqual(calls, [5])
+
+    def test_quantified_expression(self):
+        self.assertEqual(Parser("some $x in (1, 2, 3) satisfies $x > 2").run(), True)
+        self.assertEqual(Parser("every $x in (1, 2, 3) satisfies $x > 2").run(), False)
+        self.assertEqual(Parser("some $x in (1, 2), $y in (2, 3) satisfies $x + $y = 5").run(), True)
+        self.assertEqual(Parser("every $x in (1, 2), $y in (2, 3) satisfies $x <= $y").run(), True)
+
+        # Nothing satisfies an empty sequence, and everything in it does
+        self.assertEqual(Parser("some $x in () satisfies $x").run(), False)
+        self.assertEqual(Parser("every $x in () satisfies $x").run(), True)
+
+        # Evaluation stops at the first item that decides the outcome
+        self.assertEqual(Parser("some $x in (for $i in 1 to 100000000 return $i) satisfies $x = 5").run(), True)
+
+        xml = "<root><fact>1</fact><fact>5</fact></root>"
+        self.assertEqual(Parser("some $f in //fact satisfies $f > 3", xml=xml).run(), True)
+        self.assertEqual(Parser("every $f in //fact satisfies $f > 3", xml=xml).run(), False)
+
+    def test_simple_map_expression(self):
+        self.assertEqual(Parser("(1, 2, 3) ! (. + 1) ! (. * 10)").run(), [20, 30, 40])
+        self.assertEqual(Parser("(1, 2, 3) ! position()").run(), [1, 2, 3])
+        self.assertEqual(Parser("1 != 2").run(), True)
+
+        xml = "<root><fact c='a'>1.5</fact><fact c='b'>2.25</fact></root>"
+        self.assertEqual(Parser("//fact ! @c", xml=xml).run(), ["a", "b"])
+        # Filters on the right of ! are evaluated with the item as context item
+        self.assertEqual(Parser("//fact ! (@c)[1]", xml=xml).run(), ["a", "b"])
+        self.assertEqual(Parser("(1, 2, 3) ! (.)[1]").run(), [1, 2, 3])
+        self.assertEqual(Parser("(1, 2, 3) ! ((., 10)[. > 1])").run(), [10, 2, 10, 3, 10])
+        self.assertEqual(Parser("count(//fact ! (., .))", xml=xml).run(), 4)
+        self.assertEqual(Parser("sum(//fact ! xs:decimal(.))", xml=xml).run(), Decimal("3.75"))
+
+        # Items are mapped when they are asked for
+        self.assertEqual(Parser("((1 to 100000000) ! (. * 2))[position() < 3]").run(), [2, 4])
+
+    def test_deep_expression(self):
+        """
+        Operators, comparisons, and/or and if expressions are evaluated without recursion, so the depth of the
+        syntax tree is not limited by the recursion limit.
+        """
+        depth = 100000
+
+        left_deep_sum, right_deep_sum = 0, 0
+        for _ in range(depth):
+            left_deep_sum = BinaryOperator(left_deep_sum, operator.add, 1)
+            right_deep_sum = BinaryOperator(1, operator.sub, right_deep_sum)
+        self.assertEqual(resolve_expression(left_deep_sum, variable_map={}, lxml_etree=None), depth)
+        self.assertEqual(resolve_expression(right_deep_sum, variable_map={}, lxml_etree=None), 0)
+
+        # if ($x eq 0) then 0 else if ($x eq 1) then 2 else if ...
+        if_chain = "no match"
+        for i in reversed(range(depth)):
+            if_chain = IfExpression(test_expr=CompareValue(left=depth - 1, op=operator.eq, comparators=[i]),
+                                    then_expr=i * 2, else_expr=if_chain)
+        self.assertEqual(resolve_expression(if_chain, variable_map={}, lxml_etree=None), (depth - 1) * 2)
+
+        junctions = False
+        for _ in range(depth):
+            junctions = AndComparison(values=[1, OrComparison(values=[0, junctions])])
+        self.assertEqual(resolve_expression(junctions, variable_map={}, lxml_etree=None), False)
+
+        # Long sums are parsed without recursion as well
+        self.assertEqual(Parser(" + ".join(str(i) for i in range(2000))).run(), sum(range(2000)))
+
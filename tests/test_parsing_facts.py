@@ -0,0 +1,72 @@
+import unittest
+from decimal import Decimal
+
+from lxml import etree
+
+from src.xpyth_parser.conversion.aggregates import RunningAggregate
+from src.xpyth_parser.grammar.facts import FactStream, path_matches
+from src.xpyth_parser.parse import Parser
+
+
+class FactStreamTests(unittest.TestCase):
+    """
+    Aggregates of paths are kept up to date while facts are appended
+    """
+
+    def test_append_facts(self):
+        stream = FactStream("<xbrl xmlns:ns='http://example'><ns:X>1</ns:X></xbrl>")
+        assertion = Parser("sum(//ns:X) = //ns:Total", no_resolve=True)
+        aggregates = Parser("(count(//ns:X), avg(//ns:X), min(/xbrl/ns:X), max(//ns:X), count(//*))", no_resolve=True)
+
+        self.assertFalse(stream.evaluate(assertion))
+        self.assertEqual(stream.evaluate(aggregates), [1, 1.0, 1, 1, 2])
+
+        stream.append("<ns:X xmlns:ns='http://example'>2</ns:X>")
+        stream.append("<ns:Total xmlns:ns='http://example'>3</ns:Total>")
+        self.assertTrue(stream.evaluate(assertion))
+        self.assertEqual(stream.evaluate(aggregates), [2, 1.5, 1, 2, 4])
+
+        # A fact with nested elements
+        stream.append("<group xmlns:ns='http://example'><ns:X>0.5</ns:X></group>")
+        self.assertEqual(stream.evaluate(aggregates), [3, 3.5 / 3, 1.0, 2.0, 6])
+
+        # The outcomes are those of evaluating against the whole document
+        self.assertEqual(aggregates.evaluate(xml=stream.lxml_etree), [3, 3.5 / 3, 1.0, 2.0, 6])
+        self.assertFalse(assertion.evaluate(xml=stream.lxml_etree))
+        self.assertFalse(stream.evaluate(assertion))
+
+    def test_decimal_mode(self):
+        stream = FactStream("<xbrl/>")
+        parser = Parser("sum(//X) - 0.3", no_resolve=True, decimal_mode=True)
+        self.assertEqual(stream.evaluate(parser), Decimal("-0.3"))
+
+        for value in ["0.1", "0.1", "0.1"]:
+            stream.append(f"<X>{value}</X>")
+        self.assertEqual(stream.evaluate(parser), Decimal("0.0"))
+
+    def test_untracked_paths(self):
+        stream = FactStream("<xbrl><X>1</X></xbrl>")
+        parser = Parser("sum(//X[. > 1])", no_resolve=True)
+        self.assertEqual(stream.evaluate(parser), 0)
+        self.assertEqual(stream.aggregates(parser), {})
+
+        stream.append("<X>5</X>")
+        self.assertEqual(stream.evaluate(parser), 5)
+
+    def test_path_matches(self):
+        root = etree.fromstring("<a><b><c/></b><c/></a>")
+        steps = Parser("count(/a//b/c)", no_resolve=True).XPath.expr._children[0].steps
+        b_c, a_c = root[0][0], root[1]
+
+        self.assertTrue(path_matches(b_c, steps, root.nsmap))
+        self.assertFalse(path_matches(a_c, steps, root.nsmap))
+
+    def test_running_aggregate(self):
+        aggregate = RunningAggregate()
+        self.assertEqual((aggregate.sum(), aggregate.avg(), aggregate.min(), aggregate.max()), (0, [], [], []))
+
+        aggregate.add("a")
+        self.assertEqual(len(aggregate), 1)
+        with self.assertRaises(TypeError):
+            aggregate.add(1)
+            aggregate.sum()
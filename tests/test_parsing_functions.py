@@ -1,7 +1,14 @@
+import asyncio
+import time
 import unittest
+from concurrent.futures import ThreadPoolExecutor
+from lxml import etree
 from isodate.isodates import date
 from isodate.duration import Duration
 
+from src.xpyth_parser.conversion import vectorized
+from src.xpyth_parser.conversion.frame import EvaluationFrame
+from src.xpyth_parser.conversion.functions.generic import FunctionRegistry
 from src.xpyth_parser.conversion.qname import QName
 from src.xpyth_parser.parse import Parser
 
@@ -49,6 +56,12 @@ class FunctionsOperatorsSequences(unittest.TestCase):
         self.assertEqual(sum.args[0], [1, 4, 2, 3, 12, 3, 6])
         self.assertEqual(sum(), 31)
 
+    def test_aggregates_of_empty_sequence(self):
+        # The empty sequence has no average, maximum or minimum
+        for expression in ["avg(//missing)", "avg(())", "max(//missing)", "max(())", "min(//missing)", "min(())"]:
+            with self.subTest(expression=expression):
+                self.assertEqual(Parser(expression, xml="<xbrl><fact>1</fact></xbrl>").run(), [])
+
     def test_date_time(self):
 
         date_outcome = Parser("xs:date('2021-12-31')")
@@ -93,4 +106,156 @@ class FunctionsOperatorsSequences(unittest.TestCase):
     def test_number(self):
         self.assertEqual(Parser("number(42)").resolved_answer, 42.0)
         self.assertEqual(Parser("number(42.42)").resolved_answer, 42.42)
-        self.assertEqual(Parser("number($paramname)", variable_map={"paramname": 42.42}).resolved_answer, 42.42)
\ No newline at end of file
+        self.assertEqual(Parser("number($paramname)", variable_map={"paramname": 42.42}).resolved_answer, 42.42)
+
+class FunctionMemoization(unittest.TestCase):
+    """
+    Function calls are only run once per evaluation, and pure functions are memoized across evaluations
+    """
+
+    def setUp(self):
+        self.calls = []
+
+        def counted(*args, **kwargs):
+            self.calls.append(args)
+            return args[0]
+
+        self.counted = counted
+
+    def test_call_once_per_frame(self):
+        FunctionRegistry(custom_functions={"test:counted": self.counted}, overwrite_functions=True)
+
+        function_call = Parser("test:counted(5)", no_resolve=True).XPath.expr
+        with EvaluationFrame():
+            self.assertEqual(function_call(), 5)
+            self.assertEqual(function_call(), 5)
+        self.assertEqual(len(self.calls), 1)
+
+        # A new evaluation runs the function again
+        self.assertEqual(Parser("test:counted(5)").run(), 5)
+        self.assertEqual(len(self.calls), 2)
+
+        # Comparisons ask for the value of the function only once
+        self.assertTrue(Parser("5 eq test:counted(5)").run())
+        self.assertEqual(len(self.calls), 3)
+
+    def test_pure_functions(self):
+        registry = FunctionRegistry(custom_functions={"test:pure-counted": self.counted},
+                                    overwrite_functions=True, pure=True)
+        registry.clear_pure_results()
+        self.assertTrue(registry.is_pure("test:pure-counted"))
+
+        self.assertEqual(Parser("test:pure-counted(7)").run(), 7)
+        self.assertEqual(Parser("test:pure-counted(7)").run(), 7)
+        self.assertEqual(len(self.calls), 1)
+
+        # Other arguments give another outcome
+        self.assertEqual(Parser("test:pure-counted(8)").run(), 8)
+        self.assertEqual(len(self.calls), 2)
+
+        # Outcomes are evicted when the cache is full
+        registry.pure_results_maxsize = 1
+        try:
+            Parser("test:pure-counted(9)").run()
+            Parser("test:pure-counted(7)").run()
+            self.assertEqual(len(self.calls), 4)
+            self.assertEqual(len(registry.pure_results), 1)
+        finally:
+            del registry.pure_results_maxsize
+            registry.clear_pure_results()
+
+    def test_pure_results_from_threads(self):
+        """
+        Outcomes are looked up, stored and evicted by several threads at once
+        """
+        registry = FunctionRegistry()
+        registry.pure_results_maxsize = 4
+
+        def use_results(thread):
+            for i in range(2000):
+                key = ("test:pure", (thread, i % 8))
+                registry.set_pure_result(key, i)
+                registry.get_pure_result(key)
+                registry.get_pure_result(("test:pure", (thread - 1, i % 8)))
+
+        try:
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                list(executor.map(use_results, range(8)))
+            self.assertLessEqual(len(registry.pure_results), 4)
+        finally:
+            del registry.pure_results_maxsize
+            registry.clear_pure_results()
+
+
+class AsyncFunctions(unittest.TestCase):
+    """
+    Custom functions which are coroutine functions
+    """
+
+    def setUp(self):
+        async def lookup(value, **kwargs):
+            await asyncio.sleep(0.2)
+            return value * 10
+
+        FunctionRegistry(custom_functions={"test:lookup": lookup}, overwrite_functions=True)
+
+    def test_sync_evaluation(self):
+        self.assertEqual(Parser("test:lookup(3) + 1").run(), 31)
+
+    def test_async_evaluation(self):
+        parser = Parser("test:lookup($v) + count(//a)", no_resolve=True)
+        xml = "<root><a/><a/></root>"
+        self.assertEqual(asyncio.run(parser.evaluate_async(xml=xml, variable_map={"v": 2})), 22)
+
+    def test_concurrent_calls(self):
+        parser = Parser("(test:lookup(1), test:lookup(2), test:lookup(3))", no_resolve=True)
+
+        started = time.monotonic()
+        self.assertEqual(asyncio.run(parser.evaluate_async()), [10, 20, 30])
+        self.assertLess(time.monotonic() - started, 0.5)
+
+        parser = Parser("test:lookup(1) < test:lookup(2)", no_resolve=True)
+        started = time.monotonic()
+        self.assertTrue(asyncio.run(parser.evaluate_async()))
+        self.assertLess(time.monotonic() - started, 0.35)
+
+
+class VectorizedAggregates(unittest.TestCase):
+    """
+    Aggregates over large node sequences are computed with NumPy if it is installed
+    """
+
+    def create_instance(self, values):
+        facts = "".join(f"<fact>{value}</fact>" for value in values)
+        return bytes(f"<root>{facts}</root>", encoding="utf-8")
+
+    def assert_aggregates(self, values):
+        xml = self.create_instance(values)
+        self.assertEqual(Parser("sum(//fact)", xml=xml).run(), sum(values))
+        self.assertAlmostEqual(Parser("avg(//fact)", xml=xml).run(), sum(values) / len(values))
+        self.assertEqual(Parser("min(//fact)", xml=xml).run(), min(values))
+        self.assertEqual(Parser("max(//fact)", xml=xml).run(), max(values))
+
+    def test_aggregates_without_numpy(self):
+        numpy_module = vectorized.numpy
+        vectorized.numpy = None
+        try:
+            self.assert_aggregates(list(range(-500, 1500)))
+        finally:
+            vectorized.numpy = numpy_module
+
+    @unittest.skipIf(vectorized.numpy is None, "NumPy is not installed")
+    def test_aggregates_with_numpy(self):
+        values = list(range(-500, 1500))
+        self.assertIsNotNone(vectorized.vectorize_elements(etree.fromstring(self.create_instance(values)).xpath("//fact")))
+        self.assert_aggregates(values)
+
+        # Floating point values
+        self.assert_aggregates([value / 4 for value in range(2000)])
+
+        # Sums that do not fit in 64 bits
+        self.assert_aggregates([10 ** 17 + value for value in range(2000)])
+
+        # Non-numeric values can not be vectorized
+        facts = etree.fromstring(self.create_instance(["a"] + values)).xpath("//fact")
+        self.assertIsNone(vectorized.vectorize_elements(facts))
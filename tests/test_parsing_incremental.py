@@ -0,0 +1,76 @@
+import unittest
+
+from src.xpyth_parser.conversion.functions.generic import FunctionRegistry
+from src.xpyth_parser.grammar.incremental import same_value, variable_dependencies
+from src.xpyth_parser.parse import Parser
+
+
+class IncrementalEvaluationTests(unittest.TestCase):
+    """
+    Evaluating an expression again with other variables only evaluates the parts that refer to changed variables
+    """
+
+    xml = "<root><a>1</a><a>2</a><b>5</b></root>"
+
+    def setUp(self):
+        self.calls = []
+
+        def counted(*args, **kwargs):
+            self.calls.append(args)
+            return args[0]
+
+        FunctionRegistry(custom_functions={"test:incremental": counted}, overwrite_functions=True)
+
+    def test_reuse_subtrees(self):
+        evaluation = Parser("test:incremental(sum(//a)) * $rate + test:incremental(count(//b[. > $min]))",
+                            no_resolve=True).incremental(xml=self.xml)
+
+        self.assertEqual(evaluation.evaluate({"rate": 2, "min": 1}), 7)
+        self.assertEqual(len(self.calls), 2)
+
+        # Only the multiplication and the addition are evaluated again
+        self.assertEqual(evaluation.evaluate({"rate": 3, "min": 1}), 10)
+        self.assertEqual(len(self.calls), 2)
+        self.assertEqual(evaluation.subtree_values.reused, 2)
+
+        self.assertEqual(evaluation.evaluate({"rate": 3, "min": 10}), 9)
+        self.assertEqual(len(self.calls), 3)
+
+        # Nothing changed
+        self.assertEqual(evaluation.evaluate({"rate": 3, "min": 10}), 9)
+        self.assertEqual(evaluation.subtree_values.evaluated, 0)
+
+        # Another document
+        evaluation = Parser("test:incremental(sum(//a)) * $rate", no_resolve=True).incremental(xml="<a>4</a>")
+        self.assertEqual(evaluation.evaluate({"rate": 2}), 8)
+
+    def test_branches(self):
+        evaluation = Parser("if ($x > 1) then test:incremental(1) else test:incremental(2)",
+                            no_resolve=True).incremental()
+
+        self.assertEqual(evaluation.evaluate({"x": 2}), 1)
+        self.assertEqual(evaluation.evaluate({"x": 0}), 2)
+        self.assertEqual(evaluation.evaluate({"x": 3}), 1)
+        self.assertEqual(len(self.calls), 2)
+
+    def test_changed_values(self):
+        evaluation = Parser("for $i in 1 to $n return $i * $k", no_resolve=True).incremental()
+        self.assertEqual(evaluation.evaluate({"n": 3, "k": 1}), [1, 2, 3])
+        self.assertEqual(evaluation.evaluate({"n": 3, "k": 2}), [2, 4, 6])
+        self.assertEqual(evaluation.evaluate({"n": 2, "k": 2}), [2, 4])
+
+        # Values of other types are other values
+        self.assertTrue(same_value([1, "a"], [1, "a"]))
+        self.assertFalse(same_value([1, 2], [1.0, 2]))
+
+        # Variables with string values can refer to other variables
+        evaluation = Parser("$a + 1", no_resolve=True).incremental()
+        self.assertEqual(evaluation.evaluate({"a": "$b * 2", "b": 1}), 3)
+        self.assertEqual(evaluation.evaluate({"a": "$b * 2", "b": 5}), 11)
+
+    def test_variable_dependencies(self):
+        expression = Parser("$a + sum(for $i in 1 to $n return $i)", no_resolve=True).XPath.expr
+        dependencies = variable_dependencies(expression)
+
+        self.assertEqual(dependencies[id(expression)], {"a", "n", "i"})
+        self.assertEqual(dependencies[id(expression.left)], {"a"})
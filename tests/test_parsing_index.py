@@ -0,0 +1,70 @@
+import unittest
+
+from lxml import etree
+
+from src.xpyth_parser.conversion.document import Document
+from src.xpyth_parser.conversion.index import ElementIndex
+from src.xpyth_parser.parse import Parser
+from tests.utils import serialize
+
+xml = b"""<xbrl xmlns:ns='http://example' xmlns:other='http://other'>
+    <ns:X contextRef='c1'>1</ns:X>
+    <g><ns:X contextRef='c2'>2</ns:X><X>10</X><!-- comment --></g>
+    <other:X>100</other:X>
+    <ns:X contextRef='c1'>3</ns:X>
+</xbrl>"""
+
+
+class ElementIndexTests(unittest.TestCase):
+    """
+    Paths like //ns:X look their elements up in the index of the document
+    """
+
+    def test_elements(self):
+        index = ElementIndex(etree.fromstring(xml))
+        self.assertEqual([element.text for element in index.elements("http://example", "X")], ["1", "2", "3"])
+        self.assertEqual([element.text for element in index.elements(None, "X")], ["10"])
+        self.assertEqual(index.elements("http://example", "Y"), [])
+        # Comments are not indexed
+        self.assertEqual(len(index), 7)
+
+    def test_same_as_query(self):
+        expressions = [
+            "sum(//ns:X)",
+            "count(//X)",
+            "//other:X",
+            "//ns:X[@contextRef = 'c1']",
+            "count(//ns:X[. > 1])",
+            "count(//ns:Y)",
+            "//g/ns:X",
+            "(//ns:X)[2]",
+            "for $x in //ns:X return $x * 2",
+        ]
+
+        document = Document.load(xml)
+        indexed_document = Document.load(xml)
+        indexed_document.build_index()
+
+        for expression in expressions:
+            with self.subTest(expression=expression):
+                parser = Parser(expression, no_resolve=True)
+                self.assertEqual(serialize(parser.evaluate(xml=indexed_document)), serialize(parser.evaluate(xml=document)))
+
+    def test_index_is_used(self):
+        document = Document.load(xml)
+        parser = Parser("count(//ns:X)", no_resolve=True, xml=document)
+        self.assertEqual(parser.evaluate(), 3)
+
+        document.build_index()
+        self.assertIs(document.build_index(), document.index)
+
+        # Elements added after the index was built are not in the index
+        etree.SubElement(document.root, "{http://example}X").text = "4"
+        self.assertEqual(parser.evaluate(), 3)
+        self.assertEqual(parser.evaluate(xml=document.root), 4)
+
+    def test_undefined_prefix(self):
+        document = Document.load(xml)
+        document.build_index()
+        with self.assertRaises(etree.XPathEvalError):
+            Parser("//undefined:X", no_resolve=True).evaluate(xml=document)
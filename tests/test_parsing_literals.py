@@ -52,6 +52,10 @@ class TestLiterals(unittest.TestCase):
             float(4362.21e-3),
         )
 
+        # Leading zeros of the fraction are kept
+        self.assertEqual(t_NumericLiteral.parseString("1.05", parseAll=True)[0], 1.05)
+        self.assertEqual(t_NumericLiteral.parseString("1.005e2", parseAll=True)[0], 100.5)
+
     def test_char_literals(self):
         """
         Run NameChar literal and other character specific tests
@@ -1,5 +1,9 @@
 import unittest
 import os
+from concurrent.futures import ThreadPoolExecutor
+
+from src.xpyth_parser.conversion import nodesets
+from src.xpyth_parser.conversion.document import Document
 from src.xpyth_parser.conversion.qname import QName
 from src.xpyth_parser.conversion.tests import Test
 from src.xpyth_parser.grammar.expressions import (
@@ -240,6 +244,19 @@ class PathTraversalTests(unittest.TestCase):
             # todo: need to figure out while some queries are in lists, others are not.
             #  I think I am unpacking a bit too much somewhere
 
+            # Positional predicates are part of the query for LXML
+            self.assertEqual(
+                Parser("/maindoc/multipleOccuringElement[last()]", xml=xml_bytes).run().text,
+                "6100",
+            )
+            self.assertEqual(
+                Parser("/maindoc/multipleOccuringElement[last() - 1]", xml=xml_bytes).run().text,
+                "1400",
+            )
+            self.assertEqual(
+                Parser("count(/maindoc/multipleOccuringElement[position() < 3])", xml=xml_bytes).run(), 2
+            )
+
     def test_empty_paths(self):
         TESTDATA_FILENAME = os.path.join(
             os.path.dirname(__file__), "input/empty_instance.xml"
@@ -248,6 +265,142 @@ class PathTraversalTests(unittest.TestCase):
         with open(TESTDATA_FILENAME) as xml_file:
             xml_bytes = bytes(xml_file.read(), encoding="utf-8")
             self.assertEqual(Parser("sum(//singleOccuringElement)", xml=xml_bytes).run(), 0)
-            self.assertRaises(ValueError, Parser, "min(//singleOccuringElement)", xml=xml_bytes)
-            self.assertRaises(ValueError, Parser, "max(//singleOccuringElement)", xml=xml_bytes)
-            self.assertRaises(ZeroDivisionError, Parser, "avg(//singleOccuringElement)", xml=xml_bytes)
+            # The empty sequence has no minimum, maximum or average
+            self.assertEqual(Parser("min(//singleOccuringElement)", xml=xml_bytes).run(), [])
+            self.assertEqual(Parser("max(//singleOccuringElement)", xml=xml_bytes).run(), [])
+            self.assertEqual(Parser("avg(//singleOccuringElement)", xml=xml_bytes).run(), [])
+
+    def test_predicate_pushdown(self):
+        xml = """<xbrl xmlns:ns="http://example.com/ns">
+            <group><ns:Revenue contextRef="c1">1500</ns:Revenue></group>
+            <group><ns:Revenue contextRef="c2">900</ns:Revenue><ns:Revenue contextRef="c1">300</ns:Revenue></group>
+        </xbrl>"""
+
+        # Predicates that only depend on the node are part of the query for LXML
+        parser = Parser("sum(//ns:Revenue[@contextRef = 'c1'])", xml=xml)
+        self.assertEqual(parser.run(), 1800)
+        self.assertEqual([decision.pushed for decision in parser.pushdown_report], [True])
+        self.assertEqual(parser.pushdown_report[0].predicate, "attribute::contextRef = 'c1'")
+
+        parser = Parser("count(//ns:Revenue[. > 1000 or . < 500])", xml=xml)
+        self.assertEqual(parser.run(), 2)
+        self.assertTrue(parser.pushdown_report[0].pushed)
+
+        parser = Parser("count(//group[count(ns:Revenue) > 1]/ns:Revenue)", xml=xml)
+        self.assertEqual(parser.run(), 2)
+        self.assertEqual([decision.pushed for decision in parser.pushdown_report], [True])
+
+        self.assertEqual(Parser("//ns:Revenue/@contextRef", xml=xml).run(), ["c1", "c2", "c1"])
+
+        # Variables are passed to LXML, so the same query can be run with other values
+        parser = Parser("sum(//ns:Revenue[@contextRef = $context])", xml=xml, variable_map={"context": "'c1'"})
+        self.assertEqual(parser.run(), 1800)
+        self.assertEqual(parser.pushdown_report[0].predicate, "attribute::contextRef = $context")
+        self.assertEqual(parser.evaluate(variable_map={"context": "'c2'"}), 900)
+
+        # Other predicates are evaluated in Python, after which the rest of the path is queried from each node
+        parser = Parser("sum(//group[xs:date('2020-01-01')][2]/ns:Revenue[@contextRef = 'c1'])", xml=xml)
+        self.assertEqual(parser.run(), 300)
+        self.assertEqual([decision.pushed for decision in parser.pushdown_report], [False, False, True])
+
+    def test_relational_pushdown(self):
+        """
+        LXML compares <, <=, > and >= as numbers, so only comparisons with numbers are pushed
+        """
+        xml = "<xbrl><fact c='a'>1</fact><fact c='c'>2</fact><fact c='b'>3</fact></xbrl>"
+
+        for predicate, pushed in [
+            ("@c < 'b'", False),
+            ("@c ge 'b'", False),
+            (". > 1", True),
+            (". <= -1 + 3", True),
+            ("count(@c) >= 1", True),
+        ]:
+            with self.subTest(predicate=predicate):
+                parser = Parser(f"count(//fact[{predicate}])", xml=xml, no_resolve=True)
+                self.assertEqual([decision.pushed for decision in parser.pushdown_report], [pushed])
+
+                # Filters of a sequence are always evaluated in Python
+                self.assertEqual(parser.evaluate(), Parser(f"count((//fact)[{predicate}])", xml=xml).run())
+
+        self.assertEqual(Parser("count(//fact[@c < 'b'])", xml=xml).run(), 1)
+
+        # Equal attribute values of different nodes, after a predicate evaluated in Python, are all kept
+        xml = "<root><fact c='c1'>1</fact><fact c='c1'>2</fact><fact c='c2'>3</fact></root>"
+        self.assertEqual(Parser("//fact[. = (1, 2)]/@c", xml=xml).run(), ["c1", "c1"])
+        self.assertEqual(Parser("count(//fact[. = (1, 2)]/@c)", xml=xml).run(), 2)
+
+    def test_python_predicates_per_context_node(self):
+        """
+        Positions in predicates that are evaluated in Python count the nodes of each context node, as in LXML
+        """
+        xml = """<xbrl>
+            <group><fact id="f1">x</fact><fact id="f2">y</fact></group>
+            <group><fact id="f3">y</fact><fact id="f4">x</fact><fact id="f5">y</fact></group>
+            <group/>
+        </xbrl>"""
+
+        for expression, ids in [
+            ("//group/fact[. = ('y', 'z')][1]/@id", ["f2", "f3"]),
+            ("//group/fact[. = ('x', 'y')][last()]/@id", ["f2", "f5"]),
+            ("//group/fact[. = ('x', 'y')][position() = 2]/@id", ["f2", "f4"]),
+            ("//fact[. = ('y', 'z')][2]/@id", "f5"),
+        ]:
+            with self.subTest(expression=expression):
+                parser = Parser(expression, xml=xml, no_resolve=True)
+                self.assertIn(False, [decision.pushed for decision in parser.pushdown_report])
+                self.assertEqual(parser.evaluate(), ids)
+
+    def test_node_set_operations(self):
+        xml = """<xbrl>
+            <fact id="f1"/><other id="o1"/><fact id="f2"/><other id="o2"/><fact id="f3"/>
+        </xbrl>"""
+
+        def ids(expression):
+            return [node.get("id") for node in Parser(expression, xml=xml).run()]
+
+        # Results are in document order, without duplicates
+        self.assertEqual(ids("//other | //fact"), ["f1", "o1", "f2", "o2", "f3"])
+        self.assertEqual(ids("//fact union //fact"), ["f1", "f2", "f3"])
+        self.assertEqual(ids("//fact union //missing"), ["f1", "f2", "f3"])
+
+        self.assertEqual(ids("(//fact | //other) intersect //other"), ["o1", "o2"])
+        self.assertEqual(ids("//*[@id] except //fact"), ["o1", "o2"])
+        self.assertEqual(ids("//*[@id] except //fact except //other"), [])
+
+        # Intersect and except take precedence over union
+        self.assertEqual(ids("//fact | //other except //other"), ["f1", "f2", "f3"])
+
+        # Operands out of document order and with duplicates
+        self.assertEqual(ids("(//other, //fact, //fact) intersect (//fact[@id = 'f3'], //fact[@id = 'f1'])"),
+                         ["f1", "f3"])
+        self.assertEqual(ids("(//fact, //other, //fact) except (//fact[@id = 'f2'], //other)"), ["f1", "f3"])
+
+    def test_document_orders(self):
+        """
+        Positions of nodes are kept by the Document, the Parser or the evaluation, not by the module, and can be
+        used from several threads at once
+        """
+        xml = "<xbrl>" + "".join(f"<fact id='f{i}'/><other id='o{i}'/>" for i in range(50)) + "</xbrl>"
+        parser = Parser("//other | //fact", no_resolve=True)
+
+        # An evaluation against a tree keeps the positions only while it runs
+        self.assertEqual(len(parser.evaluate(xml=xml)), 100)
+        self.assertFalse(hasattr(nodesets, "_document_orders"))
+
+        # A Parser keeps the positions of its own tree, so they are built once for all its evaluations
+        own_parser = Parser("//other | //fact", xml=xml, no_resolve=True)
+        self.assertEqual(len(own_parser.evaluate()), 100)
+        index = own_parser.document_orders.indexes[own_parser.lxml_etree]
+        self.assertEqual(len(own_parser.evaluate()), 100)
+        self.assertIs(own_parser.document_orders.indexes[own_parser.lxml_etree], index)
+
+        document = Document.load(xml)
+        self.assertEqual(len(parser.evaluate(xml=document)), 100)
+        self.assertEqual(list(document.document_orders.indexes), [document.root])
+
+        expected = [node.get("id") for node in parser.evaluate(xml=document)]
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            outcomes = list(executor.map(lambda _: [node.get("id") for node in parser.evaluate(xml=document)],
+                                         range(32)))
+        self.assertTrue(all(outcome == expected for outcome in outcomes))
@@ -0,0 +1,74 @@
+import unittest
+
+from lxml import etree
+
+from src.xpyth_parser.conversion.document import Document
+from src.xpyth_parser.grammar.prefetch import FormulaSet, PrefetchedPaths, simple_paths
+from src.xpyth_parser.parse import Parser
+from tests.utils import serialize
+
+xml = b"""<xbrl xmlns:ns='http://example'>
+    <ns:X>1</ns:X>
+    <g><ns:X>2</ns:X><ns:Y>5</ns:Y><h><ns:X>4</ns:X></h></g>
+    <X>10</X>
+    <ns:X>3</ns:X>
+</xbrl>"""
+
+
+class FormulaSetTests(unittest.TestCase):
+    """
+    Simple paths of a set of expressions are found in one walk over the document
+    """
+
+    expressions = [
+        "sum(//ns:X)",
+        "count(/xbrl/ns:X)",
+        "//g/ns:X",
+        "count(//g//ns:X)",
+        "count(/xbrl/*/ns:Y)",
+        "count(//*)",
+        "//X",
+        "count(//ns:X[. > 1])",
+        "sum(//ns:X) = sum(/xbrl/ns:X) + sum(//g//ns:X)",
+        "for $x in //ns:Y return $x + count(//h/ns:X)",
+        "count(/ns:X)",
+        "count(//ns:Z)",
+    ]
+
+    def test_simple_paths(self):
+        self.assertEqual(set(simple_paths(Parser("sum(//ns:X) + count(/xbrl/ns:X[1]) + count(//g//ns:Y)",
+                                                 no_resolve=True).XPath)), {"//ns:X", "//g//ns:Y"})
+
+    def test_same_as_evaluate(self):
+        parsers = []
+        for expression in self.expressions:
+            try:
+                parsers.append(Parser(expression, no_resolve=True))
+            except Exception:
+                # Not every expression can be parsed by the grammar
+                continue
+
+        formula_set = FormulaSet(parsers)
+        self.assertEqual(serialize(formula_set.evaluate(xml)),
+                         serialize([parser.evaluate(xml=xml) for parser in parsers]))
+
+    def test_one_walk(self):
+        document = Document.load(xml)
+        formula_set = FormulaSet([Parser("count(//ns:X)", no_resolve=True), Parser("//g/ns:X", no_resolve=True)])
+        prefetched_paths = formula_set.prefetch(document)
+        self.assertEqual([element.text for element in prefetched_paths.elements("//ns:X")], ["1", "2", "4", "3"])
+        self.assertEqual([element.text for element in prefetched_paths.elements("//g/ns:X")], ["2"])
+        self.assertIsNone(prefetched_paths.elements("//ns:Y"))
+
+        # Paths take their elements from the walk, so elements added after it are not seen
+        etree.SubElement(document.root, "{http://example}X").text = "5"
+        parser = formula_set.parsers[0]
+        self.assertEqual(parser.evaluate(xml=document, prefetched_paths=prefetched_paths), 4)
+        self.assertEqual(parser.evaluate(xml=document), 5)
+
+    def test_undefined_prefix(self):
+        parser = Parser("count(//undefined:X)", no_resolve=True)
+        root = Document.load(xml).root
+        self.assertIsNone(PrefetchedPaths(root, simple_paths(parser.XPath).values()).elements("//undefined:X"))
+        with self.assertRaises(etree.XPathEvalError):
+            FormulaSet([parser]).evaluate(xml)
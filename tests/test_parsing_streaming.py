@@ -0,0 +1,100 @@
+import io
+import os
+import pathlib
+import tempfile
+import unittest
+
+from src.xpyth_parser.parse import Parser
+
+xml = "<xbrl xmlns:ns='http://example'>" + "".join(
+    f"<ns:X contextRef='c{i % 3}'>{i}</ns:X><g><ns:X contextRef='c1'>1</ns:X><ns:Y>2</ns:Y></g>" for i in range(10)
+) + "</xbrl>"
+
+
+class StreamingTests(unittest.TestCase):
+    """
+    Aggregates of paths are computed in a single pass over the document
+    """
+
+    def test_same_as_evaluate(self):
+        expressions = [
+            "count(//ns:X)",
+            "sum(//ns:X[@contextRef = 'c1'])",
+            "sum(/xbrl/ns:X) + avg(//g/ns:X)",
+            "exists(//ns:Z)",
+            "empty(//ns:Z)",
+            "exists(/xbrl/g/ns:Y)",
+            "max(//ns:X[. > 3])",
+            "max(//ns:X[. > $v + 0])",
+            "min(//ns:Y) = 2",
+            "count(//*/ns:Y)",
+            "count(/ns:X)",
+        ]
+        for expression in expressions:
+            parser = Parser(expression, no_resolve=True, variable_map={"v": 3})
+            with self.subTest(expression=expression):
+                self.assertEqual(parser.evaluate_streaming(xml.encode("utf-8")), parser.evaluate(xml=xml))
+
+    def test_variables(self):
+        parser = Parser("sum(//ns:X[@contextRef = $c])", no_resolve=True)
+        self.assertEqual(parser.evaluate_streaming(xml.encode("utf-8"), variable_map={"c": "'c0'"}), 18)
+        self.assertEqual(parser.evaluate_streaming(xml.encode("utf-8"), variable_map={"c": "'c1'"}), 22)
+
+    def test_sources(self):
+        parser = Parser("count(//ns:X)", no_resolve=True)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = pathlib.Path(directory) / "instance.xml"
+            path.write_text(xml)
+
+            self.assertEqual(parser.evaluate_streaming(path), 20)
+            self.assertEqual(parser.evaluate_streaming(os.fspath(path)), 20)
+            with open(path, "rb") as f:
+                self.assertEqual(parser.evaluate_streaming(f), 20)
+
+        self.assertEqual(parser.evaluate_streaming(io.BytesIO(xml.encode("utf-8"))), 20)
+
+    def test_large_document(self):
+        parser = Parser("(count(//ns:X), sum(//ns:X), max(//g/ns:X))", no_resolve=True)
+        document = "<xbrl xmlns:ns='http://example'>" + "<g><ns:X>1</ns:X><ns:X>2</ns:X></g>" * 10000 + "</xbrl>"
+        self.assertEqual(parser.evaluate_streaming(document.encode("utf-8")), [20000, 30000, 2])
+
+    def test_containers(self):
+        # The root and containers are selected, as well as elements within them
+        expressions = [
+            "count(/xbrl)",
+            "exists(//g)",
+            "count(//g) + sum(//g/ns:X)",
+            "count(//g[ns:Y = 2])",
+            "count(//g[ns:X = 1]) + sum(//ns:X)",
+            "sum(//ns:X) + count(//xbrl[g])",
+        ]
+        for expression in expressions:
+            parser = Parser(expression, no_resolve=True)
+            with self.subTest(expression=expression):
+                self.assertEqual(parser.evaluate_streaming(xml.encode("utf-8")), parser.evaluate(xml=xml))
+
+        parser = Parser("(count(/xbrl), exists(//xbrl), count(//g))", no_resolve=True)
+        document = "<xbrl xmlns:ns='http://example'>" + "<g><ns:X>1</ns:X><ns:X>2</ns:X></g>" * 10000 + "</xbrl>"
+        self.assertEqual(parser.evaluate_streaming(document.encode("utf-8")), [1, True, 10000])
+
+    def test_not_streamable(self):
+        expressions = [
+            "//ns:X",
+            "count(//ns:X) + number(/xbrl/g/ns:Y)",
+            "count(//ns:X[1])",
+            "count(//ns:X[position() = 2])",
+            "count(//ns:X[//g])",
+            "count(//ns:X[parent::g])",
+        ]
+        for expression in expressions:
+            with self.subTest(expression=expression), self.assertRaises(ValueError):
+                Parser(expression, no_resolve=True).evaluate_streaming(xml.encode("utf-8"))
+
+
+class ExistsTests(unittest.TestCase):
+    def test_exists(self):
+        self.assertTrue(Parser("exists(//ns:X)", no_resolve=True).evaluate(xml=xml))
+        self.assertFalse(Parser("exists(//ns:Z)", no_resolve=True).evaluate(xml=xml))
+        self.assertTrue(Parser("exists((1, 2))").run())
+        self.assertFalse(Parser("exists(())").run())
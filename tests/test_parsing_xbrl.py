@@ -0,0 +1,111 @@
+import datetime
+import unittest
+
+from src.xpyth_parser.conversion.document import Document
+from src.xpyth_parser.conversion.xbrl_index import Period, XbrlIndex, XbrlIndexes
+from src.xpyth_parser.parse import Parser
+
+instance = b"""<xbrli:xbrl xmlns:xbrli='http://www.xbrl.org/2003/instance' xmlns:xbrldi='http://xbrl.org/2006/xbrldi'
+        xmlns:ns='http://example' xmlns:iso4217='http://www.xbrl.org/2003/iso4217'>
+    <xbrli:context id='c1'>
+        <xbrli:entity>
+            <xbrli:identifier scheme='http://www.kvk.nl/kvk-id'>12345678</xbrli:identifier>
+            <xbrli:segment><xbrldi:explicitMember dimension='ns:Dim'>ns:Member</xbrldi:explicitMember></xbrli:segment>
+        </xbrli:entity>
+        <xbrli:period><xbrli:instant>2020-12-31</xbrli:instant></xbrli:period>
+    </xbrli:context>
+    <xbrli:context id='c2'>
+        <xbrli:entity><xbrli:identifier scheme='http://www.kvk.nl/kvk-id'>87654321</xbrli:identifier></xbrli:entity>
+        <xbrli:period><xbrli:startDate>2020-01-01</xbrli:startDate><xbrli:endDate>2020-12-31</xbrli:endDate></xbrli:period>
+    </xbrli:context>
+    <xbrli:unit id='EUR'><xbrli:measure>iso4217:EUR</xbrli:measure></xbrli:unit>
+    <xbrli:unit id='EURperShare'>
+        <xbrli:divide>
+            <xbrli:unitNumerator><xbrli:measure>iso4217:EUR</xbrli:measure></xbrli:unitNumerator>
+            <xbrli:unitDenominator><xbrli:measure>xbrli:shares</xbrli:measure></xbrli:unitDenominator>
+        </xbrli:divide>
+    </xbrli:unit>
+    <ns:Revenue contextRef='c1' unitRef='EUR'>100</ns:Revenue>
+    <ns:Revenue contextRef='c2' unitRef='EUR'>200</ns:Revenue>
+    <ns:Name contextRef='c2'>Example</ns:Name>
+</xbrli:xbrl>"""
+
+
+class XbrlIndexTests(unittest.TestCase):
+    """
+    Contexts and units are looked up by id, and parsed once
+    """
+
+    def test_contexts(self):
+        index = XbrlIndex.from_root(Document.load(instance).root)
+
+        context = index.context("c1")
+        self.assertIs(index.context("c1"), context)
+        self.assertEqual(context.scheme, "http://www.kvk.nl/kvk-id")
+        self.assertEqual(context.identifier, "12345678")
+        self.assertEqual(context.period, Period(instant=datetime.date(2020, 12, 31)))
+        self.assertEqual(context.explicit_members, {"{http://example}Dim": "{http://example}Member"})
+
+        duration = index.context("c2").period
+        self.assertFalse(duration.is_instant)
+        self.assertEqual((duration.start, duration.end), (datetime.date(2020, 1, 1), datetime.date(2020, 12, 31)))
+        self.assertIsNone(index.context("c2").segment)
+        self.assertIsNone(index.context("unknown"))
+
+    def test_units(self):
+        index = XbrlIndex.from_root(Document.load(instance).root)
+        self.assertEqual(index.unit("EUR").numerator, ("{http://www.xbrl.org/2003/iso4217}EUR",))
+        self.assertEqual(index.unit("EUR").denominator, ())
+        self.assertEqual(index.unit("EURperShare").denominator, ("{http://www.xbrl.org/2003/instance}shares",))
+
+    def test_from_element_index(self):
+        document = Document.load(instance)
+        index = document.build_index().xbrl
+        self.assertIs(document.index.xbrl, index)
+        self.assertEqual(index.context("c2").identifier, "87654321")
+        self.assertEqual(index.unit("EUR").id, "EUR")
+
+
+class XbrlFunctionTests(unittest.TestCase):
+    def test_functions(self):
+        for build_index in (False, True):
+            document = Document.load(instance)
+            if build_index:
+                document.build_index()
+
+            with self.subTest(build_index=build_index):
+                # Every fact of the sequence gets its identifier
+                self.assertEqual(Parser("xfi:identifier(//ns:Revenue)", no_resolve=True).evaluate(xml=document),
+                                 ["12345678", "87654321"])
+                self.assertEqual(Parser("xfi:identifier(//ns:Name)", no_resolve=True).evaluate(xml=document),
+                                 "87654321")
+                self.assertEqual(Parser("count(xfi:context(//ns:Revenue))", no_resolve=True).evaluate(xml=document),
+                                 2)
+                self.assertEqual(Parser("xfi:unit(//ns:Name)", no_resolve=True).evaluate(xml=document), [])
+                self.assertEqual(Parser("xfi:unit(//ns:Revenue)", no_resolve=True).evaluate(xml=document)[0].get("id"),
+                                 "EUR")
+                self.assertEqual(Parser("count(xfi:segment(//ns:Revenue))", no_resolve=True).evaluate(xml=document),
+                                 1)
+                period = Parser("xfi:period(//ns:Name)", no_resolve=True).evaluate(xml=document)
+                self.assertEqual(period.tag, "{http://www.xbrl.org/2003/instance}period")
+
+    def test_one_index_per_document(self):
+        """
+        Calls per fact share the index of the document, instead of indexing the contexts for every call
+        """
+        document = Document.load(instance)
+        parser = Parser("for $fact in //ns:Revenue return xfi:identifier($fact)", no_resolve=True)
+
+        self.assertEqual(parser.evaluate(xml=document), ["12345678", "87654321"])
+        index = document.xbrl_indexes.index(document.root)
+        self.assertEqual(set(index.contexts), {"c1", "c2"})
+
+        self.assertEqual(parser.evaluate(xml=document), ["12345678", "87654321"])
+        self.assertIs(document.xbrl_indexes.index(document.root), index)
+        self.assertEqual(list(document.xbrl_indexes.indexes), [document.root])
+
+        # Evaluations against a tree keep an index while they run
+        self.assertEqual(parser.evaluate(xml=document.root), ["12345678", "87654321"])
+
+        indexes = XbrlIndexes()
+        self.assertIs(indexes.index(document.root), indexes.index(document.root))
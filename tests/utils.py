@@ -0,0 +1,15 @@
+"""
+Helpers shared by the tests
+"""
+from lxml import etree
+
+
+def serialize(value):
+    """
+    Serialize the elements of an outcome, so outcomes of separate evaluations can be compared
+    """
+    if isinstance(value, list):
+        return [serialize(item) for item in value]
+    if isinstance(value, etree._Element):
+        return etree.tostring(value)
+    return value